@@ -0,0 +1,112 @@
+"""Profile the memory used while reading a large log file.
+
+Lines are consumed slower than they are parsed (``--delay``), like when printing
+them to a slow terminal, so that the results of the workers pile up unless the
+amount of pending tasks is bounded.
+
+The resident memory (RSS) of the main process is sampled every ``--every``
+seconds, along with the amount of bytes of the log file scanned so far::
+
+    $ python benchmarks/memory_profile.py --generate 10 /tmp/10G.log
+    $ python benchmarks/memory_profile.py /tmp/10G.log
+    $ python benchmarks/memory_profile.py /tmp/10G.log --unbounded
+
+``--generate`` writes, before profiling, a log file of that many GB
+out of the lines of ``tests/files/small.log``.
+"""
+from haproxy.engine import ProcessEngine
+from haproxy.logfile import Log
+from haproxy.logfile import Logs
+
+import argparse
+import os
+import threading
+import time
+
+
+SMALL_LOG = os.path.join(
+    os.path.dirname(__file__), os.pardir, 'tests', 'files', 'small.log'
+)
+
+
+def generate(path, size):
+    """Write a log file of, at least, ``size`` bytes."""
+    with open(SMALL_LOG, 'rb') as file_obj:
+        block = file_obj.read() * 1000
+    with open(path, 'wb') as file_obj:
+        written = 0
+        while written < size:
+            file_obj.write(block)
+            written += len(block)
+
+
+def rss():
+    """Return the resident memory of this process, in MB."""
+    with open('/proc/self/statm') as file_obj:
+        pages = int(file_obj.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+
+def sample(logs, every, stop):
+    start = time.monotonic()
+    peak = 0
+    print(f'{"seconds":>8} {"scanned MB":>11} {"RSS MB":>8}')
+    while not stop.wait(every):
+        current = rss()
+        peak = max(peak, current)
+        print(
+            f'{time.monotonic() - start:8.1f} {logs.bytes_scanned / 1e6:11.1f} '
+            f'{current:8.1f}',
+            flush=True,
+        )
+    print(f'peak RSS: {max(peak, rss()):.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log', help='log file to read')
+    parser.add_argument(
+        '--generate', type=float, help='write a log file of this many GB first'
+    )
+    parser.add_argument(
+        '--max-pending', type=int, help='see haproxy_log_analysis --max-pending'
+    )
+    parser.add_argument(
+        '--unbounded',
+        action='store_true',
+        help='do not bound the amount of pending tasks, as Pool.imap does',
+    )
+    parser.add_argument(
+        '--delay',
+        type=float,
+        default=0.5,
+        help='seconds spent by the consumer on every 10000 lines',
+    )
+    parser.add_argument(
+        '--every', type=float, default=5, help='seconds between samples'
+    )
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.log, int(args.generate * 1e9))
+
+    max_pending = args.max_pending
+    if args.unbounded:
+        max_pending = 2**62
+    engine = ProcessEngine(max_pending=max_pending)
+    logs = Logs([Log(logfile=args.log, fields=())], engine=engine)
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample, args=(logs, args.every, stop))
+    sampler.start()
+    try:
+        for index, _ in enumerate(logs, 1):
+            if index % 10000 == 0:
+                time.sleep(args.delay)
+    finally:
+        engine.close()
+        stop.set()
+        sampler.join()
+
+
+if __name__ == '__main__':
+    main()
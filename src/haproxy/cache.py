@@ -0,0 +1,438 @@
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import timedelta
+from haproxy.engine import create_engine
+from haproxy.line import ACCEPT_DATE_FIELDS
+from haproxy.line import ACCEPT_MINUTE_FORMAT
+from haproxy.line import EPOCH
+from haproxy.line import HTTP_REQUEST_FIELDS
+from haproxy.line import Line
+from haproxy.line import parse_accept_date
+from haproxy.line import parse_line
+from haproxy.readers import split_ranges
+from itertools import accumulate
+from itertools import repeat
+
+import json
+import mmap
+import os
+
+
+#: Suffix added to the log file path to get the path of its cache.
+CACHE_SUFFIX = '.hlacache'
+
+#: Bumped whenever the cache format, or how log lines are parsed, changes.
+CACHE_VERSION = 3
+
+#: Size of the ranges of bytes each worker parses when building a cache.
+CACHE_RANGE_SIZE = 16 * 1024 * 1024
+
+#: Line attributes stored as 64 bits integers.
+INTEGER_COLUMNS = (
+    'client_port',
+    'accept_timestamp',
+    'time_wait_request',
+    'time_wait_queues',
+    'time_connect_server',
+    'time_wait_response',
+    'queue_server',
+    'queue_backend',
+)
+
+#: Line attributes stored as indexes on a list of their distinct values.
+STRING_COLUMNS = (
+    'client_ip',
+    'frontend_name',
+    'backend_name',
+    'server_name',
+    'total_time',
+    'status_code',
+    'bytes_read',
+    'connections_active',
+    'connections_frontend',
+    'connections_backend',
+    'connections_server',
+    'retries',
+    'captured_request_headers',
+    'captured_response_headers',
+    'http_request_method',
+    'http_request_path',
+    'http_request_protocol',
+    # only the requests that can not be rebuilt from the other HTTP request
+    # columns, see `_http_request`
+    'raw_http_request',
+    # only the dates that can not be rebuilt from accept_timestamp,
+    # see `_raw_accept_date`
+    'raw_accept_date',
+)
+
+#: Columns needed by the ``ip`` property of lines.
+IP_COLUMNS = ('client_ip', 'captured_request_headers')
+
+#: Columns set on lines when their HTTP request is decoded.
+HTTP_REQUEST_COLUMNS = (
+    'http_request_method',
+    'http_request_path',
+    'http_request_protocol',
+)
+
+#: Columns needed to rebuild the raw HTTP request of lines.
+RAW_HTTP_REQUEST_COLUMNS = (*HTTP_REQUEST_COLUMNS, 'raw_http_request')
+
+#: Columns needed to rebuild the raw accept date of lines.
+RAW_ACCEPT_DATE_COLUMNS = ('accept_timestamp', 'raw_accept_date')
+
+
+class LineCache:
+    """Parsed lines of a log file, stored column by column next to it.
+
+    Numbers are kept as arrays of integers, strings as arrays of indexes
+    on the list of their distinct values, so that reading them back is much
+    cheaper than parsing the log file again.
+    Raw lines are not stored, only where they are on the log file.
+    Neither are ``raw_accept_date`` and ``raw_http_request`` whenever they can be
+    rebuilt from the accept timestamp, or the method, path and protocol.
+
+    Loaded caches are memory mapped, rather than read, so that reading
+    the lines of a range of bytes only reads their rows of the columns needed,
+    see :meth:`lines`.
+
+    A cache is only valid for the size and modification time of the log file
+    it was built from, see :meth:`load`.
+    """
+
+    def __init__(self, logfile, path=None):
+        self.logfile = logfile
+        self.path = path or f'{logfile}{CACHE_SUFFIX}'
+        self.size = 0
+        self.mtime = None
+        # where every line starts and ends (without the newline) on the log file
+        self.starts = array('q')
+        self.ends = array('q')
+        self.valid = array('b')
+        self.integers = {name: array('q') for name in INTEGER_COLUMNS}
+        # name -> (distinct values, array of indexes on them)
+        self.strings = {name: ([], array('I')) for name in STRING_COLUMNS}
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def load(cls, logfile, path=None):
+        """Map the cache of a log file, only its header is read.
+
+        Returns None if there is none, or if it is outdated.
+        """
+        cache = cls(logfile, path)
+        stat = os.stat(logfile)
+        try:
+            with open(cache.path, 'rb') as file_obj:
+                header = json.loads(file_obj.readline())
+                if (
+                    header.get('version') != CACHE_VERSION
+                    or header['size'] != stat.st_size
+                    or header['mtime'] != stat.st_mtime_ns
+                ):
+                    return None
+                offset = file_obj.tell()
+                lengths = [length for _, _, length in header['sections']]
+                if offset + sum(lengths) != os.fstat(file_obj.fileno()).st_size:
+                    return None
+                data = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+            sections = {}
+            view = memoryview(data)
+            for name, typecode, length in header['sections']:
+                sections[name] = view[offset : offset + length].cast(typecode)
+                offset += length
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        cache.starts = sections['starts']
+        cache.ends = sections['ends']
+        cache.valid = sections['valid']
+        for name in INTEGER_COLUMNS:
+            cache.integers[name] = sections[name]
+        for name in STRING_COLUMNS:
+            values = _Values(
+                sections[f'{name}:ends'],
+                sections[f'{name}:values'],
+                header['none_codes'][name],
+            )
+            cache.strings[name] = (values, sections[name])
+        cache.size = header['size']
+        cache.mtime = header['mtime']
+        return cache
+
+    @classmethod
+    def build(cls, logfile, path=None, engine=None):
+        """Parse the whole log file and store its lines on a new cache.
+
+        Ranges of the log file are parsed by the engine, see :mod:`haproxy.engine`,
+        by default the one best suited for its size, closed afterwards.
+        """
+        cache = cls(logfile, path)
+        stat = os.stat(logfile)
+        parts = max(1, stat.st_size // CACHE_RANGE_SIZE)
+        tasks = [(logfile, *byte_range) for byte_range in split_ranges(logfile, parts)]
+        with _engine(engine, stat.st_size) as engine:
+            for columns in engine.imap(_encode_range, tasks):
+                cache._extend(columns)
+
+        cache.size = stat.st_size
+        cache.mtime = stat.st_mtime_ns
+        return cache
+
+    def save(self):
+        """Write the cache, every column with the smallest type its values fit in.
+
+        The distinct values of every string column are written one after
+        the other, along with where each of them ends.
+        """
+        sections = {
+            'starts': _narrow(self.starts),
+            'ends': _narrow(self.ends),
+            'valid': _narrow(self.valid),
+        }
+        for name in INTEGER_COLUMNS:
+            sections[name] = _narrow(self.integers[name])
+        none_codes = {}
+        for name in STRING_COLUMNS:
+            values, codes = self.strings[name]
+            none_codes[name] = values.index(None) if None in values else None
+            encoded = [(value or '').encode() for value in values]
+            ends = array('q', accumulate(map(len, encoded)))
+            sections[name] = _narrow(codes)
+            sections[f'{name}:ends'] = _narrow(ends)
+            sections[f'{name}:values'] = array('B', b''.join(encoded))
+        header = {
+            'version': CACHE_VERSION,
+            'size': self.size,
+            'mtime': self.mtime,
+            'sections': [
+                [name, column.typecode, len(column) * column.itemsize]
+                for name, column in sections.items()
+            ],
+            'none_codes': none_codes,
+        }
+        with open(self.path, 'wb') as file_obj:
+            file_obj.write(json.dumps(header).encode())
+            file_obj.write(b'\n')
+            for column in sections.values():
+                column.tofile(file_obj)
+
+    def lines(self, fields=None, range_start=0, range_end=None):
+        """Yield the lines starting within the given range of bytes.
+
+        As with :class:`haproxy.line.Line`, ``fields`` restricts the attributes
+        set on them to the ones given, by default all of them.
+        """
+        first = bisect_left(self.starts, range_start)
+        last = len(self)
+        if range_end is not None:
+            last = bisect_left(self.starts, range_end, first)
+
+        names = _columns(fields)
+        columns = []
+        for name in names:
+            if name in self.integers:
+                columns.append(self.integers[name][first:last])
+            else:
+                values, codes = self.strings[name]
+                codes = codes[first:last]
+                # only the values on the range are decoded, once
+                values = {code: values[code] for code in set(codes)}
+                columns.append([values[code] for code in codes])
+        if fields is None or not ACCEPT_DATE_FIELDS.isdisjoint(fields):
+            names.append('accept_date')
+            columns.append(
+                [
+                    EPOCH + timedelta(milliseconds=timestamp)
+                    for timestamp in self.integers['accept_timestamp'][first:last]
+                ]
+            )
+        with_raw_line = fields is None or 'raw_line' in fields
+        with_http_request = 'raw_http_request' in names
+        with_accept_date = 'accept_date' in names
+        with_raw_accept_date = fields is None or 'raw_accept_date' in fields
+        # raw accept dates of the minutes already seen, see `_raw_accept_date`
+        minutes = {}
+        rows = zip(*columns) if columns else repeat((), last - first)
+        if first >= last:
+            return
+
+        new_line = Line.__new__
+        with open(self.logfile, 'rb') as file_obj, mmap.mmap(
+            file_obj.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            for index, values in enumerate(rows, first):
+                line = new_line(Line)
+                line.is_valid = bool(self.valid[index])
+                if line.is_valid:
+                    for name, value in zip(names, values):
+                        setattr(line, name, value)
+                    if with_http_request and line.raw_http_request is None:
+                        line.raw_http_request = _http_request(line)
+                    # only stored if it can not be rebuilt
+                    raw_accept_date = line.raw_accept_date
+                    if raw_accept_date is not None and with_accept_date:
+                        # more precise than the accept timestamp
+                        line.accept_date = parse_accept_date(raw_accept_date)[0]
+                    elif raw_accept_date is None and with_raw_accept_date:
+                        line.raw_accept_date = _raw_accept_date(
+                            line.accept_timestamp, minutes
+                        )
+                if with_raw_line or not line.is_valid:
+                    raw_line = data[self.starts[index] : self.ends[index]]
+                    line.raw_line = raw_line.decode(errors='replace').strip()
+                yield line
+
+    def _extend(self, columns):
+        """Append the columns encoded by :func:`_encode_range` to the cache."""
+        starts, ends, valid, integers, strings = columns
+        self.starts.extend(starts)
+        self.ends.extend(ends)
+        self.valid.extend(valid)
+        for name in INTEGER_COLUMNS:
+            self.integers[name].extend(integers[name])
+        for name in STRING_COLUMNS:
+            values, codes = self.strings[name]
+            lookup = {value: code for code, value in enumerate(values)}
+            range_values, range_codes = strings[name]
+            mapping = []
+            for value in range_values:
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(values)
+                    values.append(value)
+                mapping.append(code)
+            codes.extend(mapping[code] for code in range_codes)
+
+
+@contextmanager
+def _engine(engine, size):
+    """Provide the given engine, or create one for the size of the log file."""
+    if engine is not None:
+        yield engine
+        return
+    with create_engine(size=size) as engine:
+        yield engine
+
+
+def _columns(fields):
+    """Return the names of the cached columns needed to provide ``fields``."""
+    if fields is None:
+        return list(INTEGER_COLUMNS + STRING_COLUMNS)
+    names = {
+        field for field in fields if field in INTEGER_COLUMNS or field in STRING_COLUMNS
+    }
+    if not ACCEPT_DATE_FIELDS.isdisjoint(fields):
+        names.update(RAW_ACCEPT_DATE_COLUMNS)
+    if not HTTP_REQUEST_FIELDS.isdisjoint(fields):
+        names.update(HTTP_REQUEST_COLUMNS)
+    if 'raw_http_request' in fields:
+        names.update(RAW_HTTP_REQUEST_COLUMNS)
+    if 'raw_accept_date' in fields:
+        names.update(RAW_ACCEPT_DATE_COLUMNS)
+    if 'ip' in fields:
+        names.update(IP_COLUMNS)
+    return sorted(names)
+
+
+def _http_request(line):
+    """Rebuild the raw HTTP request of a line out of its method, path and protocol."""
+    parts = (
+        line.http_request_method,
+        line.http_request_path,
+        line.http_request_protocol,
+    )
+    return ' '.join(part for part in parts if part is not None)
+
+
+def _raw_accept_date(timestamp, minutes):
+    """Rebuild the raw accept date of a line out of its accept timestamp.
+
+    The text of every minute is kept on ``minutes``, as consecutive lines
+    share (almost always) the same one.
+    """
+    minute, milliseconds = divmod(timestamp, 60000)
+    prefix = minutes.get(minute)
+    if prefix is None:
+        accept_minute = EPOCH + timedelta(minutes=minute)
+        prefix = minutes[minute] = accept_minute.strftime(ACCEPT_MINUTE_FORMAT)
+    return f'{prefix}:{milliseconds // 1000:02d}.{milliseconds % 1000:03d}'
+
+
+class _Values:
+    """Distinct values of a string column of a loaded cache, see :meth:`LineCache.save`.
+
+    Values are only decoded when looked up by their index.
+    """
+
+    def __init__(self, ends, data, none_code):
+        self.ends = ends
+        self.data = data
+        self.none_code = none_code
+
+    def __getitem__(self, code):
+        if code == self.none_code:
+            return None
+        start = self.ends[code - 1] if code else 0
+        return str(self.data[start : self.ends[code]], 'utf-8')
+
+
+def _narrow(column):
+    """Return the column with the smallest array type that holds its values."""
+    if not column:
+        return column
+    lowest = min(column)
+    highest = max(column)
+    typecodes = 'bhiq' if lowest < 0 else 'BHIQ'
+    for typecode in typecodes:
+        narrow = array(typecode)
+        bits = narrow.itemsize * 8 - (typecode in 'bhiq')
+        if -(2**bits) <= lowest and highest < 2**bits:
+            narrow.fromlist(column.tolist())
+            return narrow
+    return column
+
+
+# it is not coverage covered as this is executed by the multiprocessor module
+def _encode_range(task):  # pragma: no cover
+    """Parse the lines found on the given range of bytes, column by column."""
+    logfile, range_start, range_end = task
+    starts = array('q')
+    ends = array('q')
+    valid = array('b')
+    integers = {name: array('q') for name in INTEGER_COLUMNS}
+    lookups = {name: {} for name in STRING_COLUMNS}
+    codes = {name: array('I') for name in STRING_COLUMNS}
+    minutes = {}
+    position = range_start
+    with open(logfile, 'rb') as file_obj, mmap.mmap(
+        file_obj.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        while position < range_end:
+            newline = data.find(b'\n', position, range_end)
+            if newline == -1:
+                newline = range_end
+            line = parse_line(data[position:newline].decode(errors='replace'))
+            if line.is_valid and line.raw_http_request == _http_request(line):
+                # rebuilt when read, so that near unique requests are not stored
+                line.raw_http_request = None
+            if line.is_valid and line.raw_accept_date == _raw_accept_date(
+                line.accept_timestamp, minutes
+            ):
+                # rebuilt when read as well
+                line.raw_accept_date = None
+            starts.append(position)
+            ends.append(newline)
+            valid.append(line.is_valid)
+            for name in INTEGER_COLUMNS:
+                integers[name].append(getattr(line, name) or 0)
+            for name in STRING_COLUMNS:
+                lookup = lookups[name]
+                codes[name].append(lookup.setdefault(getattr(line, name), len(lookup)))
+            position = newline + 1
+    strings = {name: (list(lookups[name]), codes[name]) for name in STRING_COLUMNS}
+    return starts, ends, valid, integers, strings
@@ -1,12 +1,99 @@
 from collections import defaultdict
 from collections import OrderedDict
 from datetime import datetime
+from datetime import timedelta
+from haproxy.line import EPOCH
+from haproxy.sketches import Histogram
+from haproxy.sketches import HyperLogLog
+from haproxy.sketches import SpaceSaving
+from operator import attrgetter
 
 import json
 import time
 
 
+def _minute(line):
+    return line.accept_timestamp // 60000 * 60
+
+
+def _hour(line):
+    return line.accept_timestamp // 3600000 * 3600
+
+
+def _status_family(line):
+    return f'{line.status_code[0]}xx'
+
+
+#: Keys that lines can be grouped by, besides their attributes, see ``--group-by``.
+#: Values are the Line attributes they read and the function returning the key.
+#: Time keys are the start of the minute or hour, in seconds since the epoch.
+GROUP_KEYS = {
+    'minute': (('accept_timestamp',), _minute),
+    'hour': (('accept_timestamp',), _hour),
+    'status_family': (('status_code',), _status_family),
+}
+
+#: Line attributes that lines can not be grouped by, nor counted, as their values
+#: can not be output as JSON, nor saved, see ``--distinct`` and ``--group-by``.
+#: ``minute`` or ``hour`` group lines by their accept date instead.
+UNGROUPABLE_ATTRIBUTES = frozenset(('accept_date',))
+
+
+class GroupMixin:
+    """Results per group of lines sharing the same values on ``group_by`` keys.
+
+    Keys are either Line attributes or :data:`GROUP_KEYS`.
+    """
+
+    def _set_group_by(self, group_by):
+        self.group_by = tuple(group_by)
+        self._key_funcs = []
+        fields = []
+        for key in self.group_by:
+            if key in GROUP_KEYS:
+                key_fields, key_func = GROUP_KEYS[key]
+            else:
+                key_fields, key_func = (key,), attrgetter(key)
+            fields.extend(key_fields)
+            self._key_funcs.append(key_func)
+        return tuple(fields)
+
+    def _group_key(self, line):
+        return tuple(key_func(line) for key_func in self._key_funcs)
+
+    def _sorted_groups(self, groups):
+        """Return the (key, value) items of ``groups`` sorted by their key."""
+        return sorted(
+            groups.items(), key=lambda item: [(part is None, part) for part in item[0]]
+        )
+
+    def _group_data(self, group):
+        """Return the values of a group key by their name, dates as text."""
+        data = {}
+        for name, part in zip(self.group_by, group):
+            if name in ('minute', 'hour'):
+                part = (EPOCH + timedelta(seconds=part)).isoformat()
+            data[name] = part
+        return data
+
+
 class BaseCommandMixin:
+    #: Line attributes the command reads, None means all of them.
+    fields = None
+
+    #: Whether the command needs the lines in time order when reading many
+    #: log files, see :class:`haproxy.logfile.Logs`.
+    ordered = False
+
+    @classmethod
+    def from_arguments(cls, args):
+        """Create the command as configured by the command line arguments."""
+        return cls()
+
+    def empty(self):
+        """Return a command, configured as this one, without any result."""
+        return type(self)()
+
     @classmethod
     def command_line_name(cls):
         """Convert class name to lowercase with underscores.
@@ -24,17 +111,47 @@ class BaseCommandMixin:
     def raw_results(self):  # pragma: no cover
         raise NotImplementedError
 
+    def merge(self, other):  # pragma: no cover
+        """Add the partial results of another instance of the same command.
+
+        Both instances must have processed different log lines,
+        and ``other`` the ones that came after the ones of this instance.
+        """
+        raise NotImplementedError
+
+    def to_state(self):  # pragma: no cover
+        """Return the partial results as JSON serializable data.
+
+        See :meth:`from_state` to create a command out of it again.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def from_state(cls, state):  # pragma: no cover
+        """Create a command with the partial results returned by :meth:`to_state`."""
+        raise NotImplementedError
+
     def json_data(self):
         return self.raw_results()
 
+    def json_errors(self):
+        """Return the error bounds of approximate results, None if they are exact.
+
+        They are output next to the results, as ``<COMMAND_NAME>_ERRORS``.
+        """
+        return None
+
     def print_data(self):
         return self.raw_results()
 
     def results(self, output=None):
         command_name = self.command_line_name().upper()
         if output == 'json':
-            results = self.json_data()
-            print(json.dumps({command_name: results}))
+            results = {command_name: self.json_data()}
+            errors = self.json_errors()
+            if errors:
+                results[f'{command_name}_ERRORS'] = errors
+            print(json.dumps(results))
         else:
             results = self.print_data()
             underline = '=' * len(command_name)
@@ -50,6 +167,19 @@ class AttributeCounterMixin:
     def __call__(self, line):
         self.stats[getattr(line, self.attribute_name)] += 1
 
+    def merge(self, other):
+        for key, value in other.stats.items():
+            self.stats[key] += value
+
+    def to_state(self):
+        return list(self.stats.items())
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls()
+        cmd.stats.update(state)
+        return cmd
+
     def raw_results(self):
         return self.stats
 
@@ -73,33 +203,128 @@ class AttributeCounterMixin:
         return result
 
 
-class SortTrimMixin:
-    @staticmethod
-    def _sort_and_trim(data, reverse=False):
-        """Sorts a dictionary with at least two fields on each of them sorting
-        by the second element.
+class AverageMixin:
+    """Average of a Line attribute, ignoring negative values (aborted requests).
 
-        .. warning::
-          Right now is hardcoded to 10 elements, improve the command line
-          interface to allow to send parameters to each command or globally.
-        """
-        threshold = 10
-        data_list = data.items()
-        data_list = sorted(
-            data_list, key=lambda data_info: data_info[1], reverse=reverse
-        )
-        return data_list[:threshold]
+    Only the sum and count of the values are kept.
+    """
+
+    attribute_name = None
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def __call__(self, line):
+        value = getattr(line, self.attribute_name)
+        if value >= 0:
+            self.total += value
+            self.count += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+
+    def to_state(self):
+        return [self.total, self.count]
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls()
+        cmd.total, cmd.count = state
+        return cmd
+
+    def raw_results(self):
+        if self.count > 0:
+            return round(self.total / self.count, 2)
+        return 0.0
+
+
+class TopMixin:
+    """The ``top`` most frequent values of a Line attribute, and their counts.
+
+    Only the counts of the ``capacity`` most frequent values are kept,
+    see :class:`haproxy.sketches.SpaceSaving`, so counts may be overestimated,
+    at most by the error shown next to them. A capacity of None counts all
+    values exactly, see ``--top`` and ``--top-capacity``.
+    """
+
+    attribute_name = None
+
+    def __init__(self, top=10, capacity=10000):
+        self.top = top
+        self.summary = SpaceSaving(capacity)
+
+    @classmethod
+    def from_arguments(cls, args):
+        cmd = cls()
+        if args['top'] is not None:
+            cmd.top = args['top']
+        if args['top_capacity'] is not None:
+            cmd.summary = SpaceSaving(args['top_capacity'] or None)
+        return cmd
+
+    def empty(self):
+        return type(self)(self.top, self.summary.capacity)
+
+    def __call__(self, line):
+        self.summary.add(getattr(line, self.attribute_name))
+
+    def merge(self, other):
+        self.summary.merge(other.summary)
+
+    def to_state(self):
+        return {'top': self.top, 'summary': self.summary.to_state()}
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls(state['top'])
+        cmd.summary = SpaceSaving.from_state(state['summary'])
+        return cmd
+
+    def raw_results(self):
+        return [(value, count) for value, count, _ in self.summary.top(self.top)]
+
+    def print_data(self):
+        result = ''
+        for value, count, error in self.summary.top(self.top):
+            result += f'- {value}: {count}'
+            if error:
+                result += f' (overestimated by up to {error})'
+            result += '\n'
+        return result
+
+    def json_data(self):
+        return [{value: count} for value, count, _ in self.summary.top(self.top)]
+
+    def json_errors(self):
+        """Return how much the counts shown may be overestimated by, if any."""
+        return {value: error for value, _, error in self.summary.top(self.top) if error}
 
 
 class Counter(BaseCommandMixin):
     """Count valid lines."""
 
+    fields = ()
+
     def __init__(self):
         self.counter = 0
 
     def __call__(self, line):
         self.counter += 1
 
+    def merge(self, other):
+        self.counter += other.counter
+
+    def to_state(self):
+        return self.counter
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls()
+        cmd.counter = state
+        return cmd
+
     def raw_results(self):
         return self.counter
 
@@ -108,6 +333,7 @@ class HttpMethods(AttributeCounterMixin, BaseCommandMixin):
     """Tally all requests per HTTP method (GET/POST...)."""
 
     attribute_name = 'http_request_method'
+    fields = (attribute_name,)
 
 
 class IpCounter(AttributeCounterMixin, BaseCommandMixin):
@@ -118,38 +344,48 @@ class IpCounter(AttributeCounterMixin, BaseCommandMixin):
     """
 
     attribute_name = 'ip'
+    fields = (attribute_name,)
 
 
-class TopIps(IpCounter, SortTrimMixin):
-    """Return the top most frequent IPs (10 items)."""
+class TopIps(TopMixin, BaseCommandMixin):
+    """Return the top most frequent IPs (10 items).
 
-    def raw_results(self):
-        return self._sort_and_trim(self.stats, reverse=True)
+    See ``--top`` and ``--top-capacity`` about counts being exact or not.
+    """
+
+    attribute_name = 'ip'
+    fields = (attribute_name,)
 
 
 class StatusCodesCounter(AttributeCounterMixin, BaseCommandMixin):
     """Tally requests per HTTP status (404, 500...)"""
 
     attribute_name = 'status_code'
+    fields = (attribute_name,)
 
 
 class RequestPathCounter(AttributeCounterMixin, BaseCommandMixin):
     """Tally requests per the request's path."""
 
     attribute_name = 'http_request_path'
+    fields = (attribute_name,)
 
 
-class TopRequestPaths(RequestPathCounter, SortTrimMixin):
-    """Returns the top most frequent paths (10 items)."""
+class TopRequestPaths(TopMixin, BaseCommandMixin):
+    """Returns the top most frequent paths (10 items).
 
-    def raw_results(self):
-        return self._sort_and_trim(self.stats, reverse=True)
+    See ``--top`` and ``--top-capacity`` about counts being exact or not.
+    """
+
+    attribute_name = 'http_request_path'
+    fields = (attribute_name,)
 
 
 class SlowRequests(BaseCommandMixin):
     """List all requests that are considered slow to process (1 second)."""
 
     threshold = 1000
+    fields = ('time_wait_response',)
 
     def __init__(self):
         self.slow_requests = []
@@ -159,6 +395,18 @@ class SlowRequests(BaseCommandMixin):
         if response_time >= self.threshold:
             self.slow_requests.append(response_time)
 
+    def merge(self, other):
+        self.slow_requests.extend(other.slow_requests)
+
+    def to_state(self):
+        return list(self.slow_requests)
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls()
+        cmd.slow_requests.extend(state)
+        return cmd
+
     def raw_results(self):
         return sorted(self.slow_requests)
 
@@ -170,42 +418,416 @@ class SlowRequestsCounter(SlowRequests):
         return len(self.slow_requests)
 
 
-class AverageResponseTime(SlowRequests):
+class AverageResponseTime(AverageMixin, BaseCommandMixin):
     """Global average response time it took downstream servers to answer requests."""
 
-    threshold = 0
+    attribute_name = 'time_wait_response'
+    fields = (attribute_name,)
+
+
+class AverageWaitingTime(AverageMixin, BaseCommandMixin):
+    """Return the average time valid requests wait on HAProxy before being dispatched to a backend server."""
+
+    attribute_name = 'time_wait_queues'
+    fields = (attribute_name,)
+
+
+class ResponseTimePercentiles(BaseCommandMixin):
+    """Report percentiles (p50, p90, p95, p99, p999) of the response times.
+
+    They are within 1% of the real ones, as response times are counted
+    on a fixed size histogram rather than kept, see
+    :class:`haproxy.sketches.Histogram`. Aborted requests are ignored.
+    """
+
+    attribute_name = 'time_wait_response'
+    fields = (attribute_name,)
+
+    #: Percentiles reported, by their name.
+    percentiles = {'p50': 50, 'p90': 90, 'p95': 95, 'p99': 99, 'p999': 99.9}
+
+    def __init__(self):
+        self.histogram = Histogram()
+
+    def __call__(self, line):
+        value = getattr(line, self.attribute_name)
+        if value >= 0:
+            self.histogram.add(value)
+
+    def merge(self, other):
+        self.histogram.merge(other.histogram)
+
+    def to_state(self):
+        return self.histogram.to_state()
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls()
+        cmd.histogram = Histogram.from_state(state)
+        return cmd
 
     def raw_results(self):
-        total_requests = float(len(self.slow_requests))
-        if total_requests > 0:
-            average = sum(self.slow_requests) / total_requests
-            return round(average, 2)
-        return 0.0
+        return {
+            name: self.histogram.percentile(percent)
+            for name, percent in self.percentiles.items()
+        }
 
+    def print_data(self):
+        data = ''
+        for name, value in self.raw_results().items():
+            data += f'- {name}: {value}\n'
+        return data
 
-class AverageWaitingTime(BaseCommandMixin):
-    """Return the average time valid requests wait on HAProxy before being dispatched to a backend server."""
+
+class ServerTimers(BaseCommandMixin):
+    """Report percentiles of the five timers of the requests per backend and server.
+
+    Time waiting for the request (Tq), on queues (Tw), to connect (Tc),
+    for the response (Tr) and in total (Tt), to tell where slow requests
+    spend their time. Timers are counted on fixed size histograms,
+    see :class:`haproxy.sketches.Histogram`. Aborted requests are ignored.
+    """
+
+    timers = (
+        'time_wait_request',
+        'time_wait_queues',
+        'time_connect_server',
+        'time_wait_response',
+        'total_time',
+    )
+    fields = ('backend_name', 'server_name', *timers)
+
+    #: Percentiles reported for every timer, by their name.
+    percentiles = {'p50': 50, 'p95': 95, 'p99': 99}
 
     def __init__(self):
-        self.waiting_times = []
+        self.servers = {}
+
+    def _histograms(self, key):
+        histograms = self.servers.get(key)
+        if histograms is None:
+            histograms = self.servers[key] = {
+                timer: Histogram() for timer in self.timers
+            }
+        return histograms
 
     def __call__(self, line):
-        waiting_time = line.time_wait_queues
-        if waiting_time >= 0:
-            self.waiting_times.append(waiting_time)
+        histograms = self._histograms((line.backend_name, line.server_name))
+        for timer in self.timers:
+            # the total time may start with a +, see HAProxy's option logasap
+            value = int(getattr(line, timer))
+            if value >= 0:
+                histograms[timer].add(value)
+
+    def merge(self, other):
+        for key, other_histograms in other.servers.items():
+            histograms = self._histograms(key)
+            for timer, histogram in other_histograms.items():
+                histograms[timer].merge(histogram)
+
+    def to_state(self):
+        state = []
+        for (backend, server), histograms in self.servers.items():
+            histograms = {
+                timer: histogram.to_state() for timer, histogram in histograms.items()
+            }
+            state.append([backend, server, histograms])
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls()
+        for backend, server, histograms in state:
+            cmd.servers[(backend, server)] = {
+                timer: Histogram.from_state(histogram)
+                for timer, histogram in histograms.items()
+            }
+        return cmd
 
     def raw_results(self):
-        total_requests = float(len(self.waiting_times))
-        if total_requests > 0:
-            average = sum(self.waiting_times) / total_requests
-            return round(average, 2)
-        return 0.0
+        results = {}
+        for backend, server in sorted(self.servers):
+            histograms = self.servers[(backend, server)]
+            server_results = {}
+            for timer, histogram in histograms.items():
+                server_results[timer] = {'count': histogram.count}
+                for name, percent in self.percentiles.items():
+                    server_results[timer][name] = histogram.percentile(percent)
+                server_results[timer]['max'] = histogram.max
+            results[f'{backend}/{server}'] = server_results
+        return results
+
+    def print_data(self):
+        data = ''
+        for server, server_results in self.raw_results().items():
+            data += f'- {server}\n'
+            for timer, timer_results in server_results.items():
+                values = ' '.join(
+                    f'{name}: {value}' for name, value in timer_results.items()
+                )
+                data += f'  - {timer}: {values}\n'
+        return data
+
+
+class DistinctCount(GroupMixin, BaseCommandMixin):
+    """Estimate the amount of distinct IPs, or other ``--distinct`` Line attribute.
+
+    Optionally per group of lines, see ``--group-by``, e.g. unique IPs per minute
+    with ``--group-by minute``. Every estimate takes 4 KB, and its standard
+    error is 1.6%, see :class:`haproxy.sketches.HyperLogLog`.
+    """
+
+    fields = ('ip',)
+
+    def __init__(self, distinct='ip', group_by=()):
+        self.distinct = distinct
+        self.fields = (distinct, *self._set_group_by(group_by))
+        self.groups = {}
+
+    @classmethod
+    def from_arguments(cls, args):
+        return cls(args['distinct'] or 'ip', args['group_by'] or ())
+
+    def empty(self):
+        return type(self)(self.distinct, self.group_by)
+
+    def __call__(self, line):
+        key = self._group_key(line)
+        estimate = self.groups.get(key)
+        if estimate is None:
+            estimate = self.groups[key] = HyperLogLog()
+        estimate.add(getattr(line, self.distinct))
+
+    def merge(self, other):
+        for key, other_estimate in other.groups.items():
+            estimate = self.groups.get(key)
+            if estimate is None:
+                estimate = self.groups[key] = HyperLogLog()
+            estimate.merge(other_estimate)
+
+    def to_state(self):
+        return {
+            'distinct': self.distinct,
+            'group_by': list(self.group_by),
+            'groups': [
+                [list(key), estimate.to_state()]
+                for key, estimate in self.groups.items()
+            ],
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls(state['distinct'], state['group_by'])
+        for key, estimate in state['groups']:
+            cmd.groups[tuple(key)] = HyperLogLog.from_state(estimate)
+        return cmd
+
+    def raw_results(self):
+        """Return the estimate, or (group key, estimate) tuples when grouping."""
+        if not self.group_by:
+            estimate = self.groups.get(())
+            return estimate.count() if estimate is not None else 0
+        return [
+            (key, estimate.count())
+            for key, estimate in self._sorted_groups(self.groups)
+        ]
+
+    def print_data(self):
+        if not self.group_by:
+            return self.raw_results()
+        data = ''
+        for key, count in self.raw_results():
+            group = ' '.join(
+                f'{name}={part}' for name, part in self._group_data(key).items()
+            )
+            data += f'- {group}: {count}\n'
+        return data
+
+    def json_data(self):
+        if not self.group_by:
+            return self.raw_results()
+        return [
+            {**self._group_data(key), 'distinct': count}
+            for key, count in self.raw_results()
+        ]
+
+
+class GroupBy(GroupMixin, BaseCommandMixin):
+    """Aggregate the lines per group, in a single pass, see ``--group-by``.
+
+    Aggregates, see ``--aggregate``, are the count of lines, and the sum,
+    minimum, maximum or histogram (see :class:`haproxy.sketches.Histogram`)
+    of a numeric Line attribute, e.g. ``sum[bytes_read]``. Negative values,
+    i.e. timers of aborted requests, are ignored.
+    """
+
+    fields = ()
+
+    #: Aggregates of the values of a Line attribute, besides ``count``.
+    aggregate_names = ('sum', 'min', 'max', 'histogram')
+
+    #: Line attributes that can be aggregated.
+    numeric_attributes = (
+        'client_port',
+        'time_wait_request',
+        'time_wait_queues',
+        'time_connect_server',
+        'time_wait_response',
+        'total_time',
+        'bytes_read',
+        'connections_active',
+        'connections_frontend',
+        'connections_backend',
+        'connections_server',
+        'retries',
+        'queue_server',
+        'queue_backend',
+    )
+
+    #: Percentiles reported for histograms, by their name.
+    percentiles = {'p50': 50, 'p95': 95, 'p99': 99}
+
+    def __init__(self, aggregates=(('count', None),), group_by=()):
+        self.aggregates = tuple(tuple(aggregate) for aggregate in aggregates)
+        attributes = tuple(
+            attribute for _, attribute in self.aggregates if attribute is not None
+        )
+        self.fields = (*self._set_group_by(group_by), *attributes)
+        self.groups = {}
+
+    @classmethod
+    def from_arguments(cls, args):
+        return cls(args['aggregates'] or (('count', None),), args['group_by'] or ())
+
+    def empty(self):
+        return type(self)(self.aggregates, self.group_by)
+
+    def _new_values(self):
+        values = []
+        for name, _ in self.aggregates:
+            if name == 'histogram':
+                values.append(Histogram())
+            elif name in ('min', 'max'):
+                values.append(None)
+            else:
+                values.append(0)
+        return values
+
+    def __call__(self, line):
+        key = self._group_key(line)
+        values = self.groups.get(key)
+        if values is None:
+            values = self.groups[key] = self._new_values()
+        for index, (name, attribute) in enumerate(self.aggregates):
+            if name == 'count':
+                values[index] += 1
+                continue
+            # some attributes are kept as text, e.g. +123 for total_time
+            value = int(getattr(line, attribute))
+            if value < 0:
+                continue
+            if name == 'sum':
+                values[index] += value
+            elif name == 'histogram':
+                values[index].add(value)
+            else:
+                values[index] = self._min_max(name, values[index], value)
+
+    @staticmethod
+    def _min_max(name, current, value):
+        if current is None:
+            return value
+        if value is None:
+            return current
+        return min(current, value) if name == 'min' else max(current, value)
+
+    def merge(self, other):
+        for key, other_values in other.groups.items():
+            values = self.groups.get(key)
+            if values is None:
+                values = self.groups[key] = self._new_values()
+            for index, (name, _) in enumerate(self.aggregates):
+                if name in ('count', 'sum'):
+                    values[index] += other_values[index]
+                elif name == 'histogram':
+                    values[index].merge(other_values[index])
+                else:
+                    values[index] = self._min_max(
+                        name, values[index], other_values[index]
+                    )
+
+    def to_state(self):
+        groups = []
+        for key, values in self.groups.items():
+            values = [
+                value.to_state() if isinstance(value, Histogram) else value
+                for value in values
+            ]
+            groups.append([list(key), values])
+        return {
+            'aggregates': [list(aggregate) for aggregate in self.aggregates],
+            'group_by': list(self.group_by),
+            'groups': groups,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls(state['aggregates'], state['group_by'])
+        for key, values in state['groups']:
+            cmd.groups[tuple(key)] = [
+                Histogram.from_state(value) if name == 'histogram' else value
+                for (name, _), value in zip(cmd.aggregates, values)
+            ]
+        return cmd
+
+    def _aggregate_name(self, name, attribute):
+        if attribute is None:
+            return name
+        return f'{name}[{attribute}]'
+
+    def raw_results(self):
+        """Return (group key, {aggregate: result}) tuples sorted by group key."""
+        results = []
+        for key, values in self._sorted_groups(self.groups):
+            group_results = {}
+            for (name, attribute), value in zip(self.aggregates, values):
+                if name == 'histogram':
+                    histogram = value
+                    value = {'count': histogram.count}
+                    for percentile, percent in self.percentiles.items():
+                        value[percentile] = histogram.percentile(percent)
+                    value['max'] = histogram.max
+                group_results[self._aggregate_name(name, attribute)] = value
+            results.append((key, group_results))
+        return results
+
+    def print_data(self):
+        data = ''
+        for key, group_results in self.raw_results():
+            parts = [f'{name}={part}' for name, part in self._group_data(key).items()]
+            for name, value in group_results.items():
+                if isinstance(value, dict):
+                    value = ', '.join(
+                        f'{label}: {part}' for label, part in value.items()
+                    )
+                    value = f'({value})'
+                parts.append(f'{name}={value}')
+            line = ' '.join(parts)
+            data += f'- {line}\n'
+        return data
+
+    def json_data(self):
+        return [
+            {**self._group_data(key), **group_results}
+            for key, group_results in self.raw_results()
+        ]
 
 
 class ServerLoad(AttributeCounterMixin, BaseCommandMixin):
     """Tally requests per downstream server."""
 
     attribute_name = 'server_name'
+    fields = (attribute_name,)
 
 
 class QueuePeaks(BaseCommandMixin):
@@ -218,6 +840,9 @@ class QueuePeaks(BaseCommandMixin):
     on a series of log lines that are between log lines with the queue empty.
     """
 
+    fields = ('accept_date', 'queue_backend')
+    ordered = True
+
     def __init__(self):
         self.requests = {}
         self.threshold = 1
@@ -240,6 +865,22 @@ class QueuePeaks(BaseCommandMixin):
         key = self._generate_key(line.accept_date)
         self.requests[key] = (line.queue_backend, line.accept_date)
 
+    def merge(self, other):
+        self.requests.update(other.requests)
+
+    def to_state(self):
+        return [
+            [key, queue, accept_date.isoformat()]
+            for key, (queue, accept_date) in self.requests.items()
+        ]
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls()
+        for key, queue, accept_date in state:
+            cmd.requests[key] = (queue, datetime.fromisoformat(accept_date))
+        return cmd
+
     def raw_results(self):
         sorted_requests = OrderedDict(sorted(self.requests.items()))
         peaks = []
@@ -313,6 +954,8 @@ class ConnectionType(BaseCommandMixin):
     This only works if the request path contains the default port for SSL (443).
     """
 
+    fields = ('is_https',)
+
     def __init__(self):
         self.https = 0
         self.non_https = 0
@@ -323,6 +966,19 @@ class ConnectionType(BaseCommandMixin):
         else:
             self.non_https += 1
 
+    def merge(self, other):
+        self.https += other.https
+        self.non_https += other.non_https
+
+    def to_state(self):
+        return [self.https, self.non_https]
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls()
+        cmd.https, cmd.non_https = state
+        return cmd
+
     def raw_results(self):
         return self.https, self.non_https
 
@@ -341,18 +997,36 @@ class RequestsPerMinute(BaseCommandMixin):
     Combine it with time constrains (`-s` and `-d`) otherwise the output will be long.
     """
 
+    fields = ('accept_timestamp',)
+
+    #: Size of the time buckets, in milliseconds.
+    bucket_size = 60 * 1000
+
     def __init__(self):
         self.requests = defaultdict(int)
 
-    def generate_key(self, accept_date):
-        date_with_minute_precision = accept_date.replace(second=0, microsecond=0)
-        unixtime = time.mktime(date_with_minute_precision.timetuple())
-        return unixtime
+    def generate_key(self, accept_timestamp):
+        """Return the start of the bucket, in seconds since the epoch."""
+        bucket = accept_timestamp // self.bucket_size
+        return bucket * self.bucket_size // 1000
 
     def __call__(self, line):
-        key = self.generate_key(line.accept_date)
+        key = self.generate_key(line.accept_timestamp)
         self.requests[key] += 1
 
+    def merge(self, other):
+        for key, value in other.requests.items():
+            self.requests[key] += value
+
+    def to_state(self):
+        return list(self.requests.items())
+
+    @classmethod
+    def from_state(cls, state):
+        cmd = cls()
+        cmd.requests.update(state)
+        return cmd
+
     def raw_results(self):
         """Return the list of requests sorted by the timestamp."""
         data = sorted(self.requests.items(), key=lambda data_info: data_info[0])
@@ -361,14 +1035,14 @@ class RequestsPerMinute(BaseCommandMixin):
     def print_data(self):
         data = ''
         for date_info, count in self.raw_results():
-            date = datetime.fromtimestamp(date_info).isoformat()
+            date = (EPOCH + timedelta(seconds=date_info)).isoformat()
             data += f'- {date}: {count}\n'
         return data
 
     def json_data(self):
         data = []
         for date_info, count in self.raw_results():
-            date = datetime.fromtimestamp(date_info).isoformat()
+            date = (EPOCH + timedelta(seconds=date_info)).isoformat()
             data.append({date: count})
         return data
 
@@ -379,20 +1053,28 @@ class RequestsPerHour(RequestsPerMinute):
     Combine it with time constrains (`-s` and `-d`) otherwise the output will be long.
     """
 
-    def generate_key(self, accept_date):
-        date_with_hour_precision = accept_date.replace(
-            minute=0, second=0, microsecond=0
-        )
-        unixtime = time.mktime(date_with_hour_precision.timetuple())
-        return unixtime
+    bucket_size = 60 * 60 * 1000
 
 
 class Print(BaseCommandMixin):
     """Returns the raw lines to be printed."""
 
+    fields = ('raw_line',)
+    ordered = True
+
     def __call__(self, line):
         print(line.raw_line)
 
+    def merge(self, other):
+        pass
+
+    def to_state(self):
+        return None
+
+    @classmethod
+    def from_state(cls, state):
+        return cls()
+
     def raw_results(self):
         return
 
@@ -0,0 +1,127 @@
+from collections import deque
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+import os
+
+
+#: Log files smaller than this, in bytes, are parsed in the main process,
+#: as starting worker processes would take longer than parsing them.
+SERIAL_SIZE = 1024 * 1024
+
+#: Tasks sent to every worker whose results were not consumed yet,
+#: unless told otherwise, see :meth:`ProcessEngine.imap_tasks`.
+PENDING_TASKS_PER_WORKER = 2
+
+
+class SerialEngine:
+    """Run tasks one after the other on the main process.
+
+    All engines run module level functions on tasks, see :meth:`imap_tasks`,
+    and can be reused, e.g. by all the log files read by a long lived service.
+    """
+
+    def __init__(self, workers=None, max_pending=None, batch_size=None):
+        # tasks run here, one at a time
+        self.workers = 1
+        self.max_pending = max_pending
+        # lines to send to workers at once, None to adapt it,
+        # see `haproxy.logfile.BatchSizer`
+        self.batch_size = batch_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def imap(self, func, tasks):
+        """Yield the results of ``func`` on every task, in order."""
+        for _, result in self.imap_tasks(func, tasks):
+            yield result
+
+    def imap_tasks(self, func, tasks):
+        """Yield (task, result) tuples of ``func`` on every task, in order.
+
+        Tasks are only taken from ``tasks`` as results are consumed.
+        """
+        for task in tasks:
+            yield task, func(task)
+
+    def close(self):
+        pass
+
+
+class ProcessEngine(SerialEngine):
+    """Run tasks on a pool of worker processes, by default one per CPU.
+
+    The pool is started on first use, and kept until the engine is closed.
+
+    At most ``max_pending`` tasks are sent to workers without their results
+    being consumed, unlike with ``Pool.imap``, which sends all tasks right away,
+    reading a whole stream if needed, and keeps their results until consumed:
+    memory would grow with the log file whenever lines are consumed slower
+    than they are parsed.
+    """
+
+    pool_class = Pool
+
+    def __init__(self, workers=None, max_pending=None, batch_size=None):
+        super().__init__(workers, max_pending, batch_size)
+        self.workers = workers or os.cpu_count()
+        self.max_pending = max_pending or self.workers * PENDING_TASKS_PER_WORKER
+        self.pool = None
+
+    def imap_tasks(self, func, tasks):
+        if self.pool is None:
+            self.pool = self.pool_class(self.workers)
+        pending = deque()
+        for task in tasks:
+            pending.append((task, self.pool.apply_async(func, (task,))))
+            if len(pending) >= self.max_pending:
+                task, result = pending.popleft()
+                yield task, result.get()
+        while pending:
+            task, result = pending.popleft()
+            yield task, result.get()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+class ThreadEngine(ProcessEngine):
+    """Run tasks on a pool of threads, by default one per CPU.
+
+    Parsing lines is bound by the global interpreter lock,
+    so threads only pay off on free-threaded Python builds.
+    """
+
+    pool_class = ThreadPool
+
+
+#: Engines by their name, see :func:`create_engine`.
+ENGINES = {
+    'serial': SerialEngine,
+    'thread': ThreadEngine,
+    'process': ProcessEngine,
+}
+
+
+def create_engine(
+    name=None, size=None, workers=None, max_pending=None, batch_size=None
+):
+    """Return the engine called ``name``, see :data:`ENGINES`.
+
+    Without a name, the best suited one to parse ``size`` bytes of log files is
+    picked: small log files are parsed serially, unless ``workers`` are given.
+    A size of None means unknown, e.g. the standard input.
+    """
+    if name is None:
+        name = 'process'
+        if workers == 1 or (
+            workers is None and size is not None and size < SERIAL_SIZE
+        ):
+            name = 'serial'
+    return ENGINES[name](workers, max_pending, batch_size)
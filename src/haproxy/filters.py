@@ -1,3 +1,85 @@
+#: Lines on which all filters are checked, to measure how many lines each of
+#: them rejects, before ordering them, see :class:`Predicate`.
+SAMPLE_LINES = 1000
+
+
+def reads(*fields, cost=1):
+    """Declare which Line attributes the filters created by a factory read.
+
+    ``cost`` is how expensive the filters are compared to the other ones,
+    see :class:`Predicate`.
+    """
+
+    def decorator(factory):
+        factory.fields = fields
+        factory.cost = cost
+        return factory
+
+    return decorator
+
+
+def raw_substring(filter_func, substring):
+    """Declare a text that raw lines contain whenever ``filter_func`` passes.
+
+    Lines without it can be discarded before being parsed,
+    see :func:`haproxy.utils.raw_substrings`.
+    """
+    filter_func.raw_substring = substring
+    return filter_func
+
+
+class Predicate:
+    """Filters compiled into a single check, that lines pass if they pass them all.
+
+    Or, if ``negate`` is set, if they do not pass all of them.
+
+    ``clauses`` are (filter function, cost) pairs. The cheapest filters are
+    checked first, until :data:`SAMPLE_LINES` lines are seen. From then on,
+    the filters rejecting the most lines for their cost go first,
+    so that most lines are discarded by the first filter checked.
+    """
+
+    def __init__(self, clauses, negate=False):
+        self.clauses = sorted(clauses, key=lambda clause: clause[1])
+        self.filter_funcs = [filter_func for filter_func, _ in self.clauses]
+        self.negate = bool(negate)
+        self.sampled = 0
+        self.passed = [0] * len(self.clauses)
+
+    def __call__(self, line):
+        if self.sampled < SAMPLE_LINES:
+            return self._sample(line)
+        for filter_func in self.filter_funcs:
+            if not filter_func(line):
+                return self.negate
+        return not self.negate
+
+    def _sample(self, line):
+        """Check all filters on the line, keeping the count of lines passing them."""
+        results = [bool(filter_func(line)) for filter_func in self.filter_funcs]
+        for index, result in enumerate(results):
+            self.passed[index] += result
+        self.sampled += 1
+        if self.sampled == SAMPLE_LINES:
+            self._reorder()
+        return all(results) is not self.negate
+
+    def _reorder(self):
+        """Order the filters by their cost for every line they reject."""
+
+        def rank(index):
+            rejected = self.sampled - self.passed[index]
+            if not rejected:
+                return float('inf')
+            return self.clauses[index][1] / rejected
+
+        order = sorted(range(len(self.clauses)), key=rank)
+        self.clauses = [self.clauses[index] for index in order]
+        self.passed = [self.passed[index] for index in order]
+        self.filter_funcs = [filter_func for filter_func, _ in self.clauses]
+
+
+@reads('ip', cost=3)
 def filter_ip(ip):
     """Filter by IP.
 
@@ -10,9 +92,10 @@ def filter_ip(ip):
     def filter_func(log_line):
         return log_line.ip == ip
 
-    return filter_func
+    return raw_substring(filter_func, ip)
 
 
+@reads('ip', cost=3)
 def filter_ip_range(ip_range):
     """Filter by an IP range.
 
@@ -27,9 +110,10 @@ def filter_ip_range(ip_range):
         if ip:
             return ip.startswith(ip_range)
 
-    return filter_func
+    return raw_substring(filter_func, ip_range)
 
 
+@reads('http_request_path')
 def filter_path(path):
     """Filter by the request path.
 
@@ -41,9 +125,13 @@ def filter_path(path):
     def filter_func(log_line):
         return path in log_line.http_request_path
 
-    return filter_func
+    # requests that can not be parsed have an 'invalid' path
+    if path in 'invalid':
+        return filter_func
+    return raw_substring(filter_func, path)
 
 
+@reads('is_https', cost=2)
 def filter_ssl(ignore=True):
     """Filter by SSL connection.
 
@@ -55,9 +143,10 @@ def filter_ssl(ignore=True):
     def filter_func(log_line):
         return log_line.is_https
 
-    return filter_func
+    return raw_substring(filter_func, ':443')
 
 
+@reads('time_wait_response')
 def filter_slow_requests(slowness):
     """Filter by response time.
 
@@ -67,13 +156,15 @@ def filter_slow_requests(slowness):
     Time is in milliseconds.
     """
 
+    slowness_int = int(slowness)
+
     def filter_func(log_line):
-        slowness_int = int(slowness)
         return slowness_int <= log_line.time_wait_response
 
     return filter_func
 
 
+@reads('time_wait_queues')
 def filter_wait_on_queues(max_waiting):
     """Filter by queue time in HAProxy.
 
@@ -83,13 +174,15 @@ def filter_wait_on_queues(max_waiting):
     prior to be sent to a downstream server to be processed.
     """
 
+    waiting = int(max_waiting)
+
     def filter_func(log_line):
-        waiting = int(max_waiting)
         return waiting <= log_line.time_wait_queues
 
     return filter_func
 
 
+@reads('status_code')
 def filter_status_code(http_status):
     """Filter by a specific HTTP status code.
 
@@ -99,9 +192,10 @@ def filter_status_code(http_status):
     def filter_func(log_line):
         return log_line.status_code == http_status
 
-    return filter_func
+    return raw_substring(filter_func, http_status)
 
 
+@reads('status_code', cost=2)
 def filter_status_code_family(family_number):
     """Filter by a family of HTTP status code.
 
@@ -114,6 +208,7 @@ def filter_status_code_family(family_number):
     return filter_func
 
 
+@reads('http_request_method')
 def filter_http_method(http_method):
     """Filter by HTTP method (GET, POST, PUT, HEAD...).
 
@@ -123,9 +218,13 @@ def filter_http_method(http_method):
     def filter_func(log_line):
         return log_line.http_request_method == http_method
 
-    return filter_func
+    # requests that can not be parsed have an 'invalid' method
+    if http_method == 'invalid':
+        return filter_func
+    return raw_substring(filter_func, f'"{http_method}')
 
 
+@reads('backend_name')
 def filter_backend(backend_name):
     """Filter by HAProxy backend.
 
@@ -137,9 +236,10 @@ def filter_backend(backend_name):
     def filter_func(log_line):
         return log_line.backend_name == backend_name
 
-    return filter_func
+    return raw_substring(filter_func, f'{backend_name}/')
 
 
+@reads('frontend_name')
 def filter_frontend(frontend_name):
     """Filter by which HAProxy frontend got the request.
 
@@ -151,9 +251,10 @@ def filter_frontend(frontend_name):
     def filter_func(log_line):
         return log_line.frontend_name == frontend_name
 
-    return filter_func
+    return raw_substring(filter_func, frontend_name)
 
 
+@reads('server_name')
 def filter_server(server_name):
     """Filter by downstream server.
 
@@ -163,9 +264,10 @@ def filter_server(server_name):
     def filter_func(log_line):
         return log_line.server_name == server_name
 
-    return filter_func
+    return raw_substring(filter_func, f'/{server_name}')
 
 
+@reads('bytes_read', cost=2)
 def filter_response_size(size):
     """Filter by how big (in bytes) the response was.
 
@@ -173,18 +275,10 @@ def filter_response_size(size):
 
     Specially useful when looking for big file downloads.
     """
-    if size.startswith('+'):
-        size_value = int(size[1:])
-    else:
-        size_value = int(size)
+    # int() accepts the leading + of sizes, and of bytes read
+    size_value = int(size)
 
     def filter_func(log_line):
-        bytes_read = log_line.bytes_read
-        if bytes_read.startswith('+'):
-            bytes_read = int(bytes_read[1:])
-        else:
-            bytes_read = int(bytes_read)
-
-        return bytes_read >= size_value
+        return int(log_line.bytes_read) >= size_value
 
     return filter_func
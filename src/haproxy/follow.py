@@ -0,0 +1,131 @@
+from haproxy.readers import CHUNK_SIZE
+
+import ctypes
+import os
+import select
+import time
+
+
+#: Seconds to sleep between checks for new lines when inotify is not available.
+POLL_INTERVAL = 0.5
+
+# inotify events that may mean that the log file grew, or was rotated,
+# see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_EVENTS = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def follow_lines(path, offset=0, timeout=1.0, encoding='utf-8'):
+    """Yield the lines of a file starting at ``offset``, and then the ones appended.
+
+    It never stops, whenever there are no new lines for ``timeout`` seconds
+    None is yielded instead, so that callers get the chance to do something else.
+
+    If the file is rotated, i.e. renamed and created again,
+    the rest of the old file is read before the new one.
+    If the file is truncated it is read again from its start.
+    Only the last line, while it is being written, is kept in memory.
+    """
+    watcher = _watcher(path)
+    file_obj = open(path, 'rb')
+    file_obj.seek(offset)
+    pending = b''
+    last_yield = time.monotonic()
+    try:
+        while True:
+            chunk = file_obj.read(CHUNK_SIZE)
+            if chunk:
+                *lines, pending = (pending + chunk).split(b'\n')
+                for line in lines:
+                    yield line.decode(encoding, errors='replace')
+                last_yield = time.monotonic()
+                continue
+
+            if _is_rotated(path, file_obj):
+                # lines written to the old file right before it was rotated
+                lines = (pending + file_obj.read()).split(b'\n')
+                if not lines[-1]:
+                    lines.pop()
+                for line in lines:
+                    yield line.decode(encoding, errors='replace')
+                file_obj.close()
+                file_obj = open(path, 'rb')
+                pending = b''
+                continue
+            if os.fstat(file_obj.fileno()).st_size < file_obj.tell():
+                file_obj.seek(0)
+                pending = b''
+                continue
+
+            if time.monotonic() - last_yield >= timeout:
+                yield None
+                last_yield = time.monotonic()
+            watcher.wait(timeout)
+    finally:
+        file_obj.close()
+        watcher.close()
+
+
+def _is_rotated(path, file_obj):
+    """Whether ``path`` is no longer the file being read."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        # the new file is not created yet
+        return False
+    current = os.fstat(file_obj.fileno())
+    return (stat.st_dev, stat.st_ino) != (current.st_dev, current.st_ino)
+
+
+def _watcher(path):
+    """Return the best way available to wait for changes on ``path``."""
+    try:
+        return InotifyWatcher(path)
+    except (AttributeError, OSError, TypeError):
+        return SleepWatcher()
+
+
+class SleepWatcher:
+    """Wait for changes on a file by sleeping a while."""
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, POLL_INTERVAL))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Wait for changes on the directory of a file with Linux' inotify."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # the directory is watched, rather than the file, to know about
+        # files being renamed or created on it, i.e. rotated
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_EVENTS) < 0:
+            errno = ctypes.get_errno()
+            self.close()
+            raise OSError(errno, os.strerror(errno))
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            # which events happened does not matter, the file is checked anyway
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
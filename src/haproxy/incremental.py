@@ -0,0 +1,142 @@
+from haproxy.readers import fingerprint
+from haproxy.readers import last_line_end
+
+import json
+import os
+
+
+#: Bumped whenever the state file format changes, older states are discarded.
+STATE_VERSION = 2
+
+
+class IncrementalState:
+    """How much of a log file was processed, and the results of the commands on it.
+
+    Saving it after every run allows the next one to only process the lines
+    appended to the log file since, adding their results to the saved ones.
+
+    ``settings`` are whatever the results depend on (commands, filters...),
+    a saved state is only used if they are the same.
+
+    The log file is told apart from a new one with the same path
+    by its device, inode and a fingerprint of its start, see :meth:`pending`.
+    """
+
+    def __init__(self, path, logfile, settings):
+        self.path = path
+        self.logfile = logfile
+        # as they are compared with the ones loaded from JSON
+        self.settings = json.loads(json.dumps(settings))
+        self.device = None
+        self.inode = None
+        self.fingerprint = None
+        # bytes of the log file already processed
+        self.offset = 0
+        # partial results of the commands, see `BaseCommandMixin.to_state`
+        self.commands = None
+
+    @classmethod
+    def load(cls, path, logfile, settings):
+        """Load a saved state, or a new one if there is none or it is not usable."""
+        state = cls(path, logfile, settings)
+        try:
+            with open(path) as file_obj:
+                data = json.load(file_obj)
+        except (OSError, ValueError):
+            return state
+
+        if (
+            data.get('version') != STATE_VERSION
+            or data.get('logfile') != os.path.abspath(logfile)
+            or data.get('settings') != state.settings
+        ):
+            print(f'{path} was saved with other settings, starting over.')
+            return state
+
+        state.device = data['device']
+        state.inode = data['inode']
+        state.fingerprint = data['fingerprint']
+        state.offset = data['offset']
+        state.commands = data['commands']
+        return state
+
+    def save(self, commands):
+        """Save the state, replacing the previous one only once it is written whole.
+
+        Otherwise a failure, e.g. a command result that can not be serialized,
+        would leave a truncated state behind.
+        """
+        content = json.dumps(
+            {
+                'version': STATE_VERSION,
+                'logfile': os.path.abspath(self.logfile),
+                'settings': self.settings,
+                'device': self.device,
+                'inode': self.inode,
+                'fingerprint': self.fingerprint,
+                'offset': self.offset,
+                'commands': [cmd.to_state() for cmd in commands],
+            }
+        )
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w') as file_obj:
+            file_obj.write(content)
+        os.replace(temporary_path, self.path)
+
+    def restore(self, commands):
+        """Return the commands with the results saved on the state, if any."""
+        if self.commands is None:
+            return commands
+        return [
+            type(cmd).from_state(cmd_state)
+            for cmd, cmd_state in zip(commands, self.commands)
+        ]
+
+    def pending(self):
+        """Return the (path, (start, end)) byte ranges that were not processed yet.
+
+        If the log file was rotated, i.e. it is a different file,
+        the rest of the old one is returned first, if it can still be found
+        on the same directory, then the new log file from its start.
+        If the log file was truncated it is read from its start again.
+
+        Lines still being written, i.e. without a newline, are left for later.
+        The state is updated as if the ranges returned were already processed.
+        """
+        stat = os.stat(self.logfile)
+        pending = []
+        offset = self.offset
+        if (stat.st_dev, stat.st_ino) != (self.device, self.inode):
+            rotated = _find_file(self.logfile, self.device, self.inode)
+            if rotated is not None and self._is_same_start(rotated):
+                pending.append((rotated, (offset, last_line_end(rotated))))
+            offset = 0
+        elif stat.st_size < offset or not self._is_same_start(self.logfile):
+            offset = 0
+
+        end = last_line_end(self.logfile)
+        pending.append((self.logfile, (offset, end)))
+
+        self.device = stat.st_dev
+        self.inode = stat.st_ino
+        self.offset = end
+        self.fingerprint = fingerprint(self.logfile, end)
+        return pending
+
+    def _is_same_start(self, path):
+        return fingerprint(path, self.offset) == self.fingerprint
+
+
+def _find_file(logfile, device, inode):
+    """Find, on the same directory as ``logfile``, the file with the given inode."""
+    if inode is None:
+        return None
+    directory = os.path.dirname(os.path.abspath(logfile))
+    for entry in os.scandir(directory):
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        if (stat.st_dev, stat.st_ino) == (device, inode) and entry.is_file():
+            return entry.path
+    return None
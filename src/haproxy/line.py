@@ -1,4 +1,5 @@
 from datetime import datetime
+from datetime import timedelta
 
 import re
 
@@ -46,100 +47,137 @@ HTTP_REQUEST_REGEX = re.compile(
     r'(\s+(?P<protocol>\w+/\d\.\d))?'
 )
 
+ACCEPT_DATE_FORMAT = '%d/%b/%Y:%H:%M:%S.%f'
+ACCEPT_MINUTE_FORMAT = '%d/%b/%Y:%H:%M'
+
+EPOCH = datetime(1970, 1, 1)
+
+ONE_MILLISECOND = timedelta(milliseconds=1)
+
+#: Line attributes that need the accept date to be decoded.
+ACCEPT_DATE_FIELDS = frozenset(('accept_date', 'accept_timestamp'))
+
+#: Line attributes that need the HTTP request to be decoded.
+HTTP_REQUEST_FIELDS = frozenset(
+    ('http_request_method', 'http_request_path', 'http_request_protocol', 'is_https')
+)
+
 
 class Line:
     """For a precise and more detailed description of every field see:
     http://cbonte.github.io/haproxy-dconv/2.2/configuration.html#8.2.3
+
+    ``fields`` restricts which attributes are decoded to the ones given,
+    the expensive ones (``accept_date`` and the HTTP request ones)
+    are left as None unless requested. By default all of them are decoded.
     """
 
-    #: IP of the upstream server that made the connection to HAProxy.
-    client_ip = None
-    #: Port used by the upstream server that made the connection to HAProxy.
-    client_port = None
-
-    # raw string from log line and its python datetime version
-    raw_accept_date = None
-    #: datetime object with the exact date when the connection to HAProxy was
-    #: made.
-    accept_date = None
-
-    #: HAProxy frontend that received the connection.
-    frontend_name = None
-    #: HAProxy backend that the connection was sent to.
-    backend_name = None
-    #: Downstream server that HAProxy send the connection to.
-    server_name = None
-
-    #: Time in milliseconds waiting the client to send the full HTTP request
-    #: (``Tq`` in HAProxy documentation).
-    time_wait_request = None
-    #: Time in milliseconds that the request spend on HAProxy queues
-    #: (``Tw`` in HAProxy documentation).
-    time_wait_queues = None
-    #: Time in milliseconds to connect to the final server
-    #: (``Tc`` in HAProxy documentation).
-    time_connect_server = None
-    #: Time in milliseconds waiting the downstream server to send the full
-    #: HTTP response (``Tr`` in HAProxy documentation).
-    time_wait_response = None
-    #: Total time in milliseconds between accepting the HTTP request and
-    #: sending back the HTTP response (``Tt`` in HAProxy documentation).
-    total_time = None
-
-    #: HTTP status code returned to the client.
-    status_code = None
-    #: Total number of bytes send back to the client.
-    bytes_read = None
-
-    # not used by now
-    captured_request_cookie = None
-    captured_response_cookie = None
-
-    # not used by now
-    termination_state = None
-
-    #: Total number of concurrent connections on the process when the
-    #: session was logged (``actconn`` in HAProxy documentation).
-    connections_active = None
-    #: Total number of concurrent connections on the frontend when the
-    #: session was logged (``feconn`` in HAProxy documentation).
-    connections_frontend = None
-    #: Total number of concurrent connections handled by the backend when
-    #: the session was logged (``beconn`` in HAProxy documentation).
-    connections_backend = None
-    #: Total number of concurrent connections still active on the server
-    #: when the session was logged (``srv_conn`` in HAProxy documentation).
-    connections_server = None
-    #: Number of connection retries experienced by this session when
-    # trying to connect to the server.
-    retries = None
-
-    #: Total number of requests which were processed before this one in
-    #: the server queue (``srv_queue`` in HAProxy documentation).
-    queue_server = None
-    #: Total number of requests which were processed before this one in
-    #: the backend's global queue (``backend_queue`` in HAProxy documentation).
-    queue_backend = None
-
-    # List of headers captured in the request.
-    captured_request_headers = None
-    # List of headers captured in the response.
-    captured_response_headers = None
-
-    raw_http_request = None
-    #: HTTP method (GET, POST...) used on this request.
-    http_request_method = None
-    #: Requested HTTP path.
-    http_request_path = None
-    #: HTTP version used on this request.
-    http_request_protocol = None
-
-    raw_line = None
-
-    def __init__(self, line):
+    # the values are the attributes' documentation
+    __slots__ = {
+        'client_ip': 'IP of the upstream server that made the connection to HAProxy.',
+        'client_port': (
+            'Port used by the upstream server that made the connection to HAProxy.'
+        ),
+        # raw string from log line and its python datetime version
+        'raw_accept_date': None,
+        'accept_date': (
+            'datetime object with the exact date when the connection to HAProxy '
+            'was made.'
+        ),
+        'accept_timestamp': (
+            '``accept_date`` as milliseconds since the epoch. '
+            'As log dates have no timezone, they are taken as if they were in UTC.'
+        ),
+        'frontend_name': 'HAProxy frontend that received the connection.',
+        'backend_name': 'HAProxy backend that the connection was sent to.',
+        'server_name': 'Downstream server that HAProxy send the connection to.',
+        'time_wait_request': (
+            'Time in milliseconds waiting the client to send the full HTTP request '
+            '(``Tq`` in HAProxy documentation).'
+        ),
+        'time_wait_queues': (
+            'Time in milliseconds that the request spend on HAProxy queues '
+            '(``Tw`` in HAProxy documentation).'
+        ),
+        'time_connect_server': (
+            'Time in milliseconds to connect to the final server '
+            '(``Tc`` in HAProxy documentation).'
+        ),
+        'time_wait_response': (
+            'Time in milliseconds waiting the downstream server to send the full '
+            'HTTP response (``Tr`` in HAProxy documentation).'
+        ),
+        'total_time': (
+            'Total time in milliseconds between accepting the HTTP request and '
+            'sending back the HTTP response (``Tt`` in HAProxy documentation).'
+        ),
+        'status_code': 'HTTP status code returned to the client.',
+        'bytes_read': 'Total number of bytes send back to the client.',
+        # not used by now
+        'captured_request_cookie': None,
+        'captured_response_cookie': None,
+        # not used by now
+        'termination_state': None,
+        'connections_active': (
+            'Total number of concurrent connections on the process when the '
+            'session was logged (``actconn`` in HAProxy documentation).'
+        ),
+        'connections_frontend': (
+            'Total number of concurrent connections on the frontend when the '
+            'session was logged (``feconn`` in HAProxy documentation).'
+        ),
+        'connections_backend': (
+            'Total number of concurrent connections handled by the backend when '
+            'the session was logged (``beconn`` in HAProxy documentation).'
+        ),
+        'connections_server': (
+            'Total number of concurrent connections still active on the server '
+            'when the session was logged (``srv_conn`` in HAProxy documentation).'
+        ),
+        'retries': (
+            'Number of connection retries experienced by this session when '
+            'trying to connect to the server.'
+        ),
+        'queue_server': (
+            'Total number of requests which were processed before this one in '
+            'the server queue (``srv_queue`` in HAProxy documentation).'
+        ),
+        'queue_backend': (
+            'Total number of requests which were processed before this one in '
+            "the backend's global queue (``backend_queue`` in HAProxy documentation)."
+        ),
+        # List of headers captured in the request.
+        'captured_request_headers': None,
+        # List of headers captured in the response.
+        'captured_response_headers': None,
+        'raw_http_request': None,
+        'http_request_method': 'HTTP method (GET, POST...) used on this request.',
+        'http_request_path': 'Requested HTTP path.',
+        'http_request_protocol': 'HTTP version used on this request.',
+        'raw_line': None,
+        'is_valid': 'Whether the log line could be parsed.',
+    }
+
+    def __init__(self, line, fields=None):
         self.raw_line = line
 
-        self.is_valid = self._parse_line(line)
+        self.is_valid = self._parse_line(line, fields)
+
+    def __getattr__(self, name):
+        # attributes not found on the log line, or not decoded, default to None
+        if name in Line.__slots__:
+            return None
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        # a plain tuple of values keeps pickles small,
+        # i.e. when sending them back from the multiprocessing pool
+        return tuple(getattr(self, name) for name in Line.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(Line.__slots__, state):
+            if value is not None:
+                setattr(self, name, value)
 
     @property
     def is_https(self):
@@ -172,51 +210,58 @@ class Line:
                 return ip.split(',')[0]
         return self.client_ip
 
-    def _parse_line(self, line):
-        matches = HAPROXY_LINE_REGEX.match(line)
-        if matches is None:
-            return False
+    def _parse_line(self, line, fields=None):
+        groups = _split_line(line)
+        if groups is None:
+            matches = HAPROXY_LINE_REGEX.match(line)
+            if matches is None:
+                return False
+            groups = matches.groupdict()
 
-        self.client_ip = matches.group('client_ip')
-        self.client_port = int(matches.group('client_port'))
+        self.client_ip = groups['client_ip']
+        self.client_port = int(groups['client_port'])
 
-        self.raw_accept_date = matches.group('accept_date')
-        self.accept_date = self._parse_accept_date()
+        self.raw_accept_date = groups['accept_date']
+        if fields is None or not ACCEPT_DATE_FIELDS.isdisjoint(fields):
+            self._parse_accept_date()
 
-        self.frontend_name = matches.group('frontend_name')
-        self.backend_name = matches.group('backend_name')
-        self.server_name = matches.group('server_name')
+        self.frontend_name = groups['frontend_name']
+        self.backend_name = groups['backend_name']
+        self.server_name = groups['server_name']
 
-        self.time_wait_request = int(matches.group('tq'))
-        self.time_wait_queues = int(matches.group('tw'))
-        self.time_connect_server = int(matches.group('tc'))
-        self.time_wait_response = int(matches.group('tr'))
-        self.total_time = matches.group('tt')
+        self.time_wait_request = int(groups['tq'])
+        self.time_wait_queues = int(groups['tw'])
+        self.time_connect_server = int(groups['tc'])
+        self.time_wait_response = int(groups['tr'])
+        self.total_time = groups['tt']
 
-        self.status_code = matches.group('status_code')
-        self.bytes_read = matches.group('bytes_read')
+        self.status_code = groups['status_code']
+        self.bytes_read = groups['bytes_read']
 
-        self.connections_active = matches.group('act')
-        self.connections_frontend = matches.group('fe')
-        self.connections_backend = matches.group('be')
-        self.connections_server = matches.group('srv')
-        self.retries = matches.group('retries')
+        self.connections_active = groups['act']
+        self.connections_frontend = groups['fe']
+        self.connections_backend = groups['be']
+        self.connections_server = groups['srv']
+        self.retries = groups['retries']
 
-        self.queue_server = int(matches.group('queue_server'))
-        self.queue_backend = int(matches.group('queue_backend'))
+        self.queue_server = int(groups['queue_server'])
+        self.queue_backend = int(groups['queue_backend'])
 
-        self.captured_request_headers = matches.group('request_headers')
-        self.captured_response_headers = matches.group('response_headers')
-        if matches.group('headers') is not None:
-            self.captured_request_headers = matches.group('headers')
+        self.captured_request_headers = groups['request_headers']
+        self.captured_response_headers = groups['response_headers']
+        if groups['headers'] is not None:
+            self.captured_request_headers = groups['headers']
 
-        self.raw_http_request = matches.group('http_request')
-        self._parse_http_request()
+        self.raw_http_request = groups['http_request']
+        if fields is None or not HTTP_REQUEST_FIELDS.isdisjoint(fields):
+            self._parse_http_request()
 
         return True
 
     def _parse_accept_date(self):
-        return datetime.strptime(self.raw_accept_date, '%d/%b/%Y:%H:%M:%S.%f')
+        self.accept_date, self.accept_timestamp = parse_accept_date(
+            self.raw_accept_date
+        )
 
     def _parse_http_request(self):
         matches = HTTP_REQUEST_REGEX.match(self.raw_http_request)
@@ -236,7 +281,206 @@ class Line:
             print(f'Could not process HTTP request {self.raw_http_request}')
 
 
+# datetime and epoch milliseconds of the minutes already seen,
+# see `parse_accept_date`
+_minutes_cache = {}
+MINUTES_CACHE_SIZE = 1024
+
+
+def parse_accept_date(raw_date):
+    """Convert an accept date to a datetime and milliseconds since the epoch.
+
+    Consecutive log lines share (almost always) the same minute,
+    so ``strptime`` is only used once per minute and cached,
+    seconds and milliseconds are added with integer arithmetic.
+    """
+    prefix, _, seconds = raw_date.rpartition(':')
+    seconds, _, fraction = seconds.partition('.')
+    if (
+        0 < len(seconds) < 3
+        and 0 < len(fraction) < 7
+        and seconds.isdigit()
+        and fraction.isdigit()
+        and (seconds + fraction).isascii()
+        and int(seconds) < 60
+    ):
+        minute = _minutes_cache.get(prefix)
+        if minute is None:
+            minute = _parse_accept_minute(prefix)
+        if minute is not None:
+            seconds = int(seconds)
+            microseconds = int(fraction) * 10 ** (6 - len(fraction))
+            accept_date = minute[0].replace(second=seconds, microsecond=microseconds)
+            accept_timestamp = minute[1] + seconds * 1000 + microseconds // 1000
+            return accept_date, accept_timestamp
+
+    # anything unusual is left to strptime, be it to parse or to complain
+    accept_date = datetime.strptime(raw_date, ACCEPT_DATE_FORMAT)
+    return accept_date, (accept_date - EPOCH) // ONE_MILLISECOND
+
+
+def _parse_accept_minute(prefix):
+    try:
+        minute_date = datetime.strptime(prefix, ACCEPT_MINUTE_FORMAT)
+    except ValueError:
+        return None
+    if len(_minutes_cache) >= MINUTES_CACHE_SIZE:
+        _minutes_cache.clear()
+    minute_timestamp = (minute_date - EPOCH) // ONE_MILLISECOND
+    _minutes_cache[prefix] = (minute_date, minute_timestamp)
+    return minute_date, minute_timestamp
+
+
+def _is_number(value, sign=''):
+    """Check that value is made of ASCII digits, optionally prefixed by sign."""
+    if sign and value[:1] == sign:
+        value = value[1:]
+    return value.isdigit() and value.isascii()
+
+
+def _split_numbers(value, signs):
+    """Split a slash separated group of numbers (e.g. ``0/1/2``).
+
+    ``signs`` holds the sign each number is allowed to be prefixed with.
+    Returns None if ``value`` does not have that shape.
+    """
+    numbers = value.split('/')
+    if len(numbers) != len(signs):
+        return None
+    unsigned = [
+        number[1:] if number[:1] == sign else number
+        for number, sign in zip(numbers, signs)
+    ]
+    digits = ''.join(unsigned)
+    if '' in unsigned or not digits.isdigit() or not digits.isascii():
+        return None
+    return numbers
+
+
+def _split_line(line):
+    """Parse a log line walking its fields with plain string operations.
+
+    It returns the same groups that :data:`HAPROXY_LINE_REGEX` would extract,
+    or None if the line does not follow the standard HTTP log layout
+    unambiguously, in which case the regular expression has the last word.
+
+    As the regular expression is full of greedy groups,
+    lines with extra quotes, square brackets, curly brackets or slashes
+    where one would not expect them are left to it.
+    """
+    prefix_end = line.find(']:')
+    if prefix_end == -1 or '\n' in line:
+        return None
+    rest = line[prefix_end + 2 :]
+    if rest[:1] != ' ' or rest[-1:] != '"' or rest.count('"') != 2:
+        return None
+
+    # fields are separated by exactly one space, otherwise the greedy groups
+    # of the regular expression would swallow the extra whitespace in the names
+    fields = rest.lstrip().split(' ', 12)
+    if len(fields) != 13 or '' in fields:
+        return None
+    (
+        client,
+        accept_date,
+        frontend_name,
+        backend_and_server,
+        timers,
+        status_code,
+        bytes_read,
+        request_cookie,
+        _,
+        _,
+        connections,
+        queues,
+        tail,
+    ) = fields
+
+    client_ip, _, client_port = client.rpartition(':')
+    if (
+        not client_ip
+        or client_ip.strip('0123456789abcdefABCDEF+.:')
+        or not _is_number(client_port)
+    ):
+        return None
+
+    quote = tail.find('"')
+    head = rest[: len(rest) - len(tail)]
+    if (
+        tail.count('"') != 2
+        or not head.isprintable()
+        or len(accept_date) < 3
+        or accept_date[0] != '['
+        or accept_date[-1] != ']'
+        or rest.count(']', 0, len(head) + quote) != 1
+    ):
+        return None
+
+    backend_name, slash, server_name = backend_and_server.rpartition('/')
+    if not slash or '/' in request_cookie:
+        return None
+
+    timers = _split_numbers(timers, ('-', '-', '-', '-', '+'))
+    connections = _split_numbers(connections, ('', '', '', '', '+'))
+    queues = _split_numbers(queues, ('', ''))
+    if timers is None or connections is None or queues is None:
+        return None
+    if not _is_number(status_code, '-') or not _is_number(bytes_read, '+'):
+        return None
+
+    request_headers = response_headers = headers = None
+    if quote:
+        captured = tail[:quote]
+        stripped = captured.rstrip()
+        if (
+            stripped == captured
+            or stripped[:1] != '{'
+            or stripped[-1] != '}'
+            or stripped.count('}') != stripped.count('{')
+        ):
+            return None
+        if stripped.count('{') == 1:
+            headers = stripped[1:-1]
+        elif stripped.count('{') == 2:
+            request_end = stripped.index('}')
+            response_start = stripped.find('{', request_end)
+            separator = stripped[request_end + 1 : response_start]
+            if response_start == -1 or not separator.isspace():
+                return None
+            request_headers = stripped[1:request_end]
+            response_headers = stripped[response_start + 1 : -1]
+        else:
+            return None
+
+    return {
+        'client_ip': client_ip,
+        'client_port': client_port,
+        'accept_date': accept_date[1:-1],
+        'frontend_name': frontend_name,
+        'backend_name': backend_name,
+        'server_name': server_name,
+        'tq': timers[0],
+        'tw': timers[1],
+        'tc': timers[2],
+        'tr': timers[3],
+        'tt': timers[4],
+        'status_code': status_code,
+        'bytes_read': bytes_read,
+        'act': connections[0],
+        'fe': connections[1],
+        'be': connections[2],
+        'srv': connections[3],
+        'retries': connections[4],
+        'queue_server': queues[0],
+        'queue_backend': queues[1],
+        'request_headers': request_headers,
+        'response_headers': response_headers,
+        'headers': headers,
+        'http_request': tail[quote + 1 : -1],
+    }
+
+
 # it is not coverage covered as this is executed by the multiprocessor module,
 # and setting it up on coverage just for two lines is not worth it
-def parse_line(line):  # pragma: no cover
-    return Line(line.strip())
+def parse_line(line, fields=None):  # pragma: no cover
+    return Line(line.strip(), fields)
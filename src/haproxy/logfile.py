@@ -1,16 +1,99 @@
+from contextlib import contextmanager
 from datetime import datetime
+from datetime import timedelta
+from haproxy.cache import LineCache
+from haproxy.engine import create_engine
+from haproxy.follow import follow_lines
 from haproxy.line import parse_line
+from haproxy.readers import bisect_lines
+from haproxy.readers import detect_compression
+from haproxy.readers import last_line_end
+from haproxy.readers import open_compressed
+from haproxy.readers import read_gzip_members
+from haproxy.readers import read_lines
+from haproxy.readers import read_range
+from haproxy.readers import split_gzip_members
+from haproxy.readers import split_ranges
+from haproxy.timeindex import TimeIndex
+from haproxy.utils import compile_filters
 from haproxy.utils import date_str_to_datetime
 from haproxy.utils import delta_str_to_timedelta
-from multiprocessing import Pool
+from itertools import islice
+from operator import attrgetter
+
+import copy
+import heapq
+import os
+import sys
+import time
+
+
+#: Size of the ranges of bytes each worker parses when iterating over a log file.
+RANGE_SIZE = 4 * 1024 * 1024
+
+#: Size of the ranges of bytes each worker decompresses and parses
+#: when iterating over a gzip log file made of many members.
+GZIP_RANGE_SIZE = 1024 * 1024
+
+#: Amount of lines of a stream, or a compressed log file, sent to parse to workers
+#: at once. None adapts it to how long workers take, see :class:`BatchSizer`.
+BATCH_SIZE = None
+
+#: Seconds workers should take to parse every batch of lines.
+BATCH_LATENCY = 0.05
+
+#: Smallest, and first, amount of lines sent to workers at once.
+MIN_BATCH_SIZE = 100
+
+#: Largest amount of lines sent to workers at once.
+MAX_BATCH_SIZE = 100000
+
+#: How much out of order lines can be when seeking: seeking starts this much
+#: before the start time and stops once lines are this much after the end time.
+SEEK_TOLERANCE = timedelta(minutes=1)
 
 
 class Log:
-    def __init__(self, logfile=None, start=None, delta=None, show_invalid=False):
+    def __init__(
+        self,
+        logfile=None,
+        start=None,
+        delta=None,
+        show_invalid=False,
+        fields=None,
+        seek=False,
+        index=False,
+        cache=False,
+        byte_range=None,
+        engine=None,
+        raw_filters=(),
+    ):
+        # Path of the log file, '-' for the standard input, or a file object
+        # or an iterable of lines to read it from, see `_read_stream`
         self.logfile = logfile
         self.show_invalid = show_invalid
+        # Whether the log file is expected to be time ordered, see `_seek`
+        self.seek = seek
+        # Whether to use, and keep up to date, a sidecar time index, see `_index`
+        self.index = index
+        # Whether to read lines from, building it if needed, a cache of parsed
+        # lines, see `_line_cache`
+        self.cache = cache
+        # (start, end) offsets of the part of the log file to read,
+        # by default the whole of it
+        self.byte_range = byte_range
+        # Engine parsing the log file, see `haproxy.engine`, e.g. to share a pool
+        # of workers between log files, by default one picked for its size
+        self.engine = engine
+        # Texts that lines have to contain to be parsed at all, the others are not
+        # counted as valid nor invalid, see `haproxy.utils.raw_substrings`
+        self.raw_filters = tuple(raw_filters)
         self.start = None
         self.end = None
+        # Line attributes to decode, None means all of them
+        self.fields = None
+        if fields is not None:
+            self.fields = frozenset(fields)
 
         if start:
             self.start = date_str_to_datetime(start)
@@ -21,28 +104,568 @@ class Log:
             if isinstance(self.start, datetime):
                 self.end = self.start + delta
 
+        if self.fields is not None and self.start:
+            self.fields |= {'accept_date'}
+
         self.invalid_lines = 0
         self.valid_lines = 0
+        self.bytes_scanned = 0
+
+    def __getstate__(self):
+        # log files are sent to workers, but engines, i.e. their pools, can not be
+        state = self.__dict__.copy()
+        state['engine'] = None
+        return state
 
     def __iter__(self):
-        start = datetime.now()
-        with open(self.logfile) as logfile, Pool() as pool:
-            for index, line in enumerate(pool.imap(parse_line, logfile)):
-                if line.is_valid:
-                    self.valid_lines += 1
-                    if line.is_within_time_frame(self.start, self.end):
-                        yield line
-                else:
-                    if self.show_invalid:
-                        print(line.raw_line)
-                    self.invalid_lines += 1
-
-                if index % 10000 == 0 and index > 0:  # pragma: no cover
+        return iter(Logs([self], engine=self.engine))
+
+    def map_reduce(self, commands, filters=None, negate_filter=False, processes=None):
+        """Run the commands on the log file, splitting the work between processes.
+
+        Each process reads its own byte range of the log file,
+        filters its lines and runs its own copy of the commands on them.
+        Their partial results are then merged back into ``commands``.
+
+        As filter functions can not be sent to other processes,
+        ``filters`` are given as (name, argument) tuples,
+        see :func:`haproxy.utils.compile_filters`.
+        """
+        logs = Logs([self], engine=self.engine)
+        return logs.map_reduce(commands, filters, negate_filter, processes)
+
+    def follow(self, timeout=1.0):
+        """Yield the lines of the log file, and then the ones appended to it, forever.
+
+        Whenever there are no new lines for ``timeout`` seconds None is yielded,
+        so that callers get the chance to, for example, output their results.
+        See :func:`haproxy.follow.follow_lines`.
+        """
+        range_start, _ = self._byte_range(self.engine)
+        end = last_line_end(self.logfile)
+        self.byte_range = (range_start, end)
+        yield from self
+
+        for raw_line in follow_lines(self.logfile, end, timeout):
+            if raw_line is None:
+                yield None
+                continue
+            for line in _parse_raw_lines((raw_line,), self.fields, self.raw_filters):
+                if self._is_wanted(line):
+                    yield line
+
+    @property
+    def total_lines(self):
+        return self.valid_lines + self.invalid_lines
+
+    def _is_wanted(self, line):
+        """Keep the count of valid and invalid lines.
+
+        Returns whether the line is valid and within the time frame.
+        """
+        if line.is_valid:
+            self.valid_lines += 1
+            return line.is_within_time_frame(self.start, self.end)
+
+        if self.show_invalid:
+            print(line.raw_line)
+        self.invalid_lines += 1
+        return False
+
+    def _lines(self, engine):
+        """Yield the valid lines within the time frame, parsed by the engine."""
+        if not self._is_file():
+            for line in self._parse_stream(self._read_stream(), engine):
+                if self._is_wanted(line):
+                    yield line
+            return
+
+        compression = detect_compression(self.logfile)
+        if compression is not None:
+            for line in self._read_compressed(compression, engine):
+                if self._is_wanted(line):
+                    yield line
+            self.bytes_scanned += os.path.getsize(self.logfile)
+            return
+
+        range_start, range_end = self._byte_range(engine)
+        if self.cache:
+            # reading lines from the cache is cheaper than sending them
+            # between processes
+            if range_end is None:
+                range_end = os.path.getsize(self.logfile)
+            yield from self._read_range(
+                range_start, range_end, self._line_cache(engine)
+            )
+            self.bytes_scanned += range_end - range_start
+            return
+
+        size = (range_end or os.path.getsize(self.logfile)) - range_start
+        parts = max(engine.workers * 4, size // RANGE_SIZE)
+        tasks = [
+            (self, *byte_range)
+            for byte_range in split_ranges(
+                self.logfile, parts, start=range_start, end=range_end
+            )
+        ]
+        index = 0
+        for (_, range_start, range_end), (lines, past_end) in engine.imap_tasks(
+            _parse_range, tasks
+        ):
+            for line in lines:
+                if self._is_wanted(line):
+                    yield line
+
+                index += 1
+                if index % 10000 == 0:  # pragma: no cover
                     print('.', end='', flush=True)
+            self.bytes_scanned += range_end - range_start
+            if past_end:
+                break
+
+    def _map_tasks(self, commands, filters, negate_filter, engine):
+        """Return the tasks to run the commands on the byte ranges of the log file.
+
+        The engine also builds the time index, or the cache, if needed.
+        See :func:`_map_range` and :meth:`_reduce`.
+        """
+        range_start, range_end = self._byte_range(engine)
+        if self.cache:
+            # workers map the cache on their own, reading only the rows of their
+            # byte range, see `LineCache.lines`
+            self._line_cache(engine)
+        ranges = split_ranges(
+            self.logfile, engine.workers * 4, start=range_start, end=range_end
+        )
+        return [
+            (self, range_start, range_end, commands, filters, negate_filter)
+            for range_start, range_end in ranges
+        ]
+
+    def _reduce(self, commands, task, results):
+        """Merge the partial results of a task returned by :meth:`_map_tasks`.
+
+        Returns whether no more lines within the time frame can follow.
+        """
+        partial_commands, valid_lines, invalid_lines, past_end = results
+        for cmd, partial_cmd in zip(commands, partial_commands):
+            cmd.merge(partial_cmd)
+        self.valid_lines += valid_lines
+        self.invalid_lines += invalid_lines
+        self.bytes_scanned += task[2] - task[1]
+        return past_end
+
+    def _read_compressed(self, compression, engine):
+        """Yield all the lines of a compressed log file, parsed by the engine.
+
+        gzip files made of many members are decompressed in parallel as well,
+        otherwise the log file is decompressed here, and its lines sent to
+        workers in batches, see :meth:`_parse_stream`.
+        """
+        ranges = []
+        if compression == 'gzip':
+            size = os.path.getsize(self.logfile)
+            parts = max(engine.workers * 4, size // GZIP_RANGE_SIZE)
+            ranges = split_gzip_members(self.logfile, parts)
+
+        if len(ranges) > 1:
+            tasks = [(self, *byte_range) for byte_range in ranges]
+            # lines can span gzip members, their pieces are joined here
+            pending = b''
+            for head, lines, tail in engine.imap(_parse_gzip_range, tasks):
+                if head is None:
+                    pending += tail
+                    continue
+                yield from self._parse_joined(pending + head)
+                yield from lines
+                pending = tail
+            if pending:
+                yield from self._parse_joined(pending)
+            return
+
+        with open_compressed(self.logfile) as file_obj:
+            yield from self._parse_stream(read_lines(file_obj), engine, count=False)
+
+    def _parse_joined(self, raw_line):
+        """Parse a line whose pieces were read from different gzip members."""
+        raw_line = raw_line.decode(errors='replace')
+        return _parse_raw_lines((raw_line,), self.fields, self.raw_filters)
+
+    def _read_stream(self):
+        """Yield the raw lines of a log file not given as a path.
+
+        Binary file objects, like the standard input, are read in large chunks,
+        see :func:`haproxy.readers.read_lines`.
+        """
+        if self.logfile == '-':
+            yield from read_lines(sys.stdin.buffer)
+        elif hasattr(self.logfile, 'read') and isinstance(self.logfile.read(0), bytes):
+            yield from read_lines(self.logfile)
+        else:
+            # text file objects and iterables of lines
+            yield from self.logfile
+
+    def _parse_stream(self, raw_lines, engine, count=True):
+        """Yield the lines parsed by the engine, sent in batches of lines.
+
+        Batches are sized as the engine was told to, see :class:`BatchSizer`.
+
+        As streams have no known size, the characters of the lines,
+        rather than the bytes, are added to ``bytes_scanned`` if ``count``.
+        """
+        sizer = BatchSizer(engine.batch_size or BATCH_SIZE)
+
+        def tasks():
+            for batch in _batches(raw_lines, sizer):
+                if count:
+                    self.bytes_scanned += sum(map(len, batch))
+                yield self.fields, self.raw_filters, batch
+
+        results = engine.imap_tasks(_parse_lines, tasks())
+        for (_, _, batch), (lines, elapsed) in results:
+            sizer.update(len(batch), elapsed)
+            yield from lines
+
+    def _is_file(self):
+        """Whether the log file is given as a path, i.e. it can be opened, or split."""
+        return isinstance(self.logfile, (str, os.PathLike)) and self.logfile != '-'
+
+    def _byte_range(self, engine=None):
+        """Return the (start, end) offsets of the log file worth reading.
+
+        The end offset is None when the whole rest of the file has to be read.
+        The time index, if used, is updated by ``engine``, see :meth:`_index`.
+        """
+        if self.byte_range is not None:
+            return self.byte_range
+        if self.index:
+            return self._index(engine)
+        return self._seek(), None
+
+    def _index(self, engine=None):
+        """Update the sidecar time index of the log file and look the time frame up.
+
+        The index is updated by ``engine``, by default one suited for the size
+        of the log file, see :meth:`haproxy.timeindex.TimeIndex.update`.
+
+        If the index can not be saved next to the log file it is still used,
+        it will have to be rebuilt the next time though.
+        """
+        time_index = TimeIndex.load(self.logfile)
+        if time_index.update(engine):
+            try:
+                time_index.save()
+            except OSError:
+                pass
+        if not self.start:
+            return 0, None
+        return time_index.byte_range(self.start, self.end)
+
+    def _seek(self):
+        """Return the offset where reading the log file should start.
+
+        When seeking, the log file is bisected to find the first line
+        logged, give or take :data:`SEEK_TOLERANCE`, after the start time.
+        """
+        if not self.seek or not self.start:
+            return 0
+
+        threshold = self.start - SEEK_TOLERANCE
 
-        end = datetime.now()
-        print(f'\nIt took {end - start}')
+        def is_before(raw_line):
+            line = parse_line(raw_line, ('accept_date',))
+            if not line.is_valid:
+                return None
+            return line.accept_date < threshold
+
+        return bisect_lines(self.logfile, is_before)
+
+    def _is_past_end(self, line):
+        """Whether, when seeking, no more lines within the time frame can follow."""
+        return (
+            self.seek
+            and self.end is not None
+            and line.is_valid
+            and line.accept_date > self.end + SEEK_TOLERANCE
+        )
+
+    def _line_cache(self, engine=None):
+        """Load the cache of parsed lines, or build it if it is missing or outdated.
+
+        The cache is built by ``engine``, by default one suited for the size
+        of the log file, see :meth:`haproxy.cache.LineCache.build`.
+
+        If the cache can not be saved next to the log file it is still used,
+        it will have to be rebuilt the next time though.
+        """
+        line_cache = LineCache.load(self.logfile)
+        if line_cache is None:
+            line_cache = LineCache.build(self.logfile, engine=engine)
+            try:
+                line_cache.save()
+            except OSError:
+                pass
+        return line_cache
+
+    def _read_range(self, range_start, range_end, line_cache=None):
+        """Yield the lines found on the given range of bytes.
+
+        Only valid lines within the time frame are returned.
+        Reading stops early, setting ``past_end``, when seeking past the end time.
+
+        When using the cache, lines are read from ``line_cache``,
+        or the one saved next to the log file (only its header is read
+        as it is memory mapped), rather than parsed.
+        """
+        self.past_end = False
+        if self.cache and line_cache is None:
+            line_cache = LineCache.load(self.logfile)
+        if line_cache is not None:
+            lines = line_cache.lines(self.fields, range_start, range_end)
+        else:
+            lines = _parse_raw_lines(
+                read_range(self.logfile, range_start, range_end),
+                self.fields,
+                self.raw_filters,
+            )
+        for line in lines:
+            if self._is_past_end(line):
+                self.past_end = True
+                return
+            if self._is_wanted(line):
+                yield line
+
+
+class Logs:
+    """Several log files read, or processed with :meth:`map_reduce`, as one.
+
+    All of them share the same engine, i.e. pool of workers,
+    the counts of lines and bytes scanned are the sum of theirs.
+
+    When ``ordered``, iterating yields the lines of all log files merged by their
+    accept date, as commands like ``queue_peaks`` or ``print`` expect.
+    Every log file is expected to be time ordered already,
+    so that only the next line of each of them needs to be compared.
+    """
+
+    def __init__(self, logs, ordered=False, engine=None):
+        self.logs = list(logs)
+        self.ordered = ordered
+        # Engine running the tasks, see `haproxy.engine`,
+        # by default one picked for the size of the log files, see `_engine`
+        self.engine = engine
+        if ordered:
+            for log in self.logs:
+                if log.fields is not None:
+                    log.fields |= {'accept_date'}
+
+    def __iter__(self):
+        start = datetime.now()
+        with self._engine() as engine:
+            if self.ordered:
+                yield from heapq.merge(
+                    *(log._lines(engine) for log in self.logs),
+                    key=attrgetter('accept_date'),
+                )
+            else:
+                for log in self.logs:
+                    yield from log._lines(engine)
+        _print_elapsed(start, self.bytes_scanned)
+
+    def map_reduce(self, commands, filters=None, negate_filter=False, processes=None):
+        """Run the commands on all log files, splitting the work between processes.
+
+        The byte ranges of all (plain) log files are sent to the same stream of
+        tasks, so that workers do not wait between log files, and the partial
+        results merged back into ``commands``, see :meth:`Log.map_reduce`.
+        """
+        start = datetime.now()
+        filters = filters or []
+        # streams and compressed log files can not be split on byte ranges
+        # of lines, lines are still parsed in parallel though
+        streams = [
+            log
+            for log in self.logs
+            if not log._is_file() or detect_compression(log.logfile) is not None
+        ]
+        # workers get empty commands, as tasks are sent while results are merged
+        # into ``commands``
+        empty_commands = [cmd.empty() for cmd in commands]
+        # log files where no more lines within the time frame can follow
+        finished = set()
+        with self._engine(processes) as engine:
+            tasks = (
+                task
+                for log in self.logs
+                if log not in streams
+                for task in log._map_tasks(
+                    empty_commands, filters, negate_filter, engine
+                )
+                if log not in finished
+            )
+            for task, results in engine.imap_tasks(_map_range, tasks):
+                log = task[0]
+                if log not in finished and log._reduce(commands, task, results):
+                    finished.add(log)
+            for log in streams:
+                _run_commands(log._lines(engine), commands, filters, negate_filter)
+
+        _print_elapsed(start, self.bytes_scanned)
+        return commands
+
+    @property
+    def size(self):
+        """Bytes of all log files, None if any of them is a stream."""
+        if not all(log._is_file() for log in self.logs):
+            return None
+        return sum(os.path.getsize(log.logfile) for log in self.logs)
+
+    @contextmanager
+    def _engine(self, workers=None):
+        """Provide the engine to run tasks with.
+
+        Unless given one, or a specific amount of ``workers``,
+        the one best suited for the size of the log files is created,
+        and closed afterwards, see :func:`haproxy.engine.create_engine`.
+        """
+        if self.engine is not None and workers is None:
+            yield self.engine
+            return
+        with create_engine(size=self.size, workers=workers) as engine:
+            yield engine
+
+    @property
+    def valid_lines(self):
+        return sum(log.valid_lines for log in self.logs)
+
+    @property
+    def invalid_lines(self):
+        return sum(log.invalid_lines for log in self.logs)
 
     @property
     def total_lines(self):
         return self.valid_lines + self.invalid_lines
+
+    @property
+    def bytes_scanned(self):
+        return sum(log.bytes_scanned for log in self.logs)
+
+
+def _print_elapsed(start, bytes_scanned):
+    elapsed = datetime.now() - start
+    throughput = bytes_scanned / max(elapsed.total_seconds(), 1e-6) / 1e6
+    print(f'\nIt took {elapsed} to scan {bytes_scanned} bytes ({throughput:.1f} MB/s)')
+
+
+def _run_commands(lines, commands, filters, negate_filter):
+    """Run the commands on the lines that pass the (name, argument) filters."""
+    predicate = compile_filters(filters, negate_filter)
+    for line in lines:
+        if predicate(line):
+            for cmd in commands:
+                cmd(line)
+
+
+class BatchSizer:
+    """Amount of lines to send to workers at once, adapted to how long they take.
+
+    Batches start small, so that small inputs do not wait for a big batch to fill,
+    and grow, or shrink, so that workers take :data:`BATCH_LATENCY` seconds
+    to parse each of them, which makes sending them between processes cheap.
+    A fixed ``size`` can be given instead.
+    """
+
+    def __init__(self, size=None):
+        self.fixed = size is not None
+        self.size = size or MIN_BATCH_SIZE
+
+    def update(self, lines, elapsed):
+        """Adapt the size to the seconds a batch of ``lines`` took to parse."""
+        if self.fixed or not lines:
+            return
+        size = BATCH_LATENCY * lines / max(elapsed, 1e-6)
+        # do not grow too fast out of a single, maybe unusually fast, batch
+        size = min(size, self.size * 2)
+        self.size = int(max(MIN_BATCH_SIZE, min(size, MAX_BATCH_SIZE)))
+
+
+def _batches(iterable, sizer):
+    """Yield lists of, at most, ``sizer.size`` items of ``iterable``.
+
+    The size is checked again for every batch, see :class:`BatchSizer`.
+    """
+    iterator = iter(iterable)
+    batch = list(islice(iterator, sizer.size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, sizer.size))
+
+
+def _parse_raw_lines(raw_lines, fields, raw_filters):
+    """Parse the raw lines containing all of ``raw_filters``, skip the others.
+
+    Looking for a text is much cheaper than parsing a line,
+    see :func:`haproxy.filters.raw_substring`.
+    """
+    if not raw_filters:
+        for raw_line in raw_lines:
+            yield parse_line(raw_line, fields)
+    elif len(raw_filters) == 1:
+        (raw_filter,) = raw_filters
+        for raw_line in raw_lines:
+            if raw_filter in raw_line:
+                yield parse_line(raw_line, fields)
+    else:
+        for raw_line in raw_lines:
+            if all(raw_filter in raw_line for raw_filter in raw_filters):
+                yield parse_line(raw_line, fields)
+
+
+# it is not coverage covered as this is executed by the multiprocessor module
+def _parse_range(task):  # pragma: no cover
+    log, range_start, range_end = task
+    lines = []
+    raw_lines = read_range(log.logfile, range_start, range_end)
+    for line in _parse_raw_lines(raw_lines, log.fields, log.raw_filters):
+        if log._is_past_end(line):
+            return lines, True
+        lines.append(line)
+    return lines, False
+
+
+def _parse_lines(task):  # pragma: no cover
+    """Parse a batch of lines, returns them and the seconds it took."""
+    fields, raw_filters, raw_lines = task
+    start = time.perf_counter()
+    lines = list(_parse_raw_lines(raw_lines, fields, raw_filters))
+    return lines, time.perf_counter() - start
+
+
+def _parse_gzip_range(task):  # pragma: no cover
+    """Decompress and parse the lines of a range of gzip members.
+
+    As lines can span members, the pieces of lines found before the first newline
+    and after the last one are returned as they are, along with the parsed lines.
+    If there is no newline at all the head is None.
+    """
+    log, range_start, range_end = task
+    content = read_gzip_members(log.logfile, range_start, range_end)
+    raw_lines = content.split(b'\n')
+    tail = raw_lines.pop()
+    if not raw_lines:
+        return None, [], tail
+    head = raw_lines[0]
+    raw_lines = (raw_line.decode(errors='replace') for raw_line in raw_lines[1:])
+    lines = list(_parse_raw_lines(raw_lines, log.fields, log.raw_filters))
+    return head, lines, tail
+
+
+def _map_range(task):  # pragma: no cover
+    log, range_start, range_end, commands, filters, negate_filter = task
+    # the task may be run on the main process, see `haproxy.engine.SerialEngine`
+    log = copy.copy(log)
+    commands = copy.deepcopy(commands)
+    log.valid_lines = log.invalid_lines = 0
+    lines = log._read_range(range_start, range_end)
+    _run_commands(lines, commands, filters, negate_filter)
+    return commands, log.valid_lines, log.invalid_lines, log.past_end
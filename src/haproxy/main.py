@@ -1,18 +1,43 @@
+from haproxy.commands import GROUP_KEYS
+from haproxy.commands import GroupBy
+from haproxy.commands import UNGROUPABLE_ATTRIBUTES
+from haproxy.engine import create_engine
+from haproxy.engine import ENGINES
+from haproxy.incremental import IncrementalState
+from haproxy.line import Line
 from haproxy.logfile import Log
+from haproxy.logfile import Logs
+from haproxy.readers import detect_compression
+from haproxy.utils import compile_filters
+from haproxy.utils import raw_substrings
 from haproxy.utils import VALID_COMMANDS
 from haproxy.utils import VALID_FILTERS
 from haproxy.utils import validate_arg_date
 from haproxy.utils import validate_arg_delta
 
 import argparse
+import glob
 import os
+import time
+
+
+#: Default seconds between outputs of the results when following a log file.
+FOLLOW_INTERVAL = 10
 
 
 def create_parser():
     desc = 'Analyze HAProxy log files and outputs statistics about it'
     parser = argparse.ArgumentParser(description=desc)
 
-    parser.add_argument('-l', '--log', help='HAProxy log file to analyze')
+    parser.add_argument(
+        '-l',
+        '--log',
+        nargs='+',
+        action='extend',
+        help='HAProxy log files to analyze, e.g. all the rotations of a day or '
+        'one per load balancer. Glob patterns, quoted, are expanded. '
+        'Their results are merged. Use - to read the standard input.',
+    )
 
     parser.add_argument(
         '-s',
@@ -68,6 +93,129 @@ def create_parser():
         '--list-filters', action='store_true', help='Lists all filters available.'
     )
 
+    parser.add_argument(
+        '--map-reduce',
+        action='store_true',
+        help='Split the log file between processes, each of them filtering and '
+        'running the commands on its part, and merge their results. '
+        'Lines printed by the print command are not kept in order.',
+    )
+
+    parser.add_argument(
+        '--seek',
+        action='store_true',
+        help='Assume the log file is ordered by time and jump straight to the '
+        'start time (-s) instead of reading the whole file, '
+        'stop reading as soon as lines are past the time delta (-d).',
+    )
+
+    parser.add_argument(
+        '--index',
+        action='store_true',
+        help='Keep a time index next to the log file (LOG.hlaidx), '
+        'building or updating it as needed, and use it to only read the lines '
+        'between the start time (-s) and the time delta (-d).',
+    )
+
+    parser.add_argument(
+        '--cache',
+        action='store_true',
+        help='Keep the parsed lines next to the log file (LOG.hlacache), '
+        'building it when missing or outdated, '
+        'so that later runs do not need to parse the log file again.',
+    )
+
+    parser.add_argument(
+        '--state',
+        help='Save on this file the results of the commands and how much of the '
+        'log file was read. Later runs, with the same options, only read the lines '
+        'added to the log file since and add them to the saved results. '
+        'Rotated and truncated log files are detected.',
+    )
+
+    parser.add_argument(
+        '--follow',
+        action='store_true',
+        help='Keep reading the lines added to the log file, like tail -f does, '
+        'and output the results of the commands every once in a while (see '
+        '--interval) until interrupted. Commands keeping lists of lines, '
+        'like print or slow_requests, keep growing.',
+    )
+
+    parser.add_argument(
+        '--interval',
+        type=float,
+        help=f'Seconds between outputs of the results with --follow '
+        f'(default: {FOLLOW_INTERVAL}).',
+    )
+
+    parser.add_argument(
+        '--max-pending',
+        type=int,
+        help='Maximum amount of parts of the log files sent to be parsed and not '
+        'processed yet, which bounds memory usage when commands are slower than '
+        'parsing (default: twice the amount of processes).',
+    )
+
+    parser.add_argument(
+        '--engine',
+        choices=sorted(ENGINES),
+        help='How to parse the log files: serially, on threads or on processes '
+        '(default: serially for small log files, on processes otherwise).',
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='Amount of worker processes parsing the log files '
+        '(default: one per CPU).',
+    )
+
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        help='Amount of lines sent at once to workers when reading the standard '
+        'input or compressed log files (default: adapted to how long workers '
+        'take to parse them).',
+    )
+
+    parser.add_argument(
+        '--top',
+        type=int,
+        help='Amount of values reported by the top_ips and top_request_paths '
+        'commands (default: 10).',
+    )
+
+    parser.add_argument(
+        '--top-capacity',
+        type=int,
+        help='Amount of values whose counts are kept by the top_ips and '
+        'top_request_paths commands, which bounds their memory usage. '
+        'Counts of less frequent values may be overestimated, by up to the '
+        'error shown. 0 counts all values exactly (default: 10000).',
+    )
+
+    parser.add_argument(
+        '--distinct',
+        help='Line attribute whose distinct values the distinct_count command '
+        'counts (default: ip).',
+    )
+
+    parser.add_argument(
+        '--group-by',
+        help='Comma separated keys to group the results of the distinct_count '
+        'and group_by commands by: Line attributes (but accept_date), or minute, '
+        'hour and status_family, e.g. backend_name,minute.',
+    )
+
+    parser.add_argument(
+        '--aggregate',
+        help='Comma separated aggregates computed by the group_by command for '
+        'every group: count, or sum, min, max or histogram of a numeric Line '
+        'attribute, e.g. count,sum[bytes_read],histogram[total_time] '
+        '(default: count).',
+    )
+
     parser.add_argument('--json', action='store_true', help='Output results in json.')
     parser.add_argument(
         '--invalid',
@@ -91,6 +239,22 @@ def parse_arguments(args):
         'list_filters': None,
         'json': None,
         'invalid_lines': None,
+        'map_reduce': None,
+        'seek': None,
+        'index': None,
+        'cache': None,
+        'state': None,
+        'follow': None,
+        'interval': None,
+        'max_pending': None,
+        'workers': None,
+        'batch_size': None,
+        'engine': None,
+        'top': None,
+        'top_capacity': None,
+        'distinct': None,
+        'group_by': None,
+        'aggregates': None,
     }
 
     if args.list_commands:
@@ -121,8 +285,7 @@ def parse_arguments(args):
         data['filters'] = parse_arg_filters(args.filter)
 
     if args.log is not None:
-        _validate_arg_logfile(args.log)
-        data['log'] = args.log
+        data['log'] = _expand_arg_logfiles(args.log)
 
     if args.json is not None:
         data['json'] = args.json
@@ -130,6 +293,88 @@ def parse_arguments(args):
     if args.invalid:
         data['invalid_lines'] = args.json
 
+    if args.map_reduce:
+        data['map_reduce'] = True
+
+    if args.seek:
+        data['seek'] = True
+
+    if args.index:
+        data['index'] = True
+
+    if args.cache:
+        data['cache'] = True
+
+    if args.state is not None:
+        if data['log'] is not None:
+            if '-' in data['log']:
+                raise ValueError('--state can not be used with the standard input')
+            if len(data['log']) > 1:
+                raise ValueError('--state can only be used with a single log file')
+            if detect_compression(data['log'][0]):
+                raise ValueError('--state can not be used with compressed log files')
+        data['state'] = args.state
+
+    if args.follow:
+        if args.state is not None:
+            raise ValueError('--follow and --state can not be used together')
+        if data['log'] is not None:
+            if '-' in data['log']:
+                raise ValueError('--follow can not be used with the standard input')
+            if len(data['log']) > 1:
+                raise ValueError('--follow can only be used with a single log file')
+            if detect_compression(data['log'][0]):
+                raise ValueError('--follow can not be used with compressed log files')
+        data['follow'] = True
+
+    if args.interval is not None:
+        if args.interval <= 0:
+            raise ValueError(f'--interval should be positive, got {args.interval}')
+        data['interval'] = args.interval
+
+    if args.max_pending is not None:
+        if args.max_pending <= 0:
+            raise ValueError(
+                f'--max-pending should be positive, got {args.max_pending}'
+            )
+        data['max_pending'] = args.max_pending
+
+    for name in ('workers', 'batch_size'):
+        value = getattr(args, name)
+        if value is not None:
+            if value <= 0:
+                option = name.replace('_', '-')
+                raise ValueError(f'--{option} should be positive, got {value}')
+            data[name] = value
+
+    if args.engine is not None:
+        data['engine'] = args.engine
+
+    if args.top is not None:
+        if args.top <= 0:
+            raise ValueError(f'--top should be positive, got {args.top}')
+        data['top'] = args.top
+
+    if args.top_capacity is not None:
+        if args.top_capacity < 0:
+            raise ValueError(
+                f'--top-capacity should not be negative, got {args.top_capacity}'
+            )
+        data['top_capacity'] = args.top_capacity
+
+    if args.distinct is not None:
+        if args.distinct in GROUP_KEYS or ',' in args.distinct:
+            raise ValueError(
+                f'--distinct should be a single Line attribute, got {args.distinct}'
+            )
+        data['distinct'] = parse_arg_line_keys(args.distinct, '--distinct')[0]
+
+    if args.group_by is not None:
+        data['group_by'] = parse_arg_line_keys(args.group_by, '--group-by')
+
+    if args.aggregate is not None:
+        data['aggregates'] = parse_arg_aggregates(args.aggregate)
+
     return data
 
 
@@ -144,6 +389,53 @@ def parse_arg_commands(commands_list):
     return input_commands
 
 
+def parse_arg_line_keys(keys_arg, option):
+    """Return the comma separated keys, Line attributes or group keys, as a list.
+
+    See :data:`haproxy.commands.GROUP_KEYS`.
+    """
+    keys = keys_arg.split(',')
+    for key in keys:
+        is_attribute = key in Line.__slots__ or isinstance(
+            getattr(Line, key, None), property
+        )
+        if not is_attribute and key not in GROUP_KEYS:
+            raise ValueError(
+                f'{option} key "{key}" is neither a Line attribute, '
+                f'nor one of {", ".join(GROUP_KEYS)}.'
+            )
+        if key in UNGROUPABLE_ATTRIBUTES:
+            raise ValueError(
+                f'{option} key "{key}" can not be used, use minute or hour instead.'
+            )
+    return keys
+
+
+def parse_arg_aggregates(aggregates_arg):
+    """Return the aggregates of the group_by command as (name, attribute) tuples.
+
+    The attribute of ``count`` is None.
+    """
+    aggregates = []
+    for aggregate_expression in aggregates_arg.split(','):
+        if aggregate_expression == 'count':
+            aggregates.append(('count', None))
+            continue
+        name, _, attribute = aggregate_expression.partition('[')
+        if (
+            name not in GroupBy.aggregate_names
+            or not attribute.endswith(']')
+            or attribute[:-1] not in GroupBy.numeric_attributes
+        ):
+            raise ValueError(
+                f'aggregate "{aggregate_expression}" is not valid. '
+                f'Use count or one of {", ".join(GroupBy.aggregate_names)} '
+                f'of a numeric Line attribute, e.g. sum[bytes_read].'
+            )
+        aggregates.append((name, attribute[:-1]))
+    return aggregates
+
+
 def parse_arg_filters(filters_arg):
     input_filters = filters_arg.split(',')
 
@@ -171,6 +463,21 @@ def parse_arg_filters(filters_arg):
     return return_data
 
 
+def _expand_arg_logfiles(patterns):
+    """Return the log files matching the glob patterns, each of them only once.
+
+    ``-``, the standard input, is kept as is.
+    """
+    filenames = []
+    for pattern in patterns:
+        filenames.extend(sorted(glob.glob(pattern)) or [pattern])
+    filenames = list(dict.fromkeys(filenames))
+    for filename in filenames:
+        if filename != '-':
+            _validate_arg_logfile(filename)
+    return filenames
+
+
 def _validate_arg_logfile(filename):
     filepath = os.path.join(os.getcwd(), filename)
     if not os.path.exists(filepath):
@@ -192,7 +499,28 @@ def print_filters():
 def show_help(data):
     # make sure that if no arguments are passed the help is shown
     show = True
-    ignore_keys = ('log', 'json', 'negate_filter', 'invalid_lines')
+    ignore_keys = (
+        'log',
+        'json',
+        'negate_filter',
+        'invalid_lines',
+        'map_reduce',
+        'seek',
+        'index',
+        'cache',
+        'state',
+        'follow',
+        'interval',
+        'max_pending',
+        'workers',
+        'batch_size',
+        'engine',
+        'top',
+        'top_capacity',
+        'distinct',
+        'group_by',
+        'aggregates',
+    )
     for key in data:
         if data[key] is not None and key not in ignore_keys:
             show = False
@@ -221,32 +549,64 @@ def main(args):
         # no need to process further
         return
 
-    # initialize the log file
-    log_file = Log(
-        logfile=args['log'],
-        start=args['start'],
-        delta=args['delta'],
-        show_invalid=args['invalid_lines'],
-    )
-
     # get the commands and filters to use
     filters_to_use = requested_filters(args)
     cmds_to_use = requested_commands(args)
 
-    # double negation: when a user wants to negate the filters,
-    # the argument parsing sets `negate_filter` to True,
-    # but the filtering logic (the `all()`) returns True if the line meets all filters
-    # so reversing whatever `negate_filter` has is what the user wants :)
-    expected_filtering = True
-    if args['negate_filter']:
-        expected_filtering = False
-    # process all log lines
-    for line in log_file:
-        if all(f(line) for f in filters_to_use) is expected_filtering:
-            for cmd in cmds_to_use:
-                cmd(line)
+    # only process what was not processed on previous runs
+    state = None
+    byte_ranges = [(logfile, None) for logfile in args['log']]
+    if args['state']:
+        state = IncrementalState.load(
+            args['state'], args['log'][0], state_settings(args)
+        )
+        cmds_to_use = state.restore(cmds_to_use)
+        byte_ranges = state.pending()
+
+    # lines lacking what the filters look for are skipped before being parsed,
+    # unless the filters are negated or invalid lines are to be shown
+    raw_filters = ()
+    if not args['negate_filter'] and not args['invalid_lines']:
+        raw_filters = raw_substrings(filters_to_use.filter_funcs)
+
+    # initialize the log files
+    log_files = [
+        Log(
+            logfile=logfile,
+            start=args['start'],
+            delta=args['delta'],
+            show_invalid=args['invalid_lines'],
+            fields=requested_fields(args),
+            seek=args['seek'],
+            index=args['index'],
+            cache=args['cache'],
+            byte_range=byte_range,
+            raw_filters=raw_filters,
+        )
+        for logfile, byte_range in byte_ranges
+    ]
+    if args['follow']:
+        follow_log(log_files[0], cmds_to_use, filters_to_use, args)
+        return
+    ordered = any(cmd.ordered for cmd in cmds_to_use)
+    log_files = Logs(log_files, ordered)
+    log_files.engine = create_engine(
+        args['engine'],
+        log_files.size,
+        args['workers'],
+        args['max_pending'],
+        args['batch_size'],
+    )
+    with log_files.engine:
+        process_log(log_files, cmds_to_use, filters_to_use, args)
+
+    if state is not None:
+        state.save(cmds_to_use)
 
-    # print the results
+    print_results(cmds_to_use, args)
+
+
+def print_results(cmds_to_use, args):
     print('\nRESULTS\n')
     output = None
     if args['json']:
@@ -255,23 +615,97 @@ def main(args):
         cmd.results(output=output)
 
 
+def process_log(log_file, cmds_to_use, filters_to_use, args):
+    """Run the commands on the lines of the log file(s) that pass the filters.
+
+    ``log_file`` is either a :class:`haproxy.logfile.Log` or
+    a :class:`haproxy.logfile.Logs`.
+    """
+    # process all log lines
+    if args['map_reduce']:
+        log_file.map_reduce(cmds_to_use, args['filters'], args['negate_filter'])
+    else:
+        for line in log_file:
+            if filters_to_use(line):
+                for cmd in cmds_to_use:
+                    cmd(line)
+
+
 def requested_filters(args):
-    filters_list = []
-    if args['filters']:
-        for filter_name, arg in args['filters']:
-            filter_func = VALID_FILTERS[filter_name]['obj']
-            filters_list.append(filter_func(arg))
-    return filters_list
+    """Return the requested filters, and their negation, compiled into a predicate."""
+    return compile_filters(args['filters'] or [], args['negate_filter'])
 
 
 def requested_commands(args):
     cmds_list = []
     for command in args['commands']:
         cmd_klass = VALID_COMMANDS[command]['klass']
-        cmds_list.append(cmd_klass())
+        cmds_list.append(cmd_klass.from_arguments(args))
     return cmds_list
 
 
+def follow_log(log_file, cmds_to_use, filters_to_use, args):
+    """Keep running the commands on the lines appended to the log file.
+
+    Their results are printed every ``--interval`` seconds,
+    and a last time when interrupted.
+    """
+    interval = args['interval'] or FOLLOW_INTERVAL
+    next_output = time.monotonic() + interval
+    try:
+        for line in log_file.follow(timeout=interval):
+            if line is not None:
+                if filters_to_use(line):
+                    for cmd in cmds_to_use:
+                        cmd(line)
+            if time.monotonic() >= next_output:
+                print_results(cmds_to_use, args)
+                next_output = time.monotonic() + interval
+    except KeyboardInterrupt:
+        pass
+    print_results(cmds_to_use, args)
+
+
+def state_settings(args):
+    """Return the arguments that the results saved with ``--state`` depend on."""
+    return {
+        key: args[key]
+        for key in (
+            'commands',
+            'filters',
+            'negate_filter',
+            'start',
+            'delta',
+            'top',
+            'top_capacity',
+            'distinct',
+            'group_by',
+            'aggregates',
+        )
+    }
+
+
+def requested_fields(args):
+    """Return the Line attributes that the requested commands and filters read.
+
+    None if any of them does not declare them, i.e. all attributes are needed.
+    """
+    fields = set()
+    for command in args['commands']:
+        # commands reading Line attributes given as arguments tell them once created
+        cmd_fields = VALID_COMMANDS[command]['klass'].from_arguments(args).fields
+        if cmd_fields is None:
+            return None
+        fields.update(cmd_fields)
+    if args['filters']:
+        for filter_name, _ in args['filters']:
+            filter_fields = getattr(VALID_FILTERS[filter_name]['obj'], 'fields', None)
+            if filter_fields is None:
+                return None
+            fields.update(filter_fields)
+    return fields
+
+
 def console_script():  # pragma: no cover
     parser = create_parser()
     arguments = parse_arguments(parser.parse_args())
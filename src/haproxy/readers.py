@@ -0,0 +1,272 @@
+import bz2
+import gzip
+import hashlib
+import lzma
+import mmap
+import os
+import zlib
+
+
+#: Amount of bytes decoded at once when reading a range of a log file.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+#: Once the bisection of a file narrows down to this amount of bytes it stops,
+#: reading them is faster than probing further.
+BISECT_PRECISION = 64 * 1024
+
+#: Amount of bytes, from the start of a log file, used to tell whether
+#: it is still the same file that was read before.
+FINGERPRINT_SIZE = 4096
+
+#: Magic bytes compressed files start with, and their compression.
+COMPRESSION_MAGICS = {
+    b'\x1f\x8b': 'gzip',
+    b'BZh': 'bz2',
+    b'\xfd7zXZ\x00': 'xz',
+}
+
+#: How to open files with each compression.
+OPENERS = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+#: Magic bytes of a gzip member using deflate, the only method there is.
+GZIP_MEMBER_MAGIC = b'\x1f\x8b\x08'
+
+#: Bytes decompressed to tell whether a gzip member starts at some offset.
+GZIP_PROBE_SIZE = 64 * 1024
+
+
+def split_ranges(path, parts, start=0, end=None):
+    """Cut a file in, at most, ``parts`` ranges of bytes.
+
+    Ranges are returned as (start, end) tuples,
+    they are aligned to line boundaries so no line is split between two ranges.
+    ``start`` and ``end`` are the offsets, expected to be line boundaries,
+    of the part of the file to split, by default all of it.
+    """
+    size = os.path.getsize(path)
+    if end is not None:
+        size = min(size, end)
+    if start >= size:
+        return []
+
+    with open(path, 'rb') as file_obj, mmap.mmap(
+        file_obj.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        boundaries = [start]
+        for part in range(1, parts):
+            offset = start + (size - start) * part // parts
+            newline = data.find(b'\n', max(offset, boundaries[-1]))
+            if newline == -1:
+                break
+            if newline + 1 < size:
+                boundaries.append(newline + 1)
+        boundaries.append(size)
+
+    return [
+        (range_start, range_end)
+        for range_start, range_end in zip(boundaries, boundaries[1:])
+        if range_start < range_end
+    ]
+
+
+def read_range(path, range_start, range_end, encoding='utf-8'):
+    """Yield the lines of a file found on the given range of bytes.
+
+    The range is expected to be aligned to line boundaries,
+    see :func:`split_ranges`.
+    It is read in chunks of :data:`CHUNK_SIZE` bytes, newlines are removed.
+    """
+    with open(path, 'rb') as file_obj, mmap.mmap(
+        file_obj.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        position = range_start
+        while position < range_end:
+            chunk_end = min(position + CHUNK_SIZE, range_end)
+            if chunk_end < range_end:
+                newline = data.rfind(b'\n', position, chunk_end)
+                if newline == -1:
+                    newline = data.find(b'\n', chunk_end, range_end)
+                chunk_end = range_end if newline == -1 else newline + 1
+
+            lines = data[position:chunk_end].decode(encoding, errors='replace')
+            lines = lines.split('\n')
+            if not lines[-1]:
+                # the chunk ends with a newline
+                lines.pop()
+            yield from lines
+            position = chunk_end
+
+
+def bisect_lines(path, is_before, precision=None):
+    """Find where a line sits on a file sorted by some criteria.
+
+    ``is_before`` is called with a line and returns True if the line sorts
+    before the wanted one, False if it does not, or None if it can not tell
+    (e.g. the line can not be parsed), in which case the next lines are tried.
+
+    The offset returned is a line boundary, at most ``precision`` bytes plus a line
+    before the first line for which ``is_before`` returns False.
+    Defaults to :data:`BISECT_PRECISION`.
+    """
+    if precision is None:
+        precision = BISECT_PRECISION
+    size = os.path.getsize(path)
+    if not size:
+        return 0
+
+    with open(path, 'rb') as file_obj, mmap.mmap(
+        file_obj.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        low = 0
+        high = size
+        while high - low > precision:
+            middle = (low + high) // 2
+            position = _line_start(data, middle)
+            before = None
+            while before is None and position < high:
+                newline = data.find(b'\n', position)
+                if newline == -1:
+                    newline = size
+                before = is_before(data[position:newline].decode(errors='replace'))
+                position = newline + 1
+            if before:
+                low = middle
+            else:
+                high = middle
+        return _line_start(data, low)
+
+
+def _line_start(data, offset):
+    """Return the start of the first line starting at, or after, ``offset``."""
+    if offset == 0:
+        return 0
+    newline = data.find(b'\n', offset - 1)
+    if newline == -1:
+        return len(data)
+    return newline + 1
+
+
+def last_line_end(path):
+    """Return the offset right after the last newline of a file.
+
+    Lines after it are still being written, i.e. they are incomplete.
+    """
+    if not os.path.getsize(path):
+        return 0
+    with open(path, 'rb') as file_obj, mmap.mmap(
+        file_obj.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        return data.rfind(b'\n') + 1
+
+
+def fingerprint(path, size):
+    """Hash the start, up to ``size`` bytes, of a file."""
+    with open(path, 'rb') as file_obj:
+        content = file_obj.read(min(size, FINGERPRINT_SIZE))
+    return hashlib.sha1(content).hexdigest()
+
+
+def detect_compression(path):
+    """Return the compression of a file (gzip, bz2 or xz), or None if it has none.
+
+    The compression is detected by the magic bytes the file starts with.
+    """
+    with open(path, 'rb') as file_obj:
+        start = file_obj.read(8)
+    for magic, compression in COMPRESSION_MAGICS.items():
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def open_compressed(path):
+    """Return a binary file object with the decompressed content of a file."""
+    return OPENERS[detect_compression(path)](path, 'rb')
+
+
+def read_lines(file_obj, encoding='utf-8'):
+    """Yield the lines of a binary file object, without newlines.
+
+    It is read in chunks of, at most, :data:`CHUNK_SIZE` bytes.
+    Pipes, like the standard input, are read as data arrives instead of
+    waiting for a whole chunk, so that lines are processed as they are logged.
+    """
+    read = file_obj.read
+    if hasattr(file_obj, 'read1') and not file_obj.seekable():
+        read = file_obj.read1
+    pending = b''
+    chunk = read(CHUNK_SIZE)
+    while chunk:
+        *lines, pending = (pending + chunk).split(b'\n')
+        for line in lines:
+            yield line.decode(encoding, errors='replace')
+        chunk = read(CHUNK_SIZE)
+    if pending:
+        yield pending.decode(encoding, errors='replace')
+
+
+def split_gzip_members(path, parts):
+    """Cut a gzip file in, at most, ``parts`` ranges of whole members.
+
+    Files made of many gzip members, e.g. compressed in parallel or concatenated,
+    can be decompressed in parallel, one range of members each.
+    Files with a single member get a single range.
+    Ranges are returned as (start, end) tuples, see :func:`read_gzip_members`.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file_obj, mmap.mmap(
+        file_obj.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        starts = [0]
+        for part in range(1, parts):
+            offset = max(size * part // parts, starts[-1] + 1)
+            member = _find_gzip_member(data, offset, size * (part + 1) // parts)
+            if member is not None:
+                starts.append(member)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _find_gzip_member(data, offset, limit):
+    """Return where the first gzip member between ``offset`` and ``limit`` starts.
+
+    As the magic bytes of gzip members can show up in compressed data too,
+    a member is only taken as such if its start can be decompressed.
+    """
+    while True:
+        candidate = data.find(
+            GZIP_MEMBER_MAGIC, offset, limit + len(GZIP_MEMBER_MAGIC) - 1
+        )
+        if candidate == -1:
+            return None
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            decompressor.decompress(data[candidate : candidate + GZIP_PROBE_SIZE])
+        except zlib.error:
+            offset = candidate + 1
+        else:
+            return candidate
+
+
+def read_gzip_members(path, range_start, range_end):
+    """Return the decompressed content of the gzip members on a range of bytes.
+
+    The range is expected to be made of whole members,
+    see :func:`split_gzip_members`.
+    """
+    output = []
+    with open(path, 'rb') as file_obj, mmap.mmap(
+        file_obj.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        position = range_start
+        while position < range_end:
+            if data[position] == 0 and not data[position:range_end].strip(b'\x00'):
+                # padding after the last member
+                break
+            decompressor = zlib.decompressobj(wbits=31)
+            while not decompressor.eof:
+                chunk = data[position : min(position + CHUNK_SIZE, range_end)]
+                if not chunk:
+                    raise EOFError(f'{path} ended before the end of a gzip member')
+                output.append(decompressor.decompress(chunk))
+                position += len(chunk) - len(decompressor.unused_data)
+    return b''.join(output)
@@ -0,0 +1,243 @@
+from hashlib import blake2b
+
+import math
+
+
+#: Relative error of the values returned by :meth:`Histogram.percentile`.
+RELATIVE_ACCURACY = 0.01
+
+
+class Histogram:
+    """Mergeable histogram of positive values, e.g. times in milliseconds.
+
+    Values are counted on buckets whose width grows with the values, rather than
+    kept, so that percentiles are within ``relative_accuracy`` of the real ones
+    (or half a unit, as they are rounded) whatever the amount of values.
+    With the default 1% accuracy, at most 914 buckets are needed for values
+    between 1 millisecond and 1 day.
+
+    Bucket ``i`` counts the values in ``(gamma ** (i - 1), gamma ** i]``,
+    with ``gamma = (1 + relative_accuracy) / (1 - relative_accuracy)``.
+    Values of 0, or below, are counted apart, as 0.
+
+    The sum, minimum and maximum of the values are kept exactly.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._multiplier = 1 / math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) * self._multiplier)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        """Add the values counted by another histogram with the same accuracy."""
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return round(self.total / self.count, 2)
+
+    def percentile(self, percent):
+        """Return the smallest value that ``percent`` (0 to 100) of the values are
+        below of, or equal to, i.e. its nearest rank.
+
+        None if no value was added.
+        """
+        if not self.count:
+            return None
+        rank = max(math.ceil(percent / 100 * self.count) - 1, 0)
+        seen = self.zeros
+        if rank < seen:
+            return max(self.min, 0)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # the value with the least relative error for the whole bucket
+                value = 2 * self.gamma**index / (self.gamma + 1)
+                return min(max(round(value), self.min), self.max)
+        return self.max  # pragma: no cover
+
+    def to_state(self):
+        """Return the histogram as JSON serializable data, see :meth:`from_state`."""
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'buckets': list(self.buckets.items()),
+            'zeros': self.zeros,
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        histogram = cls(state['relative_accuracy'])
+        histogram.buckets.update(state['buckets'])
+        histogram.zeros = state['zeros']
+        histogram.count = state['count']
+        histogram.total = state['total']
+        histogram.min = state['min']
+        histogram.max = state['max']
+        return histogram
+
+
+class SpaceSaving:
+    """Mergeable counts of the most frequent values (heavy hitters).
+
+    Only the counts of, at most, twice ``capacity`` values are kept:
+    when there are more, the ``capacity`` most frequent ones are kept, and
+    the highest count of the values dropped becomes the ``floor``,
+    an upper bound of the count of any value not kept.
+    Values seen afterwards start counting from the floor,
+    so counts are never underestimated, and overestimated by, at most,
+    their ``error``: the floor when they started to be counted.
+
+    Without a capacity all values are counted exactly.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        # value: [count, error]
+        self.counters = {}
+        self.floor = 0
+
+    def add(self, value):
+        counter = self.counters.get(value)
+        if counter is not None:
+            counter[0] += 1
+            return
+        self.counters[value] = [self.floor + 1, self.floor]
+        if self.capacity is not None and len(self.counters) > 2 * self.capacity:
+            self._purge()
+
+    def merge(self, other):
+        """Add the counts of another summary, of values seen on other lines."""
+        for value, counter in self.counters.items():
+            if value not in other.counters:
+                counter[0] += other.floor
+                counter[1] += other.floor
+        for value, (count, error) in other.counters.items():
+            counter = self.counters.get(value)
+            if counter is None:
+                self.counters[value] = [count + self.floor, error + self.floor]
+            else:
+                counter[0] += count
+                counter[1] += error
+        self.floor += other.floor
+        if self.capacity is not None and len(self.counters) > 2 * self.capacity:
+            self._purge()
+
+    def _purge(self):
+        """Keep the ``capacity`` most frequent values, raising the floor."""
+        ranked = sorted(
+            self.counters.items(), key=lambda item: item[1][0], reverse=True
+        )
+        kept = ranked[: self.capacity]
+        self.floor = max(self.floor, ranked[self.capacity][1][0])
+        self.counters = dict(kept)
+
+    def top(self, amount):
+        """Return (value, count, error) tuples of the most frequent values.
+
+        The real count of every value is between ``count - error`` and ``count``.
+        """
+        ranked = sorted(
+            self.counters.items(), key=lambda item: item[1][0], reverse=True
+        )
+        return [(value, count, error) for value, (count, error) in ranked[:amount]]
+
+    def to_state(self):
+        """Return the summary as JSON serializable data, see :meth:`from_state`."""
+        return {
+            'capacity': self.capacity,
+            'counters': [
+                [value, count, error] for value, (count, error) in self.counters.items()
+            ],
+            'floor': self.floor,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        summary = cls(state['capacity'])
+        for value, count, error in state['counters']:
+            summary.counters[value] = [count, error]
+        summary.floor = state['floor']
+        return summary
+
+
+class HyperLogLog:
+    """Mergeable estimate of the amount of distinct values seen.
+
+    Values are hashed, and only the longest run of leading zero bits of the
+    hashes landing on each of the ``2 ** precision`` registers is kept, i.e.
+    4 KB with the default precision of 12, whatever the amount of values.
+    The standard error of the estimate is ``1.04 / sqrt(2 ** precision)``,
+    1.6% by default, and small amounts are counted almost exactly.
+
+    Values are hashed with blake2b, rather than ``hash()``, so that registers
+    filled on different processes can be merged.
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(2**precision)
+
+    def add(self, value):
+        digest = blake2b(str(value).encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Add the values seen by another estimate with the same precision."""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size**2 / sum(2.0**-rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # few values, count the registers never hit instead
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+    def to_state(self):
+        """Return the estimate as JSON serializable data, see :meth:`from_state`."""
+        return {'precision': self.precision, 'registers': self.registers.hex()}
+
+    @classmethod
+    def from_state(cls, state):
+        estimate = cls(state['precision'])
+        estimate.registers = bytearray.fromhex(state['registers'])
+        return estimate
@@ -0,0 +1,183 @@
+from datetime import timedelta
+from haproxy.engine import create_engine
+from haproxy.line import EPOCH
+from haproxy.line import parse_line
+from haproxy.readers import fingerprint
+from haproxy.readers import split_ranges
+
+import json
+import mmap
+import os
+
+
+#: Suffix added to the log file path to get the path of its index.
+INDEX_SUFFIX = '.hlaidx'
+
+#: Bumped whenever the index format changes, older indexes are rebuilt.
+INDEX_VERSION = 1
+
+#: Lines are indexed on buckets of this time span.
+BUCKET_SIZE = timedelta(minutes=1)
+
+#: Size of the ranges of bytes each worker indexes.
+INDEX_RANGE_SIZE = 16 * 1024 * 1024
+
+
+class TimeIndex:
+    """Map time buckets of a log file to the bytes where their lines are.
+
+    For every bucket the offsets of its first line and of the end of its last
+    line are kept, so lines do not need to be perfectly sorted by time.
+
+    The size, modification time and a fingerprint of the start of the log file
+    are recorded as well, so that when the log file grows
+    only the new lines need to be indexed.
+    """
+
+    def __init__(self, logfile, path=None):
+        self.logfile = logfile
+        self.path = path or f'{logfile}{INDEX_SUFFIX}'
+        # Amount of bytes of the log file indexed, always up to a line end
+        self.size = 0
+        self.mtime = None
+        self.fingerprint = None
+        # bucket number -> [first line start, last line end]
+        self.buckets = {}
+
+    @classmethod
+    def load(cls, logfile, path=None):
+        """Load the index of a log file, or an empty one if there is none."""
+        index = cls(logfile, path)
+        try:
+            with open(index.path) as file_obj:
+                data = json.load(file_obj)
+        except (OSError, ValueError):
+            return index
+
+        if data.get('version') == INDEX_VERSION:
+            index.size = data['size']
+            index.mtime = data['mtime']
+            index.fingerprint = data['fingerprint']
+            index.buckets = {
+                int(bucket): offsets for bucket, offsets in data['buckets'].items()
+            }
+        return index
+
+    def save(self):
+        with open(self.path, 'w') as file_obj:
+            json.dump(
+                {
+                    'version': INDEX_VERSION,
+                    'size': self.size,
+                    'mtime': self.mtime,
+                    'fingerprint': self.fingerprint,
+                    'buckets': self.buckets,
+                },
+                file_obj,
+            )
+
+    def update(self, engine=None):
+        """Index the lines added to the log file since the index was last saved.
+
+        If the log file shrank or was replaced, it is indexed from scratch.
+        Ranges of the log file are indexed by the engine, see :mod:`haproxy.engine`,
+        by default the one best suited for their size, closed afterwards.
+        Returns whether the index changed.
+        """
+        stat = os.stat(self.logfile)
+        if stat.st_mtime_ns == self.mtime and stat.st_size == self.size:
+            return False
+        if stat.st_size <= self.size or (
+            fingerprint(self.logfile, self.size) != self.fingerprint
+        ):
+            self.size = 0
+            self.buckets = {}
+
+        parts = max(1, (stat.st_size - self.size) // INDEX_RANGE_SIZE)
+        tasks = [
+            (self.logfile, *byte_range)
+            for byte_range in split_ranges(self.logfile, parts, start=self.size)
+        ]
+        if engine is None:
+            with create_engine(size=stat.st_size - self.size) as engine:
+                results = list(engine.imap(_index_range, tasks))
+        else:
+            results = list(engine.imap(_index_range, tasks))
+
+        for buckets, indexed_end in results:
+            for bucket, (first, last) in buckets.items():
+                offsets = self.buckets.setdefault(bucket, [first, last])
+                offsets[0] = min(offsets[0], first)
+                offsets[1] = max(offsets[1], last)
+            self.size = max(self.size, indexed_end)
+        self.mtime = stat.st_mtime_ns
+        self.fingerprint = fingerprint(self.logfile, self.size)
+        return True
+
+    def byte_range(self, start=None, end=None):
+        """Return the (start, end) offsets where lines between both dates are.
+
+        The end offset is None when the lines may go up to the end of the file.
+        """
+        range_start = 0
+        if start is not None:
+            first_bucket = _bucket(start)
+            range_start = min(
+                (
+                    first
+                    for bucket, (first, _) in self.buckets.items()
+                    if bucket >= first_bucket
+                ),
+                default=self.size,
+            )
+
+        range_end = None
+        if end is not None:
+            last_bucket = _bucket(end)
+            range_end = max(
+                (
+                    last
+                    for bucket, (_, last) in self.buckets.items()
+                    if bucket <= last_bucket
+                ),
+                default=range_start,
+            )
+            range_end = max(range_start, range_end)
+
+        return range_start, range_end
+
+
+def _bucket(date):
+    return (date - EPOCH) // BUCKET_SIZE
+
+
+# it is not coverage covered as this is executed by the multiprocessor module
+def _index_range(task):  # pragma: no cover
+    """Index the complete lines found on the given range of bytes.
+
+    Returns the buckets found and where the last complete line ends.
+    """
+    logfile, range_start, range_end = task
+    bucket_ms = BUCKET_SIZE // timedelta(milliseconds=1)
+    buckets = {}
+    position = range_start
+    with open(logfile, 'rb') as file_obj, mmap.mmap(
+        file_obj.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        while position < range_end:
+            newline = data.find(b'\n', position, range_end)
+            if newline == -1:
+                break
+            line_start = position
+            position = newline + 1
+            raw_line = data[line_start:newline].decode(errors='replace')
+            line = parse_line(raw_line, ('accept_timestamp',))
+            if not line.is_valid:
+                continue
+            bucket = line.accept_timestamp // bucket_ms
+            offsets = buckets.get(bucket)
+            if offsets is None:
+                buckets[bucket] = [line_start, position]
+            else:
+                offsets[1] = position
+    return buckets, position
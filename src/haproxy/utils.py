@@ -112,6 +112,32 @@ def list_commands():
     return data
 
 
+def compile_filters(filters, negate_filter=False):
+    """Compile the (name, argument) filters into a single predicate.
+
+    See :class:`haproxy.filters.Predicate`.
+    """
+    from haproxy.filters import Predicate
+
+    clauses = []
+    for name, argument in filters:
+        factory = VALID_FILTERS[name]['obj']
+        clauses.append((factory(argument), factory.cost))
+    return Predicate(clauses, negate_filter)
+
+
+def raw_substrings(filter_funcs):
+    """Return the texts that raw lines contain whenever they pass all filters.
+
+    See :func:`haproxy.filters.raw_substring`.
+    """
+    return tuple(
+        filter_func.raw_substring
+        for filter_func in filter_funcs
+        if getattr(filter_func, 'raw_substring', None)
+    )
+
+
 def _strip_description(raw_text):
     if not raw_text:
         return ''
@@ -2,7 +2,9 @@ from haproxy.main import create_parser
 from haproxy.main import parse_arg_filters
 from haproxy.main import parse_arguments
 
+import gzip
 import pytest
+import re
 
 
 def test_parser_arguments_defaults():
@@ -20,6 +22,22 @@ def test_parser_arguments_defaults():
         'list_filters': None,
         'json': False,
         'invalid_lines': False,
+        'map_reduce': None,
+        'seek': None,
+        'index': None,
+        'cache': None,
+        'state': None,
+        'follow': None,
+        'interval': None,
+        'max_pending': None,
+        'workers': None,
+        'batch_size': None,
+        'engine': None,
+        'top': None,
+        'top_capacity': None,
+        'distinct': None,
+        'group_by': None,
+        'aggregates': None,
     }
 
 
@@ -31,6 +49,11 @@ def test_parser_arguments_defaults():
         ('--negate-filter', 'negate_filter'),
         ('-n', 'negate_filter'),
         ('--json', 'json'),
+        ('--map-reduce', 'map_reduce'),
+        ('--seek', 'seek'),
+        ('--index', 'index'),
+        ('--cache', 'cache'),
+        ('--follow', 'follow'),
     ],
 )
 def test_parser_boolean_arguments(argument, option):
@@ -143,7 +166,185 @@ def test_log_argument(filename, is_valid):
     parser = create_parser()
     if is_valid:
         data = parse_arguments(parser.parse_args(['-l', filename]))
-        assert data['log'] == filename
+        assert data['log'] == [filename]
     else:
         with pytest.raises(ValueError, match=f'{filename} does not exist'):
             parse_arguments(parser.parse_args(['-l', filename]))
+
+
+@pytest.mark.parametrize(
+    ('arguments', 'expected'),
+    [
+        (['-l', 'a.log', 'b.log'], ['a.log', 'b.log']),
+        (['-l', 'a.log', '-l', 'b.log'], ['a.log', 'b.log']),
+        (['-l', '*.log'], ['a.log', 'b.log']),
+        (['-l', '*.log', 'a.log'], ['a.log', 'b.log']),
+        (['-l', 'a.*'], ['a.log', 'a.log.1']),
+        (['-l', '-'], ['-']),
+    ],
+)
+def test_log_argument_many(tmp_path, monkeypatch, arguments, expected):
+    """Check that many log files, and glob patterns, can be given."""
+    for filename in ('a.log', 'a.log.1', 'b.log'):
+        (tmp_path / filename).write_text('')
+    monkeypatch.chdir(tmp_path)
+    parser = create_parser()
+    data = parse_arguments(parser.parse_args(arguments))
+    assert data['log'] == expected
+
+
+def test_log_argument_glob_no_match():
+    """Check that glob patterns not matching any file are reported."""
+    parser = create_parser()
+    with pytest.raises(ValueError, match='does not exist'):
+        parse_arguments(parser.parse_args(['-l', 'tests/files/*.missing']))
+
+
+@pytest.mark.parametrize('option', ['--state', '--follow'])
+@pytest.mark.parametrize(
+    ('logs', 'message'),
+    [
+        (['tests/files/small.log', 'tests/files/2_ok_1_invalid.log'], 'single'),
+        (['-'], 'standard input'),
+    ],
+)
+def test_log_argument_single_file_options(option, logs, message):
+    """Check that options working on a single log file refuse other inputs."""
+    parser = create_parser()
+    arguments = ['-l', *logs, option]
+    if option == '--state':
+        arguments.append('state.json')
+    with pytest.raises(ValueError, match=message):
+        parse_arguments(parser.parse_args(arguments))
+
+
+@pytest.mark.parametrize(
+    ('arguments', 'message'),
+    [
+        (['--interval', '2.5'], None),
+        (['--interval', '0'], '--interval should be positive, got 0.0'),
+        (['--interval', '-1'], '--interval should be positive, got -1.0'),
+        (['--max-pending', '0'], '--max-pending should be positive, got 0'),
+        (['--workers', '0'], '--workers should be positive, got 0'),
+        (['--batch-size', '-1'], '--batch-size should be positive, got -1'),
+        (
+            ['--follow', '--state', 'state.json'],
+            '--follow and --state can not be used together',
+        ),
+    ],
+)
+def test_follow_arguments(arguments, message):
+    """Check that the follow mode arguments are validated."""
+    parser = create_parser()
+    if message is None:
+        data = parse_arguments(parser.parse_args(arguments))
+        assert data['interval'] == 2.5
+    else:
+        with pytest.raises(ValueError, match=message):
+            parse_arguments(parser.parse_args(arguments))
+
+
+@pytest.mark.parametrize(
+    ('arguments', 'expected', 'message'),
+    [
+        (['--top', '3'], {'top': 3, 'top_capacity': None}, None),
+        (['--top-capacity', '100'], {'top': None, 'top_capacity': 100}, None),
+        (['--top-capacity', '0'], {'top': None, 'top_capacity': 0}, None),
+        (['--top', '0'], None, '--top should be positive, got 0'),
+        (['--top-capacity', '-1'], None, '--top-capacity should not be negative'),
+    ],
+)
+def test_top_arguments(arguments, expected, message):
+    """Check that the top commands arguments are validated."""
+    parser = create_parser()
+    if expected is not None:
+        data = parse_arguments(parser.parse_args(arguments))
+        assert {key: data[key] for key in expected} == expected
+    else:
+        with pytest.raises(ValueError, match=message):
+            parse_arguments(parser.parse_args(arguments))
+
+
+@pytest.mark.parametrize(
+    ('arguments', 'expected', 'message'),
+    [
+        (
+            ['--distinct', 'http_request_path'],
+            {'distinct': 'http_request_path'},
+            None,
+        ),
+        (['--distinct', 'ip'], {'distinct': 'ip'}, None),
+        (['--group-by', 'backend_name'], {'group_by': ['backend_name']}, None),
+        (
+            ['--group-by', 'minute,status_family,is_https'],
+            {'group_by': ['minute', 'status_family', 'is_https']},
+            None,
+        ),
+        (['--distinct', 'minute'], None, 'should be a single Line attribute'),
+        (['--distinct', 'ip,server_name'], None, 'should be a single Line attribute'),
+        (['--distinct', 'unknown'], None, 'is neither a Line attribute'),
+        (['--distinct', 'accept_date'], None, 'use minute or hour instead'),
+        (['--group-by', 'backend_name,unknown'], None, 'is neither a Line attribute'),
+        (['--group-by', 'is_within_time_frame'], None, 'is neither a Line attribute'),
+        (['--group-by', 'minute,accept_date'], None, 'use minute or hour instead'),
+    ],
+)
+def test_group_by_arguments(arguments, expected, message):
+    """Check that the keys of the distinct_count command are validated."""
+    parser = create_parser()
+    if expected is not None:
+        data = parse_arguments(parser.parse_args(arguments))
+        assert {key: data[key] for key in expected} == expected
+    else:
+        with pytest.raises(ValueError, match=message):
+            parse_arguments(parser.parse_args(arguments))
+
+
+@pytest.mark.parametrize(
+    ('aggregates', 'expected'),
+    [
+        ('count', [('count', None)]),
+        (
+            'count,sum[bytes_read],histogram[total_time]',
+            [('count', None), ('sum', 'bytes_read'), ('histogram', 'total_time')],
+        ),
+        (
+            'min[queue_backend],max[retries]',
+            [('min', 'queue_backend'), ('max', 'retries')],
+        ),
+        ('average[bytes_read]', None),
+        ('sum[server_name]', None),
+        ('sum[bytes_read', None),
+        ('sum', None),
+    ],
+)
+def test_aggregate_arguments(aggregates, expected):
+    """Check that the aggregates of the group_by command are validated."""
+    parser = create_parser()
+    if expected is not None:
+        data = parse_arguments(parser.parse_args(['--aggregate', aggregates]))
+        assert data['aggregates'] == expected
+    else:
+        message = re.escape(f'aggregate "{aggregates}" is not valid')
+        with pytest.raises(ValueError, match=message):
+            parse_arguments(parser.parse_args(['--aggregate', aggregates]))
+
+
+def test_state_compressed(tmp_path):
+    """Check that saving the state of compressed log files is refused."""
+    log_path = tmp_path / 'haproxy.log.gz'
+    log_path.write_bytes(gzip.compress(b'line\n'))
+    parser = create_parser()
+    arguments = parser.parse_args(['-l', str(log_path), '--state', 'state.json'])
+    with pytest.raises(ValueError, match='compressed'):
+        parse_arguments(arguments)
+
+
+def test_follow_compressed(tmp_path):
+    """Check that following compressed log files is refused."""
+    log_path = tmp_path / 'haproxy.log.gz'
+    log_path.write_bytes(gzip.compress(b'line\n'))
+    parser = create_parser()
+    arguments = parser.parse_args(['-l', str(log_path), '--follow'])
+    with pytest.raises(ValueError, match='compressed'):
+        parse_arguments(arguments)
@@ -0,0 +1,195 @@
+from array import array
+from haproxy import cache
+from haproxy.cache import LineCache
+from haproxy.engine import create_engine
+from haproxy.line import Line
+from haproxy.line import parse_line
+
+import os
+import pytest
+import shutil
+
+
+@pytest.fixture(params=['small.log', '2_ok_1_invalid.log'])
+def log_path(request, tmp_path):
+    path = tmp_path / request.param
+    shutil.copy(os.path.join('tests', 'files', request.param), path)
+    return path
+
+
+def _state(line):
+    return dict(zip(Line.__slots__, line.__getstate__()))
+
+
+def test_lines(log_path):
+    """Check that cached lines are the same as the parsed ones."""
+    LineCache.build(log_path).save()
+    line_cache = LineCache.load(log_path)
+    with open(log_path) as file_obj:
+        expected = [_state(parse_line(raw_line)) for raw_line in file_obj]
+    assert [_state(line) for line in line_cache.lines()] == expected
+
+
+@pytest.mark.parametrize(
+    ('fields', 'expected'),
+    [
+        ((), set()),
+        (('status_code',), {'status_code'}),
+        (('raw_line',), {'raw_line'}),
+        (('ip',), {'client_ip', 'captured_request_headers'}),
+        (('accept_date',), {'accept_date', 'accept_timestamp', 'raw_accept_date'}),
+        (
+            ('is_https',),
+            {'http_request_method', 'http_request_path', 'http_request_protocol'},
+        ),
+    ],
+)
+def test_lines_fields(fields, expected):
+    """Check that only the attributes needed by the fields requested are set."""
+    line_cache = LineCache.build('tests/files/small.log')
+    with open('tests/files/small.log') as file_obj:
+        parsed_lines = [parse_line(raw_line) for raw_line in file_obj]
+    for line, parsed in zip(line_cache.lines(fields), parsed_lines):
+        attributes = {
+            name
+            for name in Line.__slots__
+            if getattr(line, name) is not None and name != 'is_valid'
+        }
+        assert attributes <= expected
+        for field in fields:
+            assert getattr(line, field) == getattr(parsed, field)
+
+
+@pytest.mark.parametrize('loaded', [False, True])
+def test_lines_range(log_path, loaded):
+    """Check that only lines starting on the range of bytes are returned."""
+    line_cache = LineCache.build(log_path)
+    if loaded:
+        line_cache.save()
+        line_cache = LineCache.load(log_path)
+    with open(log_path, 'rb') as file_obj:
+        content = file_obj.read()
+    second_line = content.index(b'\n') + 1
+    third_line = content.index(b'\n', second_line) + 1
+
+    lines = list(line_cache.lines(('raw_line',), second_line, third_line))
+    assert [line.raw_line for line in lines] == [
+        content[second_line:third_line].decode().strip()
+    ]
+    lines = list(line_cache.lines(('raw_line',), third_line))
+    assert len(lines) == len(line_cache) - 2
+
+
+def test_raw_http_request(tmp_path):
+    """Check that only the raw HTTP requests that can not be rebuilt are stored."""
+    with open('tests/files/small.log') as file_obj:
+        raw_line = file_obj.readline().strip()
+    requests = ['GET /hello HTTP/1.1', 'GET  /hello', '<BADREQ>', 'GET /hello']
+    path = tmp_path / 'haproxy.log'
+    path.write_text(
+        ''.join(
+            raw_line.replace('GET /hello HTTP/1.1', request) + '\n'
+            for request in requests
+        )
+    )
+    LineCache.build(path).save()
+    line_cache = LineCache.load(path)
+    assert [line.raw_http_request for line in line_cache.lines()] == requests
+    values, codes = line_cache.strings['raw_http_request']
+    assert [values[code] for code in codes] == [None, 'GET  /hello', '<BADREQ>', None]
+
+
+#: Every Line attribute, and property, that commands can be keyed on.
+LINE_KEYS = [
+    *Line.__slots__,
+    *(name for name, value in vars(Line).items() if isinstance(value, property)),
+]
+
+
+@pytest.mark.parametrize('key', LINE_KEYS)
+def test_lines_keys(tmp_path, key):
+    """Check that every attribute read on its own is the one of a parsed line."""
+    with open('tests/files/small.log') as file_obj:
+        raw_lines = file_obj.read().splitlines()
+    # unusual accept dates can not be rebuilt out of the accept timestamp
+    raw_lines.append(raw_lines[0].replace('10:01:04.205]', '10:01:04.2]'))
+    raw_lines.append(raw_lines[0].replace('10:01:04.205]', '10:01:04.205001]'))
+    path = tmp_path / 'haproxy.log'
+    path.write_text('\n'.join(raw_lines) + '\n')
+    LineCache.build(path).save()
+    line_cache = LineCache.load(path)
+    lines = list(line_cache.lines((key,)))
+    assert len(lines) == len(raw_lines)
+    for line, raw_line in zip(lines, raw_lines):
+        parsed = Line(raw_line)
+        if parsed.is_valid:
+            assert getattr(line, key) == getattr(parsed, key)
+
+
+def test_build_parallel(monkeypatch):
+    """Check that building the cache in parallel gives the same lines."""
+    serial = LineCache.build('tests/files/small.log')
+    monkeypatch.setattr(cache, 'CACHE_RANGE_SIZE', 500)
+    with create_engine('process', workers=2) as engine:
+        parallel = LineCache.build('tests/files/small.log', engine=engine)
+    assert [_state(line) for line in parallel.lines()] == [
+        _state(line) for line in serial.lines()
+    ]
+
+
+@pytest.mark.parametrize(
+    'change',
+    ['missing', 'log file', 'version', 'truncated', 'broken'],
+)
+def test_load_outdated(log_path, change):
+    """Check that missing, outdated or broken caches are not loaded."""
+    line_cache = LineCache.build(log_path)
+    if change != 'missing':
+        line_cache.save()
+    if change == 'log file':
+        with open(log_path, 'a') as file_obj:
+            file_obj.write('new line\n')
+    elif change == 'version':
+        line_cache.mtime = os.stat(log_path).st_mtime_ns
+        line_cache.save()
+        with open(line_cache.path, 'rb') as file_obj:
+            content = file_obj.read()
+        with open(line_cache.path, 'wb') as file_obj:
+            version = f'"version": {cache.CACHE_VERSION}'.encode()
+            file_obj.write(content.replace(version, b'"version": 0', 1))
+    elif change == 'truncated':
+        with open(line_cache.path, 'r+b') as file_obj:
+            file_obj.truncate(os.path.getsize(line_cache.path) - 1)
+    elif change == 'broken':
+        with open(line_cache.path, 'wb') as file_obj:
+            file_obj.write(b'not a cache')
+    assert LineCache.load(log_path) is None
+
+
+def test_empty_log_file(tmp_path):
+    """Check that empty log files have an empty cache."""
+    path = tmp_path / 'haproxy.log'
+    path.write_bytes(b'')
+    LineCache.build(path).save()
+    line_cache = LineCache.load(path)
+    assert len(line_cache) == 0
+    assert list(line_cache.lines()) == []
+
+
+@pytest.mark.parametrize(
+    ('values', 'typecode'),
+    [
+        ([], 'q'),
+        ([0, 255], 'B'),
+        ([0, 256], 'H'),
+        ([-1, 127], 'b'),
+        ([-1, 128], 'h'),
+        ([0, 2**40], 'Q'),
+        ([-(2**40), 0], 'q'),
+    ],
+)
+def test_narrow(values, typecode):
+    """Check that columns are saved with the smallest type their values fit in."""
+    column = cache._narrow(array('q', values))
+    assert column.typecode == typecode
+    assert column.tolist() == values
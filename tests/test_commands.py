@@ -1,7 +1,10 @@
 from datetime import datetime
 from datetime import timedelta
 from haproxy import commands
+from haproxy.line import Line
+from haproxy.utils import VALID_COMMANDS
 
+import json
 import pytest
 
 
@@ -358,6 +361,53 @@ def test_top_request_paths_output(line_factory, capsys, output, expected):
     check_output(cmd, output, expected, capsys)
 
 
+def test_top_request_paths_capacity(line_factory, capsys):
+    """Test the TopRequestPaths command.
+
+    With a capacity, only the most frequent paths are counted, and the error
+    of their counts is shown.
+    """
+    cmd = commands.TopRequestPaths(top=2, capacity=1)
+    for path in ('/file/1', '/file/0', '/file/0', '/file/1', '/file/2', '/file/2'):
+        cmd(line_factory(http_request=f'GET {path} HTTP/1.1'))
+    check_output(
+        cmd, None, '- /file/2: 3 (overestimated by up to 2)\n- /file/1: 2', capsys
+    )
+    cmd.results(output='json')
+    assert json.loads(capsys.readouterr().out) == {
+        'TOP_REQUEST_PATHS': [{'/file/2': 3}, {'/file/1': 2}],
+        'TOP_REQUEST_PATHS_ERRORS': {'/file/2': 2},
+    }
+
+
+def test_top_ips_error_value(line_factory, capsys):
+    """Check that a value called error does not clash with the error bounds."""
+    cmd = commands.TopIps(top=2, capacity=1)
+    for ip in ('1.1.1.1', '2.2.2.2', 'error', 'error', 'error'):
+        cmd(line_factory(headers=f' {{{ip}}}'))
+    cmd.results(output='json')
+    assert json.loads(capsys.readouterr().out) == {
+        'TOP_IPS': [{'error': 3}, {'1.1.1.1': 1}],
+        'TOP_IPS_ERRORS': {'error': 1},
+    }
+
+
+@pytest.mark.parametrize(
+    ('top', 'top_capacity', 'expected'),
+    [
+        (None, None, (10, 10000)),
+        (3, 50, (3, 50)),
+        (3, 0, (3, None)),
+    ],
+)
+def test_top_from_arguments(top, top_capacity, expected):
+    """Check that top commands are configured by the command line arguments."""
+    cmd = commands.TopIps.from_arguments({'top': top, 'top_capacity': top_capacity})
+    assert (cmd.top, cmd.summary.capacity) == expected
+    empty = cmd.empty()
+    assert (empty.top, empty.summary.capacity) == expected
+
+
 def test_slow_requests_counter_results(line_factory):
     """Test the SlowRequestsCounter command.
 
@@ -452,6 +502,386 @@ def test_average_waiting_time_output(line_factory, capsys, output):
     check_output(cmd, output, 35.0, capsys)
 
 
+def test_response_time_percentiles_results(line_factory):
+    """Test the ResponseTimePercentiles command.
+
+    Returns the percentiles of the response times of all valid requests.
+    """
+    cmd = commands.ResponseTimePercentiles()
+    assert cmd.raw_results() == {
+        'p50': None,
+        'p90': None,
+        'p95': None,
+        'p99': None,
+        'p999': None,
+    }
+    for total_time in [*range(1, 1001), -1]:
+        cmd(line_factory(tr=total_time))
+    results = cmd.raw_results()
+    for name, expected in (('p50', 500), ('p90', 900), ('p99', 990), ('p999', 999)):
+        assert abs(results[name] - expected) <= expected * 0.01
+
+
+@pytest.mark.parametrize(
+    ('output', 'expected'),
+    [
+        (None, '- p50: 40\n- p90: 40\n- p95: 40\n- p99: 40\n- p999: 40\n'),
+        ('json', '{"p50": 40, "p90": 40, "p95": 40, "p99": 40, "p999": 40}'),
+    ],
+)
+def test_response_time_percentiles_output(line_factory, capsys, output, expected):
+    """Test the ResponseTimePercentiles command.
+
+    Returns the percentiles of the response times of all valid requests.
+    """
+    cmd = commands.ResponseTimePercentiles()
+    cmd(line_factory(tr=40))
+    check_output(cmd, output, expected, capsys)
+
+
+def test_server_timers_results(line_factory):
+    """Test the ServerTimers command.
+
+    Returns the percentiles of every timer per backend and server.
+    """
+    cmd = commands.ServerTimers()
+    assert cmd.raw_results() == {}
+    for server_name, tr in (('one', 10), ('one', 1000), ('two', 50), ('two', -1)):
+        cmd(
+            line_factory(
+                server_name=server_name, tq=1, tw=2, tc=3, tr=tr, tt=f'+{tr + 6}'
+            )
+        )
+    results = cmd.raw_results()
+    assert list(results) == ['default/one', 'default/two']
+    assert results['default/one']['time_wait_request'] == {
+        'count': 2,
+        'p50': 1,
+        'p95': 1,
+        'p99': 1,
+        'max': 1,
+    }
+    assert results['default/one']['time_wait_response'] == {
+        'count': 2,
+        'p50': 10,
+        'p95': 1000,
+        'p99': 1000,
+        'max': 1000,
+    }
+    # aborted requests are ignored
+    assert results['default/two']['time_wait_response']['count'] == 1
+    assert results['default/two']['total_time']['max'] == 56
+
+
+@pytest.mark.parametrize(
+    ('output', 'expected'),
+    [
+        (
+            None,
+            '- default/one\n'
+            '  - time_wait_request: count: 1 p50: 1 p95: 1 p99: 1 max: 1\n'
+            '  - time_wait_queues: count: 1 p50: 2 p95: 2 p99: 2 max: 2\n'
+            '  - time_connect_server: count: 1 p50: 3 p95: 3 p99: 3 max: 3\n'
+            '  - time_wait_response: count: 1 p50: 4 p95: 4 p99: 4 max: 4\n'
+            '  - total_time: count: 1 p50: 10 p95: 10 p99: 10 max: 10\n',
+        ),
+        (
+            'json',
+            json.dumps(
+                {
+                    'default/one': {
+                        timer: {
+                            'count': 1,
+                            **dict.fromkeys(('p50', 'p95', 'p99', 'max'), value),
+                        }
+                        for timer, value in (
+                            ('time_wait_request', 1),
+                            ('time_wait_queues', 2),
+                            ('time_connect_server', 3),
+                            ('time_wait_response', 4),
+                            ('total_time', 10),
+                        )
+                    }
+                }
+            ),
+        ),
+    ],
+)
+def test_server_timers_output(line_factory, capsys, output, expected):
+    """Test the ServerTimers command.
+
+    Returns the percentiles of every timer per backend and server.
+    """
+    cmd = commands.ServerTimers()
+    cmd(line_factory(server_name='one', tq=1, tw=2, tc=3, tr=4, tt='10'))
+    check_output(cmd, output, expected, capsys)
+
+
+def test_distinct_count_results():
+    """Test the DistinctCount command.
+
+    Returns an estimate of the amount of distinct IPs.
+    """
+    cmd = commands.DistinctCount()
+    assert cmd.raw_results() == 0
+    for line in _small_log_lines():
+        cmd(line)
+    assert cmd.raw_results() == 5
+
+
+def test_distinct_count_group_by():
+    """Test the DistinctCount command.
+
+    Returns an estimate of the amount of distinct paths per group of lines.
+    """
+    cmd = commands.DistinctCount('http_request_path', ['status_family', 'server_name'])
+    assert cmd.fields == ('http_request_path', 'status_code', 'server_name')
+    assert cmd.raw_results() == []
+    for line in _small_log_lines():
+        cmd(line)
+    assert cmd.raw_results() == [
+        (('2xx', 'instance1'), 1),
+        (('2xx', 'instance2'), 1),
+        (('3xx', 'instance1'), 2),
+        (('3xx', 'instance2'), 2),
+        (('4xx', 'instance1'), 1),
+        (('4xx', 'instance3'), 2),
+    ]
+
+
+@pytest.mark.parametrize(
+    ('output', 'expected'),
+    [
+        (
+            None,
+            '- minute=2013-12-10T10:01:00 backend_name=default: 2\n'
+            '- minute=2013-12-10T10:02:00 backend_name=default: 1\n',
+        ),
+        (
+            'json',
+            '[{"minute": "2013-12-10T10:01:00", "backend_name": "default", '
+            '"distinct": 2}, '
+            '{"minute": "2013-12-10T10:02:00", "backend_name": "default", '
+            '"distinct": 1}]',
+        ),
+    ],
+)
+def test_distinct_count_output(line_factory, capsys, output, expected):
+    """Test the DistinctCount command.
+
+    Returns an estimate of the amount of distinct IPs per minute and backend.
+    """
+    cmd = commands.DistinctCount(group_by=['minute', 'backend_name'])
+    for accept_date, ip in (
+        ('10/Dec/2013:10:02:04.205', '1.1.1.1'),
+        ('10/Dec/2013:10:01:04.205', '1.1.1.1'),
+        ('10/Dec/2013:10:01:34.205', '2.2.2.2'),
+        ('10/Dec/2013:10:01:54.205', '1.1.1.1'),
+    ):
+        cmd(line_factory(accept_date=accept_date, headers=f' {{{ip}}}'))
+    check_output(cmd, output, expected, capsys)
+
+
+#: Every key lines can be grouped by, see ``--group-by``.
+GROUP_BY_KEYS = [
+    key
+    for key in (
+        *Line.__slots__,
+        *(name for name, value in vars(Line).items() if isinstance(value, property)),
+        *commands.GROUP_KEYS,
+    )
+    if key not in commands.UNGROUPABLE_ATTRIBUTES
+]
+
+
+@pytest.mark.parametrize('key', GROUP_BY_KEYS)
+def test_distinct_count_group_by_any_key(line_factory, capsys, key):
+    """Check that estimates grouped by any key can be output as JSON and saved."""
+    cmd = commands.DistinctCount(group_by=[key])
+    cmd(line_factory())
+    cmd.results(output='json')
+    assert json.loads(capsys.readouterr().out)['DISTINCT_COUNT'][0]['distinct'] == 1
+    state = json.loads(json.dumps(cmd.to_state()))
+    assert commands.DistinctCount.from_state(state).raw_results() == cmd.raw_results()
+
+
+def test_distinct_count_from_arguments():
+    """Check that the distinct count is configured by the command line arguments."""
+    cmd = commands.DistinctCount.from_arguments(
+        {'distinct': 'server_name', 'group_by': ['hour']}
+    )
+    assert cmd.fields == ('server_name', 'accept_timestamp')
+    empty = cmd.empty()
+    assert (empty.distinct, empty.group_by) == ('server_name', ('hour',))
+
+
+GROUP_BY_AGGREGATES = (
+    ('count', None),
+    ('sum', 'bytes_read'),
+    ('min', 'time_wait_response'),
+    ('max', 'time_wait_response'),
+    ('histogram', 'total_time'),
+)
+
+
+def test_group_by_results():
+    """Test the GroupBy command.
+
+    Returns the aggregates of every group of lines.
+    """
+    cmd = commands.GroupBy(GROUP_BY_AGGREGATES, ['status_family', 'server_name'])
+    assert cmd.fields == (
+        'status_code',
+        'server_name',
+        'bytes_read',
+        'time_wait_response',
+        'time_wait_response',
+        'total_time',
+    )
+    assert cmd.raw_results() == []
+    for line in _small_log_lines():
+        cmd(line)
+    results = cmd.raw_results()
+    assert [key for key, _ in results] == [
+        ('2xx', 'instance1'),
+        ('2xx', 'instance2'),
+        ('3xx', 'instance1'),
+        ('3xx', 'instance2'),
+        ('4xx', 'instance1'),
+        ('4xx', 'instance3'),
+    ]
+    assert results[2][1] == {
+        'count': 2,
+        'sum[bytes_read]': 35220,
+        'min[time_wait_response]': 4,
+        'max[time_wait_response]': 2936,
+        'histogram[total_time]': {
+            # 430 and 437 are within the accuracy of the histogram
+            'count': 2,
+            'p50': 433,
+            'p95': 433,
+            'p99': 433,
+            'max': 437,
+        },
+    }
+
+
+def test_group_by_no_keys(line_factory):
+    """Test the GroupBy command.
+
+    Without keys all lines are on the same group, and negative values ignored.
+    """
+    cmd = commands.GroupBy([('count', None), ('min', 'time_wait_queues')])
+    for tw in (-1, 30, 20):
+        cmd(line_factory(tw=tw))
+    assert cmd.raw_results() == [((), {'count': 3, 'min[time_wait_queues]': 20})]
+
+
+@pytest.mark.parametrize(
+    ('output', 'expected'),
+    [
+        (
+            None,
+            '- hour=2013-12-10T10:00:00 count=2 max[total_time]=20 '
+            'histogram[bytes_read]=(count: 2, p50: 100, p95: 300, p99: 300, '
+            'max: 300)\n'
+            '- hour=2013-12-10T11:00:00 count=1 max[total_time]=10 '
+            'histogram[bytes_read]=(count: 1, p50: 200, p95: 200, p99: 200, '
+            'max: 200)\n',
+        ),
+        (
+            'json',
+            json.dumps(
+                [
+                    {
+                        'hour': '2013-12-10T10:00:00',
+                        'count': 2,
+                        'max[total_time]': 20,
+                        'histogram[bytes_read]': {
+                            'count': 2,
+                            'p50': 100,
+                            'p95': 300,
+                            'p99': 300,
+                            'max': 300,
+                        },
+                    },
+                    {
+                        'hour': '2013-12-10T11:00:00',
+                        'count': 1,
+                        'max[total_time]': 10,
+                        'histogram[bytes_read]': {
+                            'count': 1,
+                            'p50': 200,
+                            'p95': 200,
+                            'p99': 200,
+                            'max': 200,
+                        },
+                    },
+                ]
+            ),
+        ),
+    ],
+)
+def test_group_by_output(line_factory, capsys, output, expected):
+    """Test the GroupBy command.
+
+    Returns the aggregates of every group of lines.
+    """
+    cmd = commands.GroupBy(
+        [('count', None), ('max', 'total_time'), ('histogram', 'bytes_read')],
+        ['hour'],
+    )
+    for accept_date, tt, size in (
+        ('10/Dec/2013:11:02:04.205', '10', '200'),
+        ('10/Dec/2013:10:01:04.205', '+20', '100'),
+        ('10/Dec/2013:10:31:34.205', '+5', '300'),
+    ):
+        cmd(line_factory(accept_date=accept_date, tt=tt, bytes=size))
+    check_output(cmd, output, expected, capsys)
+
+
+def test_group_by_merge_state():
+    """Check that merging the partial results of all aggregates matches one pass."""
+    lines = _small_log_lines()
+    group_by = ['backend_name', 'server_name']
+    expected = commands.GroupBy(GROUP_BY_AGGREGATES, group_by)
+    for line in lines:
+        expected(line)
+    for split in range(len(lines) + 1):
+        parts = []
+        for part in (lines[:split], lines[split:]):
+            cmd = commands.GroupBy(GROUP_BY_AGGREGATES, group_by)
+            for line in part:
+                cmd(line)
+            state = json.loads(json.dumps(cmd.to_state()))
+            parts.append(commands.GroupBy.from_state(state))
+        parts[0].merge(parts[1])
+        assert parts[0].raw_results() == expected.raw_results()
+
+
+@pytest.mark.parametrize('key', GROUP_BY_KEYS)
+def test_group_by_any_key(line_factory, capsys, key):
+    """Check that aggregates grouped by any key can be output as JSON and saved."""
+    cmd = commands.GroupBy(GROUP_BY_AGGREGATES, [key])
+    cmd(line_factory())
+    cmd.results(output='json')
+    assert json.loads(capsys.readouterr().out)['GROUP_BY'][0]['count'] == 1
+    state = json.loads(json.dumps(cmd.to_state()))
+    assert commands.GroupBy.from_state(state).raw_results() == cmd.raw_results()
+
+
+def test_group_by_from_arguments():
+    """Check that the group by command is configured by the command line arguments."""
+    cmd = commands.GroupBy.from_arguments(
+        {'aggregates': [('sum', 'bytes_read')], 'group_by': ['minute']}
+    )
+    assert cmd.fields == ('accept_timestamp', 'bytes_read')
+    empty = cmd.empty()
+    assert (empty.aggregates, empty.group_by) == ((('sum', 'bytes_read'),), ('minute',))
+    cmd = commands.GroupBy.from_arguments({'aggregates': None, 'group_by': None})
+    assert (cmd.aggregates, cmd.group_by) == ((('count', None),), ())
+
+
 def test_server_load_results(line_factory):
     """Test the ServerLoad command.
 
@@ -714,6 +1144,17 @@ def test_requests_per_minute_results(line_factory):
     assert results[4][1] == 1
 
 
+def test_requests_per_minute_keys(line_factory):
+    """Test the RequestsPerMinute command.
+
+    Check that the keys are the start of the minute, in seconds since the epoch.
+    """
+    cmd = commands.RequestsPerMinute()
+    cmd(line_factory(accept_date='09/Dec/2013:12:59:46.633'))
+    assert cmd.raw_results() == [(1386593940, 1)]
+    assert cmd.json_data() == [{'2013-12-09T12:59:00': 1}]
+
+
 @pytest.mark.parametrize('output', [None, 'json'])
 def test_requests_per_minute_output(line_factory, capsys, output):
     """Test the RequestsPerMinute command.
@@ -808,3 +1249,64 @@ def test_print_results_and_output(line_factory, capsys):
     assert '/first-thing-to-do' in lines[0]
     assert '/second/thing/to-do' in lines[1]
     assert lines[2] == ''
+
+
+@pytest.mark.parametrize(
+    'klass', [data['klass'] for name, data in VALID_COMMANDS.items() if name != 'print']
+)
+def test_commands_fields(klass):
+    """Check that commands only read the Line attributes they declare."""
+    with open('tests/files/small.log') as log_file:
+        raw_lines = [raw_line.strip() for raw_line in log_file]
+    full_cmd = klass()
+    projected_cmd = klass()
+    for raw_line in raw_lines:
+        full_cmd(Line(raw_line))
+        projected_cmd(Line(raw_line, fields=klass.fields))
+    assert projected_cmd.raw_results() == full_cmd.raw_results()
+
+
+MERGEABLE_COMMANDS = [
+    data['klass'] for name, data in VALID_COMMANDS.items() if name != 'print'
+]
+
+
+def _small_log_lines():
+    with open('tests/files/small.log') as log_file:
+        return [Line(raw_line.strip()) for raw_line in log_file]
+
+
+def _run(klass, lines):
+    cmd = klass()
+    for line in lines:
+        cmd(line)
+    return cmd
+
+
+@pytest.mark.parametrize('klass', MERGEABLE_COMMANDS)
+def test_commands_merge(klass):
+    """Check that merging any split of the lines matches a single pass."""
+    lines = _small_log_lines()
+    expected = _run(klass, lines).raw_results()
+    for first in range(len(lines) + 1):
+        for second in range(first, len(lines) + 1):
+            cmd = _run(klass, lines[:first])
+            cmd.merge(_run(klass, lines[first:second]))
+            cmd.merge(_run(klass, lines[second:]))
+            assert cmd.raw_results() == expected
+
+
+@pytest.mark.parametrize('klass', MERGEABLE_COMMANDS)
+def test_commands_state(klass):
+    """Check that partial results survive being serialized and merged."""
+    lines = _small_log_lines()
+    expected = _run(klass, lines)
+    for split in range(len(lines) + 1):
+        states = [
+            json.loads(json.dumps(_run(klass, part).to_state()))
+            for part in (lines[:split], lines[split:])
+        ]
+        cmd = klass.from_state(states[0])
+        cmd.merge(klass.from_state(states[1]))
+        assert cmd.raw_results() == expected.raw_results()
+        assert cmd.json_data() == expected.json_data()
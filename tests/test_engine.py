@@ -0,0 +1,72 @@
+from haproxy import engine
+from haproxy.engine import create_engine
+from haproxy.engine import ProcessEngine
+from haproxy.engine import SerialEngine
+from haproxy.engine import ThreadEngine
+
+import pytest
+
+
+@pytest.fixture(params=['serial', 'thread', 'process'])
+def any_engine(request):
+    with engine.ENGINES[request.param](2, max_pending=3) as new_engine:
+        yield new_engine
+
+
+def test_imap(any_engine):
+    """Check that results are returned in the order of their tasks."""
+    assert list(any_engine.imap(abs, range(-20, 0))) == list(range(20, 0, -1))
+    assert list(any_engine.imap_tasks(abs, [-1, -2])) == [(-1, 1), (-2, 2)]
+
+
+def test_imap_bounded(any_engine):
+    """Check that tasks are only sent to workers as their results are consumed."""
+    sent = []
+
+    def tasks():
+        for number in range(-10, 0):
+            sent.append(number)
+            yield number
+
+    results = any_engine.imap(abs, tasks())
+    assert next(results) == 10
+    assert len(sent) == (1 if type(any_engine) is SerialEngine else 3)
+    assert list(results) == list(range(9, 0, -1))
+
+
+def test_imap_bounded_process():
+    """Check that the amount of pending tasks defaults to twice the workers."""
+    assert ProcessEngine(3).max_pending == 6
+    assert ProcessEngine(3, max_pending=1).max_pending == 1
+
+
+def test_reuse():
+    """Check that the pool of workers is kept until the engine is closed."""
+    process_engine = ProcessEngine(2)
+    assert process_engine.pool is None
+    assert list(process_engine.imap(abs, [-1])) == [1]
+    pool = process_engine.pool
+    assert list(process_engine.imap(abs, [-2])) == [2]
+    assert process_engine.pool is pool
+    process_engine.close()
+    assert process_engine.pool is None
+
+
+@pytest.mark.parametrize(
+    ('name', 'size', 'workers', 'expected'),
+    [
+        (None, 0, None, SerialEngine),
+        (None, engine.SERIAL_SIZE - 1, None, SerialEngine),
+        (None, engine.SERIAL_SIZE, None, ProcessEngine),
+        (None, None, None, ProcessEngine),
+        (None, 0, 2, ProcessEngine),
+        (None, engine.SERIAL_SIZE, 1, SerialEngine),
+        ('thread', 0, None, ThreadEngine),
+        ('process', 0, None, ProcessEngine),
+        ('serial', None, 4, SerialEngine),
+    ],
+)
+def test_create_engine(name, size, workers, expected):
+    """Check that small log files are parsed serially, unless told otherwise."""
+    with create_engine(name, size, workers) as new_engine:
+        assert type(new_engine) is expected
@@ -1,4 +1,5 @@
 from haproxy import filters
+from haproxy.line import Line
 
 import pytest
 
@@ -209,3 +210,119 @@ def test_filter_response_size(line_factory, to_filter, to_check, result):
     current_filter = filters.filter_response_size(to_filter)
     line = line_factory(bytes=to_check)
     assert current_filter(line) is result
+
+
+@pytest.mark.parametrize(
+    ('factory', 'argument'),
+    [
+        (filters.filter_ip, '123.123.123.123'),
+        (filters.filter_ip_range, '123.123.124'),
+        (filters.filter_path, '/hello'),
+        (filters.filter_ssl, None),
+        (filters.filter_slow_requests, '100'),
+        (filters.filter_wait_on_queues, '10'),
+        (filters.filter_status_code, '404'),
+        (filters.filter_status_code_family, '4'),
+        (filters.filter_http_method, 'GET'),
+        (filters.filter_backend, 'default'),
+        (filters.filter_frontend, 'loadbalancer'),
+        (filters.filter_server, 'instance1'),
+        (filters.filter_response_size, '+17000'),
+    ],
+)
+def test_filters_fields(factory, argument):
+    """Check that filters only read the Line attributes they declare."""
+    current_filter = factory(argument)
+    with open('tests/files/small.log') as log_file:
+        for raw_line in log_file:
+            full_line = Line(raw_line.strip())
+            projected_line = Line(raw_line.strip(), fields=factory.fields)
+            assert current_filter(projected_line) == current_filter(full_line)
+
+
+@pytest.mark.parametrize(
+    ('factory', 'argument'),
+    [
+        (filters.filter_ip, '123.123.123.123'),
+        (filters.filter_ip_range, '123.123.124'),
+        (filters.filter_path, '/hello'),
+        (filters.filter_status_code, '404'),
+        (filters.filter_http_method, 'GET'),
+        (filters.filter_backend, 'default'),
+        (filters.filter_frontend, 'loadbalancer'),
+        (filters.filter_server, 'instance1'),
+    ],
+)
+def test_filters_raw_substring(factory, argument):
+    """Check that lines passing a filter contain its raw substring."""
+    current_filter = factory(argument)
+    passed = 0
+    with open('tests/files/small.log') as log_file:
+        for raw_line in log_file:
+            if current_filter(Line(raw_line.strip())):
+                assert current_filter.raw_substring in raw_line
+                passed += 1
+    assert passed
+
+
+@pytest.mark.parametrize(
+    ('factory', 'argument'),
+    [
+        (filters.filter_path, 'valid'),
+        (filters.filter_http_method, 'invalid'),
+        (filters.filter_slow_requests, '100'),
+        (filters.filter_response_size, '+17000'),
+    ],
+)
+def test_filters_no_raw_substring(factory, argument):
+    """Check that filters without a text to look for do not declare one."""
+    current_filter = factory(argument)
+    assert not hasattr(current_filter, 'raw_substring')
+
+
+def test_predicate_cost_order():
+    """Check that the cheapest filters are checked first."""
+    expensive = filters.filter_ip('1.2.3.4')
+    cheap = filters.filter_status_code('200')
+    predicate = filters.Predicate([(expensive, 3), (cheap, 1)])
+    assert predicate.filter_funcs == [cheap, expensive]
+
+
+def test_predicate_selectivity_order(monkeypatch, line_factory):
+    """Check that filters rejecting the most lines are moved first."""
+    monkeypatch.setattr(filters, 'SAMPLE_LINES', 4)
+    rarely_rejects = filters.filter_backend('default')
+    often_rejects = filters.filter_server('instance1')
+    predicate = filters.Predicate([(rarely_rejects, 1), (often_rejects, 1)])
+    lines = [
+        line_factory(server_name='instance1'),
+        line_factory(server_name='instance2'),
+        line_factory(server_name='instance2'),
+        line_factory(backend_name='other', server_name='instance3'),
+    ]
+    assert [predicate(line) for line in lines] == [True, False, False, False]
+    assert predicate.filter_funcs == [often_rejects, rarely_rejects]
+    assert [predicate(line) for line in lines] == [True, False, False, False]
+
+
+@pytest.mark.parametrize('sample_lines', [1, 1000])
+@pytest.mark.parametrize(
+    ('clauses', 'negate', 'expected'),
+    [
+        ([], False, True),
+        ([], True, False),
+        ([('status_code', '200')], False, True),
+        ([('status_code', '200')], True, False),
+        ([('status_code', '200'), ('server', 'other')], False, False),
+        ([('status_code', '200'), ('server', 'other')], True, True),
+    ],
+)
+def test_predicate(monkeypatch, line_factory, sample_lines, clauses, negate, expected):
+    """Check that lines pass the predicate if they pass all filters, or not."""
+    monkeypatch.setattr(filters, 'SAMPLE_LINES', sample_lines)
+    filter_funcs = [
+        (getattr(filters, f'filter_{name}')(argument), 1) for name, argument in clauses
+    ]
+    predicate = filters.Predicate(filter_funcs, negate)
+    line = line_factory(status='200')
+    assert [predicate(line) for _ in range(3)] == [expected] * 3
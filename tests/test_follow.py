@@ -0,0 +1,81 @@
+from haproxy import follow
+from haproxy.follow import follow_lines
+from haproxy.follow import InotifyWatcher
+from haproxy.follow import SleepWatcher
+
+import os
+import pytest
+
+
+@pytest.fixture(params=['inotify', 'sleep'])
+def watcher(request, monkeypatch):
+    """Run the tests with both ways of waiting for changes."""
+    if request.param == 'sleep':
+        monkeypatch.setattr(follow, '_watcher', lambda path: SleepWatcher())
+        monkeypatch.setattr(follow, 'POLL_INTERVAL', 0.01)
+    return request.param
+
+
+@pytest.fixture()
+def log_path(tmp_path):
+    path = tmp_path / 'haproxy.log'
+    path.write_text('first\nsecond\nthird, still being writ')
+    return path
+
+
+def _next_lines(lines):
+    """Return the lines yielded until there are no more new lines."""
+    result = []
+    for line in lines:
+        if line is None:
+            return result
+        result.append(line)
+
+
+def test_follow_lines(log_path, watcher):
+    """Check that lines are yielded as they are appended."""
+    lines = follow_lines(log_path, offset=6, timeout=0.05)
+    assert _next_lines(lines) == ['second']
+    assert _next_lines(lines) == []
+
+    with open(log_path, 'a') as file_obj:
+        file_obj.write('ten\nfourth\n')
+    assert _next_lines(lines) == ['third, still being written', 'fourth']
+    lines.close()
+
+
+def test_follow_lines_rotated(log_path, watcher):
+    """Check that the rest of a rotated file is read before the new one."""
+    lines = follow_lines(log_path, timeout=0.05)
+    assert _next_lines(lines) == ['first', 'second']
+
+    with open(log_path, 'a') as file_obj:
+        file_obj.write('ten\n')
+    os.rename(log_path, f'{log_path}.1')
+    assert _next_lines(lines) == ['third, still being written']
+
+    log_path.write_text('new file\n')
+    assert _next_lines(lines) == ['new file']
+    lines.close()
+
+
+def test_follow_lines_truncated(log_path, watcher):
+    """Check that a truncated file is read again from its start."""
+    lines = follow_lines(log_path, timeout=0.05)
+    assert _next_lines(lines) == ['first', 'second']
+
+    with open(log_path, 'w') as file_obj:
+        file_obj.write('new\n')
+    assert _next_lines(lines) == ['new']
+    lines.close()
+
+
+def test_inotify_watcher(tmp_path):
+    """Check that the inotify watcher wakes up on changes."""
+    try:
+        watcher = InotifyWatcher(tmp_path / 'haproxy.log')
+    except (AttributeError, OSError, TypeError):  # pragma: no cover
+        pytest.skip('inotify is not available')
+    (tmp_path / 'haproxy.log').write_text('line\n')
+    watcher.wait(10)
+    watcher.close()
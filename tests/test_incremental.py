@@ -0,0 +1,108 @@
+from haproxy import commands
+from haproxy.incremental import IncrementalState
+
+import os
+import pytest
+
+
+SETTINGS = {'commands': ['counter'], 'filters': [('server', 'instance1')]}
+
+
+@pytest.fixture()
+def log_path(tmp_path):
+    path = tmp_path / 'haproxy.log'
+    path.write_text('first line\nsecond line\n')
+    return path
+
+
+@pytest.fixture()
+def state_path(tmp_path):
+    return tmp_path / 'state.json'
+
+
+def _save(state_path, log_path, counter=2):
+    """Save the state of a run that processed the whole log file."""
+    state = IncrementalState.load(state_path, log_path, SETTINGS)
+    pending = state.pending()
+    cmd = commands.Counter()
+    cmd.counter = counter
+    state.save([cmd])
+    return pending
+
+
+def test_first_run(log_path, state_path):
+    """Check that the whole log file is pending, but for incomplete lines."""
+    with open(log_path, 'a') as file_obj:
+        file_obj.write('still being writ')
+    assert _save(state_path, log_path) == [(log_path, (0, 23))]
+
+
+def test_restore(log_path, state_path):
+    """Check that commands get the results saved on the state."""
+    state = IncrementalState.load(state_path, log_path, SETTINGS)
+    cmds = [commands.Counter()]
+    assert state.restore(cmds) is cmds
+
+    _save(state_path, log_path, counter=7)
+    state = IncrementalState.load(state_path, log_path, SETTINGS)
+    cmds = state.restore([commands.Counter()])
+    assert cmds[0].raw_results() == 7
+
+
+def test_save_failure(log_path, state_path):
+    """Check that the saved state is kept if the new one can not be saved."""
+    _save(state_path, log_path, counter=7)
+    content = state_path.read_text()
+    state = IncrementalState.load(state_path, log_path, SETTINGS)
+    cmd = commands.Counter()
+    cmd.counter = object()
+    with pytest.raises(TypeError, match='not JSON serializable'):
+        state.save([cmd])
+    assert state_path.read_text() == content
+    assert sorted(os.listdir(state_path.parent)) == ['haproxy.log', 'state.json']
+
+
+def test_other_settings(log_path, state_path, capsys):
+    """Check that states saved with other settings are not used."""
+    _save(state_path, log_path)
+    state = IncrementalState.load(state_path, log_path, {'commands': ['ip_counter']})
+    assert state.commands is None
+    assert state.pending() == [(log_path, (0, 23))]
+    assert 'starting over' in capsys.readouterr().out
+
+
+def test_appended(log_path, state_path):
+    """Check that only the lines appended since are pending."""
+    _save(state_path, log_path)
+    with open(log_path, 'a') as file_obj:
+        file_obj.write('third line\n')
+    assert _save(state_path, log_path) == [(log_path, (23, 34))]
+    assert _save(state_path, log_path) == [(log_path, (34, 34))]
+
+
+@pytest.mark.parametrize('content', ['short\n', 'changed line\nsecond line\nmore\n'])
+def test_truncated(log_path, state_path, content):
+    """Check that a truncated, or rewritten, log file is read from its start."""
+    _save(state_path, log_path)
+    with open(log_path, 'r+') as file_obj:
+        file_obj.truncate(0)
+        file_obj.write(content)
+    assert _save(state_path, log_path) == [(log_path, (0, len(content)))]
+
+
+@pytest.mark.parametrize('keep_rotated', [True, False])
+def test_rotated(log_path, state_path, keep_rotated):
+    """Check that the rest of a rotated log file is read before the new one."""
+    _save(state_path, log_path)
+    with open(log_path, 'a') as file_obj:
+        file_obj.write('third line\n')
+    rotated_path = f'{log_path}.1'
+    os.rename(log_path, rotated_path)
+    if not keep_rotated:
+        os.remove(rotated_path)
+    log_path.write_text('new file\n')
+
+    expected = [(log_path, (0, 9))]
+    if keep_rotated:
+        expected.insert(0, (rotated_path, (23, 34)))
+    assert _save(state_path, log_path) == expected
@@ -1,7 +1,22 @@
 from datetime import datetime
+from datetime import timedelta
+from haproxy import commands
+from haproxy import logfile
+from haproxy import readers
+from haproxy.engine import ENGINES
+from haproxy.engine import ProcessEngine
+from haproxy.logfile import BatchSizer
 from haproxy.logfile import Log
+from haproxy.logfile import Logs
+from haproxy.readers import split_ranges
 
+import bz2
+import gzip
+import io
+import lzma
+import os
 import pytest
+import sys
 
 
 def test_logfile_default_values():
@@ -14,6 +29,7 @@ def test_logfile_default_values():
     assert log_file.total_lines == 0
     assert log_file.start is None
     assert log_file.end is None
+    assert log_file.bytes_scanned == 0
 
 
 @pytest.mark.parametrize(
@@ -107,3 +123,425 @@ def test_print_invalid_lines(tmp_path, line_factory, headers, capsys):
         assert headers not in output
     else:
         assert headers in output
+
+
+@pytest.mark.parametrize('parts', [1, 2, 3, 7, 100, 5000])
+def test_read_ranges(parts):
+    """Check that splitting a log file in ranges of bytes reads every line once."""
+    log_file = Log(logfile='tests/files/small.log')
+    lines = []
+    for range_start, range_end in split_ranges('tests/files/small.log', parts):
+        lines.extend(log_file._read_range(range_start, range_end))
+    with open('tests/files/small.log') as file_obj:
+        expected = [raw_line.strip() for raw_line in file_obj]
+    assert [line.raw_line for line in lines] == expected
+    assert log_file.valid_lines == len(expected)
+
+
+@pytest.mark.parametrize(
+    ('filters', 'negate_filter', 'expected'),
+    [
+        (None, False, 9),
+        ([('server', 'instance1')], False, 4),
+        ([('server', 'instance1')], True, 5),
+    ],
+)
+def test_map_reduce(filters, negate_filter, expected):
+    """Check that commands get the lines from all processes."""
+    cmds = [commands.Counter(), commands.ServerLoad()]
+    log_file = Log(logfile='tests/files/small.log')
+    log_file.map_reduce(cmds, filters, negate_filter, processes=2)
+    assert cmds[0].raw_results() == expected
+    assert sum(cmds[1].raw_results().values()) == expected
+    assert log_file.valid_lines == 9
+
+
+def test_bytes_scanned(capsys):
+    """Check that the amount of bytes read is reported."""
+    log_file = Log(logfile='tests/files/small.log')
+    _ = list(log_file)
+    assert log_file.bytes_scanned == os.path.getsize('tests/files/small.log')
+    assert f'to scan {log_file.bytes_scanned} bytes' in capsys.readouterr().out
+
+
+@pytest.fixture()
+def ordered_log(tmp_path, line_factory):
+    """A log file with a line every 10 seconds along a day."""
+    file_path = tmp_path / 'haproxy.log'
+    first = datetime(2013, 12, 9)
+    with open(file_path, 'w') as file_obj:
+        for index in range(8640):
+            accept_date = first + timedelta(seconds=index * 10)
+            accept_date = accept_date.strftime('%d/%b/%Y:%H:%M:%S.%f')[:-3]
+            file_obj.write(f'{line_factory(accept_date=accept_date).raw_line}\n')
+    return file_path
+
+
+@pytest.mark.parametrize('delta', [None, '10m'])
+def test_seek(ordered_log, monkeypatch, delta):
+    """Check that seeking finds the same lines while reading less of the file."""
+    monkeypatch.setattr(readers, 'BISECT_PRECISION', 1024)
+    log_file = Log(logfile=ordered_log, start='09/Dec/2013:19:31', delta=delta)
+    expected = [line.raw_line for line in log_file]
+
+    seek_log_file = Log(
+        logfile=ordered_log, start='09/Dec/2013:19:31', delta=delta, seek=True
+    )
+    assert [line.raw_line for line in seek_log_file] == expected
+    assert seek_log_file.bytes_scanned < log_file.bytes_scanned
+
+
+@pytest.mark.parametrize('delta', [None, '10m'])
+def test_seek_map_reduce(ordered_log, monkeypatch, delta):
+    """Check that seeking also works when splitting the work between processes."""
+    monkeypatch.setattr(readers, 'BISECT_PRECISION', 1024)
+    log_file = Log(logfile=ordered_log, start='09/Dec/2013:19:31', delta=delta)
+    expected = len(list(log_file))
+
+    cmds = [commands.Counter()]
+    seek_log_file = Log(
+        logfile=ordered_log, start='09/Dec/2013:19:31', delta=delta, seek=True
+    )
+    seek_log_file.map_reduce(cmds, processes=2)
+    assert cmds[0].raw_results() == expected
+    assert seek_log_file.bytes_scanned < log_file.bytes_scanned
+
+
+def test_seek_without_start(ordered_log):
+    """Check that seeking without a start time reads the whole file."""
+    log_file = Log(logfile=ordered_log, seek=True)
+    assert len(list(log_file)) == 8640
+
+
+@pytest.mark.parametrize('delta', [None, '10m'])
+def test_index(ordered_log, delta):
+    """Check that the time index finds the same lines while reading less of the file."""
+    log_file = Log(logfile=ordered_log, start='09/Dec/2013:19:31', delta=delta)
+    expected = [line.raw_line for line in log_file]
+
+    index_log_file = Log(
+        logfile=ordered_log, start='09/Dec/2013:19:31', delta=delta, index=True
+    )
+    assert [line.raw_line for line in index_log_file] == expected
+    assert index_log_file.bytes_scanned < log_file.bytes_scanned
+    assert os.path.exists(f'{ordered_log}.hlaidx')
+
+
+def test_index_without_start(ordered_log):
+    """Check that the time index is built even if the whole file is read."""
+    log_file = Log(logfile=ordered_log, index=True)
+    assert len(list(log_file)) == 8640
+    assert os.path.exists(f'{ordered_log}.hlaidx')
+
+
+@pytest.mark.parametrize('delta', [None, '10m'])
+def test_cache(ordered_log, delta):
+    """Check that lines read from the cache are the same as the parsed ones."""
+    log_file = Log(logfile=ordered_log, start='09/Dec/2013:19:31', delta=delta)
+    expected = [line.raw_line for line in log_file]
+
+    for _ in range(2):
+        cache_log_file = Log(
+            logfile=ordered_log,
+            start='09/Dec/2013:19:31',
+            delta=delta,
+            fields=('raw_line',),
+            cache=True,
+        )
+        assert [line.raw_line for line in cache_log_file] == expected
+        assert cache_log_file.valid_lines == log_file.valid_lines
+        assert os.path.exists(f'{ordered_log}.hlacache')
+
+
+def test_cache_map_reduce(ordered_log):
+    """Check that workers read their lines from the cache as well."""
+    cmds = [commands.Counter(), commands.RequestsPerHour()]
+    log_file = Log(logfile=ordered_log, cache=True, fields=('accept_timestamp', 'ip'))
+    log_file.map_reduce(cmds, [('ip', '77.24.148.74')], processes=2)
+    assert cmds[0].raw_results() == 8640
+    assert len(cmds[1].raw_results()) == 24
+    assert os.path.exists(f'{ordered_log}.hlacache')
+
+
+def test_follow(tmp_path):
+    """Check that lines appended to the log file are returned as well."""
+    file_path = tmp_path / 'haproxy.log'
+    with open('tests/files/small.log') as file_obj:
+        lines = file_obj.readlines()
+    file_path.write_text(''.join(lines[:5]) + lines[5][:10])
+    log_file = Log(logfile=file_path)
+
+    followed = log_file.follow(timeout=0.05)
+    assert len(list(iter(followed.__next__, None))) == 5
+    with open(file_path, 'a') as file_obj:
+        file_obj.write(lines[5][10:] + 'invalid line\n')
+    assert len(list(iter(followed.__next__, None))) == 1
+    followed.close()
+    assert log_file.valid_lines == 6
+    assert log_file.invalid_lines == 1
+
+
+def _gzip_members(content):
+    """Compress every 100 bytes on its own gzip member."""
+    return b''.join(
+        gzip.compress(content[start : start + 100])
+        for start in range(0, len(content), 100)
+    )
+
+
+@pytest.mark.parametrize(
+    'compress',
+    [gzip.compress, _gzip_members, bz2.compress, lzma.compress],
+)
+def test_compressed(tmp_path, monkeypatch, compress):
+    """Check that compressed log files are read as the plain ones."""
+    monkeypatch.setattr(logfile, 'GZIP_RANGE_SIZE', 100)
+    monkeypatch.setattr(logfile, 'BATCH_SIZE', 2)
+    with open('tests/files/small.log', 'rb') as file_obj:
+        content = file_obj.read()
+    file_path = tmp_path / 'haproxy.log.compressed'
+    file_path.write_bytes(compress(content + b'invalid line\n\nlast line'))
+
+    log_file = Log(logfile=file_path)
+    lines = [line.raw_line for line in log_file]
+    assert lines == [raw_line.strip() for raw_line in content.decode().splitlines()]
+    assert log_file.valid_lines == 9
+    assert log_file.invalid_lines == 3
+    assert log_file.bytes_scanned == file_path.stat().st_size
+
+
+def test_compressed_map_reduce(tmp_path):
+    """Check that commands get all the lines of compressed log files."""
+    with open('tests/files/small.log', 'rb') as file_obj:
+        content = file_obj.read()
+    file_path = tmp_path / 'haproxy.log.gz'
+    file_path.write_bytes(gzip.compress(content))
+
+    cmds = [commands.Counter()]
+    log_file = Log(logfile=file_path)
+    log_file.map_reduce(cmds, [('server', 'instance1')], negate_filter=True)
+    assert cmds[0].raw_results() == 5
+
+
+def test_logs():
+    """Check that the lines of many log files are read as one."""
+    logs = Logs(
+        [Log(logfile='tests/files/small.log'), Log('tests/files/2_ok_1_invalid.log')]
+    )
+    lines = list(logs)
+    assert len(lines) == 11
+    assert logs.valid_lines == 11
+    assert logs.invalid_lines == 1
+    assert logs.total_lines == 12
+    assert logs.bytes_scanned == os.path.getsize(
+        'tests/files/small.log'
+    ) + os.path.getsize('tests/files/2_ok_1_invalid.log')
+
+
+def test_logs_ordered(tmp_path, line_factory):
+    """Check that the lines of many log files can be merged by time."""
+    first = datetime(2013, 12, 9)
+    paths = []
+    for name, seconds in (('odd', range(1, 100, 2)), ('even', range(0, 100, 2))):
+        file_path = tmp_path / f'{name}.log'
+        with open(file_path, 'w') as file_obj:
+            for second in seconds:
+                accept_date = first + timedelta(seconds=second)
+                accept_date = accept_date.strftime('%d/%b/%Y:%H:%M:%S.%f')[:-3]
+                file_obj.write(f'{line_factory(accept_date=accept_date).raw_line}\n')
+        paths.append(file_path)
+
+    logs = Logs([Log(logfile=path, fields=('raw_line',)) for path in paths], True)
+    dates = [line.accept_date for line in logs]
+    assert dates == [first + timedelta(seconds=second) for second in range(100)]
+
+
+def test_logs_map_reduce(tmp_path):
+    """Check that the results of many log files, even compressed, are merged."""
+    with open('tests/files/small.log', 'rb') as file_obj:
+        content = file_obj.read()
+    file_path = tmp_path / 'haproxy.log.gz'
+    file_path.write_bytes(gzip.compress(content))
+
+    cmds = [commands.Counter(), commands.ServerLoad()]
+    logs = Logs([Log(logfile='tests/files/small.log'), Log(logfile=file_path)])
+    logs.map_reduce(cmds, [('server', 'instance1')], processes=2)
+    assert cmds[0].raw_results() == 8
+    assert cmds[1].raw_results() == {'instance1': 8}
+    assert logs.valid_lines == 18
+
+
+@pytest.mark.parametrize('stream', ['stdin', 'binary', 'text', 'lines'])
+def test_stream(monkeypatch, stream):
+    """Check that log files can be read from streams rather than paths."""
+    monkeypatch.setattr(logfile, 'BATCH_SIZE', 2)
+    with open('tests/files/2_ok_1_invalid.log', 'rb') as file_obj:
+        content = file_obj.read()
+    if stream == 'stdin':
+        monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(content)))
+        source = '-'
+    elif stream == 'binary':
+        source = io.BytesIO(content)
+    elif stream == 'text':
+        source = io.StringIO(content.decode())
+    else:
+        source = content.decode().splitlines()
+
+    log_file = Log(logfile=source)
+    lines = [line.raw_line for line in log_file]
+    raw_lines = content.decode().splitlines()
+    assert lines == [raw_lines[0], raw_lines[2]]
+    assert log_file.valid_lines == 2
+    assert log_file.invalid_lines == 1
+    assert 0 < log_file.bytes_scanned <= len(content)
+
+
+def test_stream_map_reduce():
+    """Check that commands get all the lines of streams."""
+    cmds = [commands.Counter()]
+    with open('tests/files/small.log', 'rb') as file_obj:
+        log_file = Log(logfile=file_obj)
+        log_file.map_reduce(cmds, [('server', 'instance1')], negate_filter=True)
+    assert cmds[0].raw_results() == 5
+
+
+@pytest.mark.parametrize('max_pending', [1, 2, 100])
+def test_max_pending(monkeypatch, max_pending):
+    """Check that every line is read whatever the amount of pending tasks."""
+    monkeypatch.setattr(logfile, 'RANGE_SIZE', 100)
+    engine = ProcessEngine(2, max_pending=max_pending)
+    logs = Logs([Log(logfile='tests/files/small.log')], engine=engine)
+    with open('tests/files/small.log') as file_obj:
+        expected = [raw_line.strip() for raw_line in file_obj]
+    with engine:
+        assert [line.raw_line for line in logs] == expected
+
+
+@pytest.mark.parametrize(
+    ('lines', 'elapsed', 'expected'),
+    [
+        (1000, 0.05, 1000),
+        (1000, 0.5, 100),
+        (1000, 0.1, 500),
+        (1000, 0.01, 2000),
+        (1000, 0, 2000),
+        (0, 0, 1000),
+    ],
+)
+def test_batch_sizer(monkeypatch, lines, elapsed, expected):
+    """Check that batches take, about, the same time to parse."""
+    monkeypatch.setattr(logfile, 'BATCH_LATENCY', 0.05)
+    sizer = BatchSizer()
+    sizer.size = 1000
+    sizer.update(lines, elapsed)
+    assert sizer.size == expected
+
+
+def test_batch_sizer_bounds(monkeypatch):
+    """Check that batches are neither too small nor too big."""
+    sizer = BatchSizer()
+    assert sizer.size == logfile.MIN_BATCH_SIZE
+    sizer.update(10, 100)
+    assert sizer.size == logfile.MIN_BATCH_SIZE
+    for _ in range(20):
+        sizer.update(sizer.size, 0)
+    assert sizer.size == logfile.MAX_BATCH_SIZE
+
+
+def test_batch_sizer_fixed():
+    """Check that a fixed batch size is kept."""
+    sizer = BatchSizer(7)
+    sizer.update(7, 100)
+    assert sizer.size == 7
+
+
+def test_stream_adaptive_batches(monkeypatch):
+    """Check that lines are sent in batches growing as they are parsed fast."""
+    sizes = []
+    batches = logfile._batches
+
+    def record_batches(iterable, sizer):
+        for batch in batches(iterable, sizer):
+            sizes.append(len(batch))
+            yield batch
+
+    monkeypatch.setattr(logfile, '_batches', record_batches)
+    with open('tests/files/small.log') as file_obj:
+        raw_lines = file_obj.readlines() * 500
+    log_file = Log(logfile=raw_lines)
+    assert len(list(log_file)) == len(raw_lines)
+    assert sizes[0] == logfile.MIN_BATCH_SIZE
+    assert max(sizes) > logfile.MIN_BATCH_SIZE
+
+
+@pytest.mark.parametrize('name', sorted(ENGINES))
+def test_engines(name):
+    """Check that all engines read the same lines and give the same results."""
+    with ENGINES[name](2) as engine:
+        log_file = Log(logfile='tests/files/small.log', engine=engine)
+        assert len(list(log_file)) == 9
+        cmds = [commands.Counter(), commands.ServerLoad()]
+        log_file = Log(logfile='tests/files/small.log', engine=engine)
+        log_file.map_reduce(cmds, [('server', 'instance1')])
+        assert cmds[0].raw_results() == 4
+        assert cmds[1].raw_results() == {'instance1': 4}
+        assert log_file.valid_lines == 9
+
+
+def test_engine_shared():
+    """Check that log files can share an engine, that is not closed by them."""
+    engine = ProcessEngine(2)
+    for _ in range(2):
+        log_file = Log(logfile='tests/files/small.log', engine=engine)
+        assert len(list(log_file)) == 9
+        pool = engine.pool
+    assert pool is engine.pool is not None
+    engine.close()
+
+
+@pytest.mark.parametrize('method', ['__iter__', 'map_reduce'])
+def test_engine_builds_sidecars(ordered_log, method):
+    """Check that the time index and the cache are built by the log file engine."""
+    funcs = []
+
+    class RecordingEngine(ENGINES['serial']):
+        def imap_tasks(self, func, tasks):
+            funcs.append(func.__name__)
+            return super().imap_tasks(func, tasks)
+
+    with RecordingEngine() as engine:
+        log_file = Log(logfile=ordered_log, index=True, cache=True, engine=engine)
+        if method == '__iter__':
+            assert len(list(log_file)) == 8640
+        else:
+            cmds = [commands.Counter()]
+            log_file.map_reduce(cmds)
+            assert cmds[0].raw_results() == 8640
+    assert {'_index_range', '_encode_range'} <= set(funcs)
+
+
+@pytest.mark.parametrize('source', ['path', 'gzip', 'stream'])
+def test_raw_filters(tmp_path, source):
+    """Check that lines lacking the raw filters are not even parsed."""
+    with open('tests/files/small.log', 'rb') as file_obj:
+        content = file_obj.read()
+    logfile = 'tests/files/small.log'
+    if source == 'gzip':
+        logfile = tmp_path / 'haproxy.log.gz'
+        logfile.write_bytes(gzip.compress(content))
+    elif source == 'stream':
+        logfile = io.BytesIO(content)
+    log_file = Log(logfile=logfile, raw_filters=('instance1', '"GET'))
+    lines = list(log_file)
+    assert [line.server_name for line in lines] == ['instance1', 'instance1']
+    assert log_file.valid_lines == 2
+
+
+def test_raw_filters_map_reduce():
+    """Check that raw filters do not change the results of the filters."""
+    cmds = [commands.Counter(), commands.ServerLoad()]
+    log_file = Log(logfile='tests/files/small.log', raw_filters=('/instance1',))
+    log_file.map_reduce(cmds, [('server', 'instance1')])
+    assert cmds[0].raw_results() == 4
+    assert cmds[1].raw_results() == {'instance1': 4}
+    assert log_file.valid_lines == 4
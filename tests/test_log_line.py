@@ -1,6 +1,11 @@
 from datetime import datetime
 from datetime import timedelta
+from haproxy.line import ACCEPT_DATE_FORMAT
+from haproxy.line import EPOCH
+from haproxy.line import Line
+from haproxy.line import parse_accept_date
 
+import pickle
 import pytest
 
 
@@ -204,3 +209,92 @@ def test_is_within_timeframe(line_factory, start, end, result):
     """Check that a line is within a given time frame."""
     line = line_factory(accept_date=NOW.strftime('%d/%b/%Y:%H:%M:%S.%f'))
     assert line.is_within_time_frame(start, end) is result
+
+
+def test_fields_projection(line_factory):
+    """Check that only the requested expensive attributes are decoded."""
+    raw_line = line_factory().raw_line
+    line = Line(raw_line, fields={'status_code'})
+    assert line.is_valid
+    assert line.status_code == '200'
+    assert line.accept_date is None
+    assert line.http_request_method is None
+    assert line.http_request_path is None
+
+
+@pytest.mark.parametrize(
+    ('fields', 'expected'),
+    [
+        ({'accept_date'}, 'accept_date'),
+        ({'http_request_path'}, 'http_request_path'),
+        ({'is_https'}, 'http_request_path'),
+    ],
+)
+def test_fields_projection_decodes_requested(line_factory, fields, expected):
+    """Check that requested attributes, or the ones properties use, are decoded."""
+    raw_line = line_factory().raw_line
+    line = Line(raw_line, fields=fields)
+    assert getattr(line, expected) is not None
+
+
+def test_accept_timestamp(line_factory):
+    """Check that the accept date is also given as milliseconds since the epoch."""
+    line = line_factory(accept_date='09/Dec/2013:12:59:46.633')
+    assert line.accept_timestamp == 1386593986633
+
+
+@pytest.mark.parametrize(
+    'raw_date',
+    [
+        '09/Dec/2013:12:59:46.633',
+        '09/Dec/2013:12:59:46.6',
+        '09/Dec/2013:12:59:46.123456',
+        '9/Dec/2013:1:5:4.1',
+        '09/dec/2013:12:59:46.633',
+    ],
+)
+def test_parse_accept_date(raw_date):
+    """Check that accept dates are parsed like strptime would do."""
+    expected = datetime.strptime(raw_date, ACCEPT_DATE_FORMAT)
+    # the second time the minute is already cached
+    for _ in range(2):
+        accept_date, accept_timestamp = parse_accept_date(raw_date)
+        assert accept_date == expected
+        assert accept_timestamp == (expected - EPOCH) // timedelta(milliseconds=1)
+
+
+@pytest.mark.parametrize(
+    ('raw_date', 'message'),
+    [
+        ('09/Dec/2013:12:59:60.633', 'second must be in 0..59'),
+        ('09/Dec/2013:12:59:46.1234567', 'unconverted data remains: 7'),
+        ('09/Dxc/2013:12:59:46.633', 'does not match format'),
+        ('31/Feb/2013:12:59:46.633', 'day is out of range for month'),
+        ('09/Dec/2013:12:59:46', 'does not match format'),
+    ],
+)
+def test_parse_accept_date_invalid(raw_date, message):
+    """Check that invalid accept dates raise the same errors strptime does."""
+    with pytest.raises(ValueError, match=message) as expected:
+        datetime.strptime(raw_date, ACCEPT_DATE_FORMAT)
+    with pytest.raises(ValueError, match=message) as error:
+        parse_accept_date(raw_date)
+    assert str(error.value) == str(expected.value)
+
+
+def test_no_instance_dict(line_factory):
+    """Check that lines do not carry a __dict__, to keep them small."""
+    line = line_factory()
+    assert not hasattr(line, '__dict__')
+    with pytest.raises(AttributeError):
+        line.not_an_attribute  # noqa: B018
+
+
+@pytest.mark.parametrize('fields', [None, {'status_code'}])
+def test_pickle(line_factory, fields):
+    """Check that lines survive being sent to and from other processes."""
+    line = Line(line_factory().raw_line, fields=fields)
+    unpickled = pickle.loads(pickle.dumps(line))
+    for name in Line.__slots__:
+        assert getattr(unpickled, name) == getattr(line, name)
+    assert unpickled.ip == line.ip
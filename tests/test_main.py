@@ -1,11 +1,16 @@
+from haproxy.logfile import Log
 from haproxy.main import create_parser
 from haproxy.main import main
 from haproxy.main import parse_arguments
+from haproxy.main import requested_fields
 from haproxy.utils import VALID_COMMANDS
 from haproxy.utils import VALID_FILTERS
 
+import io
 import pytest
+import re
 import sys
+import time
 
 
 PY310_OR_HIGHER = sys.version_info[1] > 9
@@ -17,7 +22,7 @@ def default_arguments():
     return {
         'start': None,
         'delta': None,
-        'log': 'tests/files/small.log',
+        'log': ['tests/files/small.log'],
         'commands': ['counter'],
         'negate_filter': None,
         'filters': None,
@@ -25,6 +30,22 @@ def default_arguments():
         'list_filters': False,
         'json': False,
         'invalid_lines': False,
+        'map_reduce': False,
+        'seek': False,
+        'index': False,
+        'cache': False,
+        'state': None,
+        'follow': False,
+        'interval': None,
+        'max_pending': None,
+        'workers': None,
+        'batch_size': None,
+        'engine': None,
+        'top': None,
+        'top_capacity': None,
+        'distinct': None,
+        'group_by': None,
+        'aggregates': None,
     }
 
 
@@ -90,6 +111,31 @@ def test_main_negate_filter(capsys, default_arguments):
     assert 'COUNTER\n=======\n5' in output_text
 
 
+@pytest.mark.parametrize('map_reduce', [False, True])
+def test_main_raw_filters(capsys, default_arguments, map_reduce):
+    """Check that lines skipped before being parsed do not change the results."""
+    default_arguments['filters'] = [
+        ('backend', 'default'),
+        ('status_code', '404'),
+        ('http_method', 'HEAD'),
+    ]
+    default_arguments['map_reduce'] = map_reduce
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert 'COUNTER\n=======\n2' in output_text
+
+
+def test_main_raw_filters_invalid_lines(capsys, default_arguments):
+    """Check that invalid lines are still shown along filtered lines."""
+    default_arguments['log'] = ['tests/files/2_ok_1_invalid.log']
+    default_arguments['filters'] = [('server', 'instance5')]
+    default_arguments['invalid_lines'] = True
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert 'default/instance6' in output_text
+    assert 'COUNTER\n=======\n1' in output_text
+
+
 def test_print_no_output(capsys, default_arguments):
     """Check that the print header is not shown."""
     default_arguments['commands'] = ['print']
@@ -105,3 +151,187 @@ def test_json_output(capsys, default_arguments):
     output_text = capsys.readouterr().out
     assert 'COUNTER\n=======\n9' not in output_text
     assert '{"COUNTER": 9}' in output_text
+
+
+@pytest.mark.parametrize(
+    ('commands', 'filters', 'expected'),
+    [
+        (['counter'], None, set()),
+        (['status_codes_counter'], None, {'status_code'}),
+        (['counter'], [('ip', '1.2.3.4')], {'ip'}),
+        (['queue_peaks', 'ip_counter'], None, {'accept_date', 'queue_backend', 'ip'}),
+        (['distinct_count'], None, {'ip'}),
+    ],
+)
+def test_requested_fields(default_arguments, commands, filters, expected):
+    """Check that the fields read by commands and filters are gathered."""
+    default_arguments['commands'] = commands
+    default_arguments['filters'] = filters
+    assert requested_fields(default_arguments) == expected
+
+
+def test_requested_fields_arguments(default_arguments):
+    """Check that the fields given as arguments to commands are gathered."""
+    default_arguments['commands'] = ['distinct_count']
+    default_arguments['distinct'] = 'http_request_path'
+    default_arguments['group_by'] = ['minute']
+    assert requested_fields(default_arguments) == {
+        'http_request_path',
+        'accept_timestamp',
+    }
+
+
+def test_main_map_reduce(capsys, default_arguments):
+    """Check that the work can be split between processes."""
+    default_arguments['map_reduce'] = True
+    default_arguments['filters'] = [
+        ('server', 'instance1'),
+    ]
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert 'COUNTER\n=======\n4' in output_text
+
+
+@pytest.mark.parametrize('map_reduce', [False, True])
+def test_main_many_log_files(capsys, default_arguments, map_reduce):
+    """Check that the results of many log files are merged."""
+    default_arguments['log'] = [
+        'tests/files/small.log',
+        'tests/files/2_ok_1_invalid.log',
+    ]
+    default_arguments['commands'] = ['counter', 'queue_peaks']
+    default_arguments['map_reduce'] = map_reduce
+    main(default_arguments)
+    assert 'COUNTER\n=======\n11' in capsys.readouterr().out
+
+
+def test_main_max_pending(capsys, default_arguments):
+    """Check that the amount of pending parts of the log file can be bounded."""
+    default_arguments['max_pending'] = 1
+    main(default_arguments)
+    assert 'COUNTER\n=======\n9' in capsys.readouterr().out
+
+
+def test_main_workers_batch_size(capsys, default_arguments, monkeypatch):
+    """Check that the amount of workers and lines sent at once can be given."""
+    with open('tests/files/small.log', 'rb') as file_obj:
+        content = file_obj.read()
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(content)))
+    default_arguments['log'] = ['-']
+    default_arguments['workers'] = 2
+    default_arguments['batch_size'] = 3
+    main(default_arguments)
+    assert 'COUNTER\n=======\n9' in capsys.readouterr().out
+
+
+def test_main_stdin(capsys, default_arguments, monkeypatch):
+    """Check that the log file can be read from the standard input."""
+    with open('tests/files/small.log', 'rb') as file_obj:
+        content = file_obj.read()
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(content)))
+    default_arguments['log'] = ['-']
+    main(default_arguments)
+    assert 'COUNTER\n=======\n9' in capsys.readouterr().out
+
+
+def test_main_state(capsys, default_arguments, tmp_path):
+    """Check that results are added up between runs saving their state."""
+    log_path = tmp_path / 'haproxy.log'
+    with open('tests/files/small.log') as file_obj:
+        lines = file_obj.readlines()
+    log_path.write_text(''.join(lines[:5]))
+    default_arguments['log'] = [str(log_path)]
+    default_arguments['state'] = str(tmp_path / 'state.json')
+
+    main(default_arguments)
+    assert 'COUNTER\n=======\n5' in capsys.readouterr().out
+
+    with open(log_path, 'a') as file_obj:
+        file_obj.write(''.join(lines[5:]))
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert 'COUNTER\n=======\n9' in output_text
+    assert f'to scan {len("".join(lines[5:]))} bytes' in output_text
+
+
+def test_main_follow(capsys, default_arguments, monkeypatch):
+    """Check that results are printed on every interval and when interrupted."""
+
+    def follow(log_file, timeout):
+        assert timeout == 0.5
+        yield from log_file
+        yield None
+        monkeypatch.setattr(time, 'monotonic', lambda: float('inf'))
+        yield None
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(Log, 'follow', follow)
+    default_arguments['follow'] = True
+    default_arguments['interval'] = 0.5
+    main(default_arguments)
+    assert capsys.readouterr().out.count('COUNTER\n=======\n9') == 2
+
+
+@pytest.mark.parametrize('map_reduce', [False, True])
+@pytest.mark.parametrize('top_capacity', [None, 0, 1])
+def test_main_top(capsys, default_arguments, map_reduce, top_capacity):
+    """Check that the amount of top values, and of values counted, can be given."""
+    default_arguments['commands'] = ['top_request_paths']
+    default_arguments['map_reduce'] = map_reduce
+    default_arguments['top'] = 2
+    default_arguments['top_capacity'] = top_capacity
+    main(default_arguments)
+    lines = capsys.readouterr().out.split('====\n')[1].strip().split('\n')
+    assert len(lines) == 2
+    if top_capacity == 1:
+        # counts may be overestimated, but the real one is within the error
+        match = re.match(
+            r'- /hello: (\d+)( \(overestimated by up to (\d+)\))?', lines[0]
+        )
+        count, error = int(match.group(1)), int(match.group(3) or 0)
+        assert count - error <= 3 <= count
+    else:
+        assert lines[0] == '- /hello: 3'
+
+
+@pytest.mark.parametrize('map_reduce', [False, True])
+def test_main_distinct_count(capsys, default_arguments, map_reduce):
+    """Check that distinct values can be counted per group of lines."""
+    default_arguments['commands'] = ['distinct_count']
+    default_arguments['map_reduce'] = map_reduce
+    default_arguments['distinct'] = 'http_request_path'
+    default_arguments['group_by'] = ['server_name']
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert (
+        '- server_name=instance1: 3\n'
+        '- server_name=instance2: 2\n'
+        '- server_name=instance3: 2\n'
+    ) in output_text
+
+
+@pytest.mark.parametrize('map_reduce', [False, True])
+def test_main_group_by(capsys, default_arguments, map_reduce):
+    """Check that lines can be aggregated per group in a single pass."""
+    default_arguments['commands'] = ['group_by']
+    default_arguments['map_reduce'] = map_reduce
+    default_arguments['group_by'] = ['status_code', 'http_request_method']
+    default_arguments['aggregates'] = [('count', None), ('max', 'time_wait_response')]
+    default_arguments['json'] = True
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert (
+        '{"GROUP_BY": ['
+        '{"status_code": "200", "http_request_method": "GET", "count": 2, '
+        '"max[time_wait_response]": 29408}, '
+        '{"status_code": "300", "http_request_method": "GET", "count": 2, '
+        '"max[time_wait_response]": 2936}, '
+        '{"status_code": "300", "http_request_method": "HEAD", "count": 1, '
+        '"max[time_wait_response]": 2942}, '
+        '{"status_code": "300", "http_request_method": "POST", "count": 1, '
+        '"max[time_wait_response]": 4}, '
+        '{"status_code": "404", "http_request_method": "HEAD", "count": 2, '
+        '"max[time_wait_response]": 20095}, '
+        '{"status_code": "404", "http_request_method": "POST", "count": 1, '
+        '"max[time_wait_response]": 94}]}'
+    ) in output_text
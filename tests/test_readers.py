@@ -0,0 +1,218 @@
+from haproxy import readers
+from haproxy.readers import bisect_lines
+from haproxy.readers import detect_compression
+from haproxy.readers import fingerprint
+from haproxy.readers import last_line_end
+from haproxy.readers import open_compressed
+from haproxy.readers import read_gzip_members
+from haproxy.readers import read_lines
+from haproxy.readers import read_range
+from haproxy.readers import split_gzip_members
+from haproxy.readers import split_ranges
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import pytest
+
+
+CONTENT = b'first line\nsecond\r\n\nfourth line is longer\nlast, no newline'
+
+
+@pytest.fixture()
+def log_path(tmp_path):
+    path = tmp_path / 'haproxy.log'
+    path.write_bytes(CONTENT)
+    return path
+
+
+@pytest.mark.parametrize('parts', [1, 2, 3, 4, 5, 10, 100])
+def test_split_ranges(log_path, parts):
+    """Check that ranges cover the whole file and start at line boundaries."""
+    ranges = split_ranges(log_path, parts)
+    assert len(ranges) <= parts
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(CONTENT)
+    for (_, previous_end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert previous_end == next_start
+        assert CONTENT[next_start - 1 : next_start] == b'\n'
+
+
+@pytest.mark.parametrize('parts', [1, 2, 3, 100])
+def test_split_ranges_start(log_path, parts):
+    """Check that ranges cover the file from the given offset onwards."""
+    start = CONTENT.index(b'fourth')
+    ranges = split_ranges(log_path, parts, start=start)
+    assert ranges[0][0] == start
+    assert ranges[-1][1] == len(CONTENT)
+    assert split_ranges(log_path, parts, start=len(CONTENT)) == []
+
+
+def test_split_ranges_empty_file(tmp_path):
+    """Check that empty files have no ranges at all."""
+    path = tmp_path / 'haproxy.log'
+    path.write_bytes(b'')
+    assert split_ranges(path, 4) == []
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 16, 1024])
+@pytest.mark.parametrize('parts', [1, 2, 3, 100])
+def test_read_range(log_path, monkeypatch, parts, chunk_size):
+    """Check that reading all ranges returns every line once, without newlines."""
+    monkeypatch.setattr(readers, 'CHUNK_SIZE', chunk_size)
+    lines = []
+    for range_start, range_end in split_ranges(log_path, parts):
+        lines.extend(read_range(log_path, range_start, range_end))
+    assert lines == [
+        'first line',
+        'second\r',
+        '',
+        'fourth line is longer',
+        'last, no newline',
+    ]
+
+
+@pytest.mark.parametrize('precision', [1, 10, 100, 10000])
+@pytest.mark.parametrize('wanted', [0, 1, 500, 998, 999, 2000])
+def test_bisect_lines(tmp_path, precision, wanted):
+    """Check that the offset found is a line boundary close to the wanted line."""
+    content = ''.join(f'{number}\n' for number in range(999)).encode()
+    path = tmp_path / 'haproxy.log'
+    path.write_bytes(content)
+
+    offset = bisect_lines(path, lambda line: int(line) < wanted, precision)
+    expected = content.index(f'{wanted}\n'.encode()) if wanted < 999 else len(content)
+    assert offset == 0 or content[offset - 1 : offset] == b'\n'
+    assert expected - precision - 4 <= offset <= expected
+
+
+def test_bisect_lines_undecided(tmp_path):
+    """Check that lines the callable can not tell about are skipped."""
+    content = ''.join(f'{number}\n' for number in range(100)).encode()
+    content = content.replace(b'5', b'x')
+    path = tmp_path / 'haproxy.log'
+    path.write_bytes(content)
+
+    def is_before(line):
+        if 'x' in line:
+            return None
+        return int(line) < 80
+
+    offset = bisect_lines(path, is_before, precision=1)
+    assert offset == content.index(b'79\n')
+
+
+def test_bisect_lines_empty_file(tmp_path):
+    """Check that empty files are read from the start."""
+    path = tmp_path / 'haproxy.log'
+    path.write_bytes(b'')
+    assert bisect_lines(path, lambda line: True) == 0
+
+
+@pytest.mark.parametrize(
+    ('content', 'expected'),
+    [(b'', 0), (b'no newline', 0), (b'one\ntwo', 4), (b'one\ntwo\n', 8)],
+)
+def test_last_line_end(tmp_path, content, expected):
+    """Check that incomplete lines at the end of a file are left out."""
+    path = tmp_path / 'haproxy.log'
+    path.write_bytes(content)
+    assert last_line_end(path) == expected
+
+
+def test_fingerprint(log_path):
+    """Check that only the start of the file is fingerprinted."""
+    assert fingerprint(log_path, 5) != fingerprint(log_path, 6)
+    before = fingerprint(log_path, len(CONTENT))
+    with open(log_path, 'ab') as file_obj:
+        file_obj.write(b'more lines\n')
+    assert fingerprint(log_path, len(CONTENT)) == before
+
+
+@pytest.mark.parametrize(
+    ('compress', 'expected'),
+    [
+        (gzip.compress, 'gzip'),
+        (bz2.compress, 'bz2'),
+        (lzma.compress, 'xz'),
+        (lambda content: content, None),
+    ],
+)
+def test_detect_compression(tmp_path, compress, expected):
+    """Check that compressed files are detected, and can be read, as such."""
+    path = tmp_path / 'haproxy.log'
+    path.write_bytes(compress(CONTENT))
+    assert detect_compression(path) == expected
+    if expected:
+        with open_compressed(path) as file_obj:
+            assert file_obj.read() == CONTENT
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1024])
+def test_read_lines(monkeypatch, chunk_size):
+    """Check that all lines are returned, without newlines."""
+    monkeypatch.setattr(readers, 'CHUNK_SIZE', chunk_size)
+    assert list(read_lines(io.BytesIO(CONTENT))) == [
+        'first line',
+        'second\r',
+        '',
+        'fourth line is longer',
+        'last, no newline',
+    ]
+
+
+def test_read_lines_pipe():
+    """Check that lines of pipes are returned without waiting for a whole chunk."""
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd, 'rb') as reader, os.fdopen(write_fd, 'wb') as writer:
+        writer.write(b'first line\nsecond')
+        writer.flush()
+        lines = read_lines(reader)
+        assert next(lines) == 'first line'
+        writer.write(b' line\n')
+        writer.close()
+        assert list(lines) == ['second line']
+
+
+@pytest.fixture()
+def gzip_path(tmp_path):
+    """A gzip file with a member for every 5 bytes, lines span members."""
+    path = tmp_path / 'haproxy.log.gz'
+    with open(path, 'wb') as file_obj:
+        for start in range(0, len(CONTENT), 5):
+            file_obj.write(gzip.compress(CONTENT[start : start + 5]))
+        file_obj.write(b'\x00' * 10)
+    return path
+
+
+@pytest.mark.parametrize('parts', [1, 2, 3, 5, 100])
+def test_split_gzip_members(gzip_path, parts):
+    """Check that ranges of gzip members decompress to the whole content."""
+    ranges = split_gzip_members(gzip_path, parts)
+    assert len(ranges) == min(parts, len(range(0, len(CONTENT), 5)))
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == gzip_path.stat().st_size
+    content = b''.join(
+        read_gzip_members(gzip_path, range_start, range_end)
+        for range_start, range_end in ranges
+    )
+    assert content == CONTENT
+
+
+def test_split_gzip_members_single(tmp_path):
+    """Check that single member files, with false magic bytes, are kept whole."""
+    path = tmp_path / 'haproxy.log.gz'
+    path.write_bytes(gzip.compress(CONTENT * 100 + b'\x1f\x8b\x08 within data'))
+    content = path.read_bytes()
+    path.write_bytes(content[:50] + b'\x1f\x8b\x08\x00' + content[50:])
+    assert split_gzip_members(path, 10) == [(0, path.stat().st_size)]
+
+
+def test_read_gzip_members_truncated(tmp_path):
+    """Check that truncated gzip members are reported."""
+    path = tmp_path / 'haproxy.log.gz'
+    path.write_bytes(gzip.compress(CONTENT)[:-5])
+    with pytest.raises(EOFError):
+        read_gzip_members(path, 0, path.stat().st_size)
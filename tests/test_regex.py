@@ -1,4 +1,5 @@
 from datetime import datetime
+from haproxy.line import _split_line
 from haproxy.line import HAPROXY_LINE_REGEX
 from haproxy.line import HTTP_REQUEST_REGEX
 
@@ -203,3 +204,58 @@ def test_http_request_regex(path):
     assert matches.group('method') == method
     assert matches.group('path') == path
     assert matches.group('protocol') == protocol
+
+
+@pytest.mark.parametrize(
+    'changes',
+    [
+        {},
+        {'client_ip': 'fe80::9379:c29e:6701:cef8'},
+        {'frontend_name': 'front/end', 'backend_name': 'back/end'},
+        {'tq': '-1', 'tw': '-1', 'tc': '-1', 'tr': '-1', 'tt': '+5'},
+        {'status': '-1', 'bytes': '+543', 'retries': '+3'},
+        {'headers': ''},
+        {'headers': ' {}'},
+        {'headers': ' {1.2.3.4, 5.6.7.8 | Mozilla}'},
+        {'headers': ' {something here} {and there}'},
+        {'http_request': '<BADREQ>'},
+        {'http_request': 'GET /here_or[here] HTTP/1.1'},
+        {'http_request': 'GET /georg}von{grote/ HTTP/1.1'},
+    ],
+)
+def test_split_line(line_factory, changes):
+    """Check that the fast path extracts the same values as the regex."""
+    line = line_factory(**changes)
+    matches = HAPROXY_LINE_REGEX.match(line.raw_line)
+
+    assert _split_line(line.raw_line) == matches.groupdict()
+
+
+def test_split_line_log_file():
+    """Check that the fast path extracts the same values as the regex on a log file."""
+    with open('tests/files/small.log') as log_file:
+        for raw_line in log_file:
+            raw_line = raw_line.strip()
+            matches = HAPROXY_LINE_REGEX.match(raw_line)
+            assert _split_line(raw_line) == matches.groupdict()
+
+
+@pytest.mark.parametrize(
+    'changes',
+    [
+        # the greedy groups on the regex swallow the extra whitespace
+        {'frontend_name': 'loadbalancer '},
+        {'server_name': 'instance8\t'},
+        # more quotes, brackets or curly brackets than expected
+        {'http_request': 'GET /"quoted" HTTP/1.1'},
+        {'headers': ' {[::1]:80}'},
+        {'headers': ' {a {b} c}'},
+        # not a log line at all
+        {'accept_date': ''},
+        {'bytes': 'wroooong'},
+    ],
+)
+def test_split_line_fallback(line_factory, changes):
+    """Check that the fast path leaves unusual lines to the regex."""
+    line = line_factory(**changes)
+    assert _split_line(line.raw_line) is None
@@ -0,0 +1,173 @@
+from collections import Counter
+from haproxy.sketches import Histogram
+from haproxy.sketches import HyperLogLog
+from haproxy.sketches import SpaceSaving
+
+import json
+import math
+import pytest
+import random
+
+
+def _exact_percentile(values, percent):
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+@pytest.mark.parametrize('percent', [0, 50, 90, 95, 99, 99.9, 100])
+def test_histogram_accuracy(percent):
+    """Check that percentiles are within the relative accuracy of the real ones."""
+    rng = random.Random(percent)
+    values = [int(rng.lognormvariate(5, 2)) for _ in range(20000)]
+    histogram = Histogram()
+    for value in values:
+        histogram.add(value)
+    expected = _exact_percentile(values, percent)
+    assert abs(histogram.percentile(percent) - expected) <= expected * 0.01 + 0.5
+
+
+def test_histogram_bounded():
+    """Check that the amount of buckets depends on the range of values only."""
+    histogram = Histogram()
+    for value in range(1, 24 * 60 * 60 * 1000, 997):
+        histogram.add(value)
+    assert len(histogram.buckets) <= 914
+
+
+def test_histogram_empty():
+    """Check that an empty histogram has no percentiles."""
+    histogram = Histogram()
+    assert histogram.percentile(50) is None
+    assert histogram.mean() == 0.0
+
+
+def test_histogram_zeros():
+    """Check that values of 0, or below, are counted apart."""
+    histogram = Histogram()
+    for value in (0, 0, 0, 10):
+        histogram.add(value)
+    assert histogram.percentile(50) == 0
+    assert histogram.percentile(100) == 10
+    assert histogram.mean() == 2.5
+
+
+def test_histogram_merge():
+    """Check that merging histograms gives the same as adding all values to one."""
+    values = list(range(0, 5000, 7))
+    expected = Histogram()
+    for value in values:
+        expected.add(value)
+    histogram = Histogram()
+    other = Histogram()
+    for value in values[:100]:
+        histogram.add(value)
+    for value in values[100:]:
+        other.add(value)
+    histogram.merge(other)
+    histogram.merge(Histogram())
+    assert histogram.to_state() == expected.to_state()
+
+
+def test_histogram_state():
+    """Check that histograms survive being serialized."""
+    histogram = Histogram(0.02)
+    for value in (3, 30, 300, 3000):
+        histogram.add(value)
+    state = json.loads(json.dumps(histogram.to_state()))
+    restored = Histogram.from_state(state)
+    assert restored.to_state() == histogram.to_state()
+    assert restored.percentile(75) == histogram.percentile(75)
+
+
+def _zipf_values(amount, seed=0):
+    rng = random.Random(seed)
+    return [f'/path/{int(rng.paretovariate(1))}' for _ in range(amount)]
+
+
+def test_space_saving_exact():
+    """Check that, without a capacity, all values are counted exactly."""
+    summary = SpaceSaving()
+    values = _zipf_values(5000)
+    for value in values:
+        summary.add(value)
+    expected = Counter(values).most_common(10)
+    assert [(value, count) for value, count, _ in summary.top(10)] == expected
+    assert all(error == 0 for _, _, error in summary.top(10))
+
+
+def test_space_saving_bounds():
+    """Check that counts are within their error of the real ones."""
+    summary = SpaceSaving(20)
+    values = _zipf_values(20000)
+    for value in values:
+        summary.add(value)
+    real = Counter(values)
+    assert len(summary.counters) <= 40
+    for value, count, error in summary.top(20):
+        assert count - error <= real[value] <= count
+    # the most frequent values are found
+    top = [value for value, _, _ in summary.top(5)]
+    assert top == [value for value, _ in real.most_common(5)]
+
+
+def test_space_saving_merge():
+    """Check that merged counts are within their error of the real ones."""
+    values = _zipf_values(20000, seed=1)
+    summaries = []
+    for part in (values[:5000], values[5000:]):
+        summary = SpaceSaving(20)
+        for value in part:
+            summary.add(value)
+        summaries.append(summary)
+    summary, other = summaries
+    summary.merge(other)
+    real = Counter(values)
+    assert len(summary.counters) <= 40
+    for value, count, error in summary.top(20):
+        assert count - error <= real[value] <= count
+
+
+def test_space_saving_state():
+    """Check that summaries survive being serialized."""
+    summary = SpaceSaving(2)
+    for value in 'abcabcaad':
+        summary.add(value)
+    state = json.loads(json.dumps(summary.to_state()))
+    restored = SpaceSaving.from_state(state)
+    assert restored.to_state() == summary.to_state()
+    assert restored.top(2) == summary.top(2)
+
+
+@pytest.mark.parametrize('amount', [0, 1, 10, 1000, 100000])
+def test_hyper_log_log_accuracy(amount):
+    """Check that the estimate is within three standard errors."""
+    estimate = HyperLogLog()
+    for _ in range(2):
+        for value in range(amount):
+            estimate.add(f'10.0.{value // 256}.{value % 256}')
+    assert abs(estimate.count() - amount) <= max(amount * 0.048, 1)
+    assert len(estimate.registers) == 4096
+
+
+def test_hyper_log_log_merge():
+    """Check that merging estimates gives the same as adding all values to one."""
+    expected = HyperLogLog()
+    estimate = HyperLogLog()
+    other = HyperLogLog()
+    for value in range(3000):
+        expected.add(value)
+        (estimate if value % 3 else other).add(value)
+    estimate.merge(other)
+    assert estimate.registers == expected.registers
+    assert abs(estimate.count() - 3000) <= 3000 * 0.048
+
+
+def test_hyper_log_log_state():
+    """Check that estimates survive being serialized."""
+    estimate = HyperLogLog(precision=8)
+    for value in ('a', 'b', 'c'):
+        estimate.add(value)
+    state = json.loads(json.dumps(estimate.to_state()))
+    restored = HyperLogLog.from_state(state)
+    assert restored.registers == estimate.registers
+    assert restored.count() == 3
@@ -0,0 +1,155 @@
+from datetime import datetime
+from datetime import timedelta
+from haproxy import timeindex
+from haproxy.engine import create_engine
+from haproxy.line import parse_line
+from haproxy.readers import read_range
+from haproxy.timeindex import TimeIndex
+
+import pytest
+
+
+FIRST_DATE = datetime(2013, 12, 9, 10)
+
+
+def _write_lines(file_path, line_factory, seconds, mode='w'):
+    """Write a log line for each of the given seconds after FIRST_DATE."""
+    with open(file_path, mode) as file_obj:
+        for second in seconds:
+            if second is None:
+                file_obj.write('not a valid line\n')
+                continue
+            accept_date = FIRST_DATE + timedelta(seconds=second)
+            accept_date = accept_date.strftime('%d/%b/%Y:%H:%M:%S.%f')[:-3]
+            file_obj.write(f'{line_factory(accept_date=accept_date).raw_line}\n')
+
+
+@pytest.fixture()
+def log_path(tmp_path, line_factory):
+    """A log file with a line every 15 seconds, some of them slightly reordered."""
+    file_path = tmp_path / 'haproxy.log'
+    seconds = list(range(0, 3600, 15))
+    for position in range(3, len(seconds), 10):
+        seconds[position], seconds[position + 1] = (
+            seconds[position + 1],
+            seconds[position],
+        )
+    seconds[20] = None
+    _write_lines(file_path, line_factory, seconds)
+    return file_path
+
+
+def _dates(log_path, range_start=0, range_end=None):
+    if range_end is None:
+        range_end = log_path.stat().st_size
+    return [
+        line.accept_date
+        for line in map(parse_line, read_range(log_path, range_start, range_end))
+        if line.is_valid
+    ]
+
+
+@pytest.mark.parametrize(
+    ('start', 'end'),
+    [
+        (None, None),
+        (None, 10),
+        (0, 1),
+        (0, 60),
+        (10, 20),
+        (15, 15),
+        (30, 90),
+        (59, 200),
+        (61, None),
+        (-10, -5),
+    ],
+)
+def test_byte_range(log_path, start, end):
+    """Check that the byte range has all the lines of the time frame."""
+    if start is not None:
+        start = FIRST_DATE + timedelta(minutes=start)
+    if end is not None:
+        end = FIRST_DATE + timedelta(minutes=end)
+    time_index = TimeIndex(log_path)
+    time_index.update()
+
+    range_start, range_end = time_index.byte_range(start, end)
+    expected = [
+        date
+        for date in _dates(log_path)
+        if (start is None or date >= start) and (end is None or date <= end)
+    ]
+    found = [
+        date
+        for date in _dates(log_path, range_start, range_end)
+        if (start is None or date >= start) and (end is None or date <= end)
+    ]
+    assert found == expected
+    if start is not None and end is not None and end - start <= timedelta(minutes=10):
+        assert (range_end - range_start) * 4 < log_path.stat().st_size
+
+
+def test_save_and_load(log_path):
+    """Check that indexes are kept next to the log file."""
+    time_index = TimeIndex(log_path)
+    assert time_index.update() is True
+    time_index.save()
+    assert time_index.path == f'{log_path}.hlaidx'
+
+    loaded = TimeIndex.load(log_path)
+    assert loaded.buckets == time_index.buckets
+    assert loaded.size == log_path.stat().st_size
+    assert loaded.update() is False
+
+
+@pytest.mark.parametrize('content', [None, 'not json', '{"version": 0}'])
+def test_load_unusable(log_path, content):
+    """Check that missing, broken or outdated indexes are ignored."""
+    if content is not None:
+        with open(f'{log_path}.hlaidx', 'w') as file_obj:
+            file_obj.write(content)
+    time_index = TimeIndex.load(log_path)
+    assert time_index.buckets == {}
+    assert time_index.size == 0
+
+
+def test_update_appended(log_path, line_factory):
+    """Check that only the lines appended to the log file are indexed."""
+    time_index = TimeIndex(log_path)
+    time_index.update()
+    size = time_index.size
+
+    _write_lines(log_path, line_factory, range(3600, 7200, 15), mode='a')
+    with open(log_path, 'a') as file_obj:
+        file_obj.write('an incomplete line')
+
+    assert time_index.update() is True
+    rebuilt = TimeIndex(log_path)
+    rebuilt.update()
+    assert time_index.buckets == rebuilt.buckets
+    assert size < time_index.size == log_path.stat().st_size - 18
+
+
+def test_update_replaced(log_path, line_factory):
+    """Check that the index is rebuilt when the log file is replaced."""
+    time_index = TimeIndex(log_path)
+    time_index.update()
+
+    _write_lines(log_path, line_factory, range(7200, 7200 * 3, 15))
+    time_index.update()
+    assert min(time_index.buckets) == (
+        FIRST_DATE + timedelta(hours=2) - timeindex.EPOCH
+    ) // timedelta(minutes=1)
+
+
+def test_update_parallel(log_path, monkeypatch):
+    """Check that indexing the log file in parallel gives the same index."""
+    time_index = TimeIndex(log_path)
+    time_index.update()
+
+    monkeypatch.setattr(timeindex, 'INDEX_RANGE_SIZE', 4096)
+    parallel = TimeIndex(log_path)
+    with create_engine('process', workers=2) as engine:
+        parallel.update(engine)
+    assert parallel.buckets == time_index.buckets
+    assert parallel.size == time_index.size
@@ -1,7 +1,9 @@
 from datetime import datetime
 from datetime import timedelta
+from haproxy.utils import compile_filters
 from haproxy.utils import date_str_to_datetime
 from haproxy.utils import delta_str_to_timedelta
+from haproxy.utils import raw_substrings
 from haproxy.utils import VALID_COMMANDS
 from haproxy.utils import VALID_FILTERS
 from haproxy.utils import validate_arg_date
@@ -77,3 +79,20 @@ def test_validate_delta(value, expected):
 
     else:
         assert validate_arg_delta(value) is None
+
+
+def test_raw_substrings():
+    """Check that only the filters declaring a raw substring are used."""
+    predicate = compile_filters(
+        [('backend', 'default'), ('slow_requests', '100'), ('status_code', '404')]
+    )
+    assert raw_substrings(predicate.filter_funcs) == ('default/', '404')
+
+
+def test_compile_filters():
+    """Check that filters are compiled along their cost, cheapest first."""
+    predicate = compile_filters(
+        [('ip', '1.2.3.4'), ('status_code', '404')], negate_filter=True
+    )
+    assert [cost for _, cost in predicate.clauses] == [1, 3]
+    assert predicate.negate is True